@@ -1,13 +1,8 @@
 import streamlit as st
-import sys, traceback, os, uuid, json, time, pathlib, hashlib
+import sys, traceback, os, time, hashlib
 from datetime import datetime
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-import requests
-import base64
 
 # ========== ALLERERSTER Streamlit-Befehl ==========
 st.set_page_config(
@@ -30,10 +25,19 @@ sys.excepthook = global_exception_handler
 
 # ========== MODULE IMPORTIEREN ==========
 try:
-    from ui_theme import inject_css, style_fig
-    from insights import build_insights
-    from charts import bar_grouped, donut_chart, tips_impact_chart, tips_savings_chart
+    from ui_theme import inject_css
+    from insights import build_insights, cache as insights_cache
+    from charts import (bar_grouped, donut_chart, tips_impact_chart, tips_savings_chart, line_chart, bar_chart,
+                        compare_bar, pie_chart, pie_pair, cache as figure_cache)
     from components import kpi_deck
+    import serialization
+    from ingest import read_all_metrics, build_thin_payload, MetricsCache, CACHE_ENTRIES, CACHE_DIR, CACHE_MAX_MB
+    from contract import DEFAULT_DATA, extract_business_data
+    from n8n_client import N8NClient, LastAnalysisCache, post_all_to_n8n_analyze, fetch_last_analysis, PAYLOAD_MODE
+    from history_columns import pick_grain
+    from history_store import (open_store, LOAD_LIMIT as HISTORY_LOAD_LIMIT, PAGE_SIZE as HISTORY_PAGE_SIZE,
+                               OVERVIEW_OPEN as HISTORY_OVERVIEW_OPEN, ROLLUP_AFTER as HISTORY_ROLLUP_AFTER)
+    from jobs import JobRunner, BACKGROUND as BACKGROUND_JOBS, POLL_SECONDS as JOB_POLL_SECONDS
 except Exception as e:
     st.error(f"❌ Fehler beim Import: {e}")
     st.code(traceback.format_exc())
@@ -72,24 +76,12 @@ TENANTS = {
     }
 }
 
-# ========== DEFAULT DATEN ==========
-DEFAULT_DATA = {
-    "belegt": 18, "frei": 6, "vertragsdauer_durchschnitt": 7.2, "reminder_automat": 15,
-    "social_facebook": 280, "social_google": 58, "belegungsgrad": 75,
-    "kundenherkunft": {"Online": 12, "Empfehlung": 6, "Vorbeikommen": 4},
-    "neukunden_labels": ["Jan", "Feb", "Mär", "Apr", "Mai", "Jun"],
-    "neukunden_monat": [5, 4, 7, 6, 8, 9],
-    "zahlungsstatus": {"bezahlt": 21, "offen": 2, "überfällig": 1},
-    "recommendations": [], "customer_message": ""
-}
-
 # ========== SESSION-STATE INITIALISIEREN ==========
 def init_session_state():
     defaults = {
         "current_data": DEFAULT_DATA.copy(),
         "before_analysis": None,
         "after_analysis": None,
-        "analyses_history": [],
         # Kein Vorgabewert. Die Backend-Adresse kommt ausschliesslich aus der
         # Umgebung. Ohne N8N_BASE_URL laeuft die App mit lokalen Beispieldaten.
         "n8n_base_url": os.environ.get("N8N_BASE_URL", ""),
@@ -97,7 +89,8 @@ def init_session_state():
         "show_comparison": False,
         "last_analysis_loaded": False,
         "logged_in": False,
-        "current_tenant": None
+        "current_tenant": None,
+        "analysis_job": None
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -105,201 +98,101 @@ def init_session_state():
 
 init_session_state()
 
-# ========== N8NResponseValidator ==========
-class N8NResponseValidator:
-    @staticmethod
-    def validate_response(response):
-        if not response:
-            return None, "Leere Response erhalten"
-        if isinstance(response, dict) and "data" in response:
-            data = response.get("data", {})
-            if isinstance(data, dict):
-                return data, None
-            return None, "Data-Feld ist kein Dictionary"
-        if isinstance(response, dict):
-            metrics = {}
-            if "metrics" in response:
-                metrics = response["metrics"]
-            elif "analysis_result" in response:
-                ar = response["analysis_result"]
-                if isinstance(ar, dict):
-                    metrics = ar.get("metrics", ar)
-            elif any(k in response for k in ["belegt", "frei", "belegungsgrad"]):
-                metrics = response
-            else:
-                return None, "Keine Metriken gefunden"
-            recommendations = response.get("recommendations", response.get("recommendation_list", []))
-            customer_message = response.get("customer_message", response.get("summary", ""))
-            analysis_date = response.get("analysis_date", response.get("timestamp", response.get("processed_at", datetime.now().isoformat())))
-            if isinstance(metrics, str):
-                try:
-                    metrics = json.loads(metrics)
-                except json.JSONDecodeError:
-                    return None, "Metrics ist ungültiger JSON-String"
-            return {
-                "metrics": metrics if isinstance(metrics, dict) else {},
-                "recommendations": recommendations if isinstance(recommendations, list) else [],
-                "customer_message": customer_message or "Analyse geladen",
-                "analysis_date": analysis_date
-            }, None
-        if isinstance(response, list):
-            if len(response) > 0:
-                return N8NResponseValidator.validate_response(response[0])
-            return None, "Leere Liste"
-        return None, f"Unbekanntes Response-Format: {type(response)}"
+# ========== GETEILTE RESSOURCEN ==========
+@st.cache_resource
+def get_metrics_cache():
+    # Ein Cache pro Serverprozess, geteilt über alle Sessions
+    return MetricsCache(max_entries=CACHE_ENTRIES, disk_dir=CACHE_DIR or None, disk_max_mb=CACHE_MAX_MB)
+
+@st.cache_resource
+def get_n8n_client():
+    # Ein Verbindungs-Pool pro Serverprozess statt neuer TCP/TLS-Verbindung je Aufruf
+    return N8NClient()
+
+@st.cache_resource
+def get_last_analysis_cache():
+    return LastAnalysisCache()
+
+@st.cache_resource
+def get_history_store():
+    # HISTORY_BACKEND: JSONL-Dateien je Tenant oder SQLite
+    return open_store()
+
+@st.cache_resource
+def get_job_runner():
+    # Begrenzter Pool für Analysen aller Sessions; schützt die Server-Threads
+    return JobRunner()
+
+def render_debug_panel():
+    with st.expander("Debug: Caches", expanded=False):
+        st.caption("Upload-Metriken")
+        st.json(get_metrics_cache().stats())
+        st.caption("n8n-Client")
+        st.json(get_n8n_client().stats())
+        st.caption("Letzte Analyse (get-last-analysis-only)")
+        st.json(get_last_analysis_cache().stats())
+        st.caption("Analyse-Jobs")
+        st.json(get_job_runner().stats())
+        st.caption("History-Speicher")
+        st.json(get_history_store().stats())
+        st.caption("Lokale Empfehlungen (build_insights)")
+        st.json(insights_cache.stats())
+        st.caption("Grafiken")
+        st.json(figure_cache.stats())
+
+# ========== GRAFIKEN ==========
+def show_chart(builder, *args, **kwargs):
+    """
+    Zeigt builder(*args, **kwargs) über die volle Breite. Die fertige Figur kommt aus dem
+    Figur-Cache: bei unveränderten Daten wird sie nicht neu gebaut und gestylt. Als Figur
+    (nicht als dict) übergeben, damit st.plotly_chart sie nicht erneut validiert.
+    """
+    st.plotly_chart(figure_cache.figure(builder, *args, **kwargs), use_container_width=True)
+
+# ========== SEITEN-ABSCHNITTE ==========
+# st.fragment (Streamlit >= 1.37, siehe requirements.txt): ein Widget im Abschnitt führt nur
+# diesen Abschnitt neu aus. Abschnitte bekommen keine Argumente: ein Fragment-Rerun nutzt die
+# Argumente des letzten vollen Laufs weiter, also Eingaben im Abschnitt aus st.session_state lesen.
+fragment = st.fragment
+
+def section_memo(name: str, key, compute):
+    """Ergebnis von compute() je Session; neu berechnet nur, wenn sich key (die Eingaben) ändert."""
+    memo = st.session_state.setdefault("section_memo", {})
+    cached = memo.get(name)
+    if key is not None and cached is not None and cached[0] == key:
+        return cached[1]
+    value = compute()
+    memo[name] = (key, value)
+    return value
 
 # ========== PERSISTENTE HISTORY ==========
-def save_history_to_disk(tenant_id: str, history: list):
+def append_history_to_disk(tenant_id: str, entry: dict):
     try:
-        path = pathlib.Path(f".history_{tenant_id}.json")
-        path.write_text(json.dumps(history, ensure_ascii=False, indent=2))
+        get_history_store().append(tenant_id, entry)
     except Exception as e:
         print(f"History speichern fehlgeschlagen: {e}")
 
-def load_history_from_disk(tenant_id: str) -> list:
+def clear_history_on_disk(tenant_id: str):
     try:
-        path = pathlib.Path(f".history_{tenant_id}.json")
-        if path.exists():
-            return json.loads(path.read_text())
+        get_history_store().clear(tenant_id)
     except Exception as e:
-        print(f"History laden fehlgeschlagen: {e}")
-    return []
-
-def extract_business_data(contract: dict) -> dict:
-    data = contract.get("data", {})
-    result = DEFAULT_DATA.copy()
-    metrics = data.get("metrics", {})
-    if isinstance(metrics, str):
-        try:
-            metrics = json.loads(metrics)
-        except json.JSONDecodeError:
-            metrics = {}
-    if not metrics or (isinstance(metrics, dict) and len(metrics) == 0):
-        for key in ["belegt", "frei", "belegungsgrad", "vertragsdauer_durchschnitt",
-                     "reminder_automat", "social_facebook", "social_google"]:
-            if key in data and data[key] is not None:
-                metrics[key] = data[key]
-        for special in ["kundenherkunft", "zahlungsstatus"]:
-            if special in data and isinstance(data[special], dict):
-                metrics[special] = data[special]
-    def safe_num(v):
-        if isinstance(v, (int, float)):
-            return v
-        try:
-            return float(v)
-        except:
-            return v
-    for key in result:
-        if key in metrics:
-            result[key] = safe_num(metrics[key])
-    for special in ["kundenherkunft", "zahlungsstatus"]:
-        if special in metrics:
-            result[special] = metrics[special]
-    result["recommendations"] = data.get("recommendations", [])
-    result["customer_message"] = data.get("customer_message", "")
-    result["analysis_date"] = data.get("analysis_date", datetime.now().isoformat())
-    return result
-
-def parse_supabase_response(response_data):
-    if isinstance(response_data, list):
-        if len(response_data) == 0:
-            return {"status": "success", "count": 0, "data": DEFAULT_DATA.copy()}
-        valid_rows = sorted(
-            [r for r in response_data if isinstance(r, dict)],
-            key=lambda r: r.get('created_at', r.get('updated_at', '')),
-            reverse=True
-        )
-        valid_rows = [r for r in valid_rows if not r.get('_for_supabase')]
-        best_row = None
-        for row in valid_rows:
-            ar = row.get('analysis_result')
-            if ar and ar != 'undefined' and ar is not None:
-                try:
-                    parsed = json.loads(ar) if isinstance(ar, str) else ar
-                    if isinstance(parsed, dict) and isinstance(parsed.get('metrics'), dict) and len(parsed.get('metrics', {})) > 0:
-                        best_row = row
-                        break
-                except:
-                    pass
-        if best_row is None:
-            for row in valid_rows:
-                ar = row.get('analysis_result')
-                if ar and ar != 'undefined' and ar is not None:
-                    best_row = row
-                    break
-        if best_row is None:
-            return {"status": "success", "count": 0, "data": DEFAULT_DATA.copy()}
-        ar = best_row.get('analysis_result')
-        if ar and ar not in ('undefined', None):
-            try:
-                analysis_data = json.loads(ar) if isinstance(ar, str) else ar
-                return {
-                    "status": "success",
-                    "tenant_id": best_row.get('tenant_id'),
-                    "count": 1,
-                    "data": {
-                        "metrics": analysis_data.get('metrics', {}),
-                        "recommendations": analysis_data.get('recommendations', []),
-                        "customer_message": analysis_data.get('customer_message', ''),
-                        "analysis_date": analysis_data.get('analysis_date', best_row.get('created_at', ''))
-                    }
-                }
-            except:
-                pass
-    if isinstance(response_data, dict):
-        if 'data' in response_data:
-            return response_data
-        ar = response_data.get('analysis_result')
-        if ar and ar not in ('undefined', None):
-            try:
-                analysis_data = json.loads(ar) if isinstance(ar, str) else ar
-                return {
-                    "status": "success",
-                    "tenant_id": response_data.get('tenant_id'),
-                    "count": 1,
-                    "data": {
-                        "metrics": analysis_data.get('metrics', {}),
-                        "recommendations": analysis_data.get('recommendations', []),
-                        "customer_message": analysis_data.get('customer_message', ''),
-                        "analysis_date": analysis_data.get('analysis_date', '')
-                    }
-                }
-            except:
-                pass
-    return {"status": "error", "message": "Unbekanntes Format", "data": DEFAULT_DATA.copy()}
-
-def post_to_n8n_analyze(base_url, tenant_id, uuid_str, file_info):
-    url = f"{base_url.rstrip('/')}/analyze-with-deepseek"
-    filename, file_content, file_type = file_info
-    base64_content = base64.b64encode(file_content).decode('utf-8')
-    payload = {
-        "tenant_id": tenant_id,
-        "uuid": uuid_str,
-        "action": "analyze_with_deepseek",
-        "file": {"filename": filename, "content_type": file_type, "data": base64_content},
-        "metadata": {"source": "streamlit", "timestamp": datetime.now().isoformat()}
-    }
-    headers = {'Content-Type': 'application/json'}
+        print(f"History löschen fehlgeschlagen: {e}")
+
+def query_history(method: str, tenant_id: str, *args, fallback=None, **kwargs):
+    # Seiten fragen nur ab, was sie anzeigen (count, latest, range, metric_series);
+    # die History liegt nicht mehr im Session-State
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=120)
-        if response.status_code != 200:
-            return {"status": "error", "message": f"HTTP {response.status_code}"}
-        json_response = response.json()
-        if isinstance(json_response, dict) and "status" in json_response:
-            standardized = json_response
-        else:
-            validated_data, error = N8NResponseValidator.validate_response(json_response)
-            if validated_data:
-                standardized = {"status": "success", "data": validated_data}
-            else:
-                standardized = {"status": "error", "data": {}}
-        return {
-            "status": "success",
-            "message": "Analyse erfolgreich",
-            "data": standardized.get("data", {}) if standardized.get("status") == "success" else None
-        }
+        return getattr(get_history_store(), method)(tenant_id, *args, **kwargs)
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        print(f"History lesen fehlgeschlagen: {e}")
+    return fallback
+
+def fetch_last_analysis_contract(n8n_base_url, tenant_id):
+    contract, raw = fetch_last_analysis(get_n8n_client(), get_last_analysis_cache(), n8n_base_url, tenant_id)
+    if raw is not None and st.session_state.debug_mode:
+        with st.expander("Debug: Raw Supabase Response"):
+            st.json(raw)
+    return contract
 
 def load_last_analysis():
     if not st.session_state.logged_in:
@@ -312,20 +205,11 @@ def load_last_analysis():
         return True
     with st.spinner("Lade letzte Analyse..."):
         try:
-            response = requests.post(
-                f"{n8n_base_url.rstrip('/')}/get-last-analysis-only",
-                json={"tenant_id": tenant_id, "uuid": str(uuid.uuid4())},
-                timeout=10
-            )
-            if response.status_code != 200:
+            contract = fetch_last_analysis_contract(n8n_base_url, tenant_id)
+            if contract is None:
                 st.info("Keine vorherige Analyse gefunden.")
                 st.session_state.current_data = DEFAULT_DATA.copy()
                 return True
-            supabase_data = response.json()
-            if st.session_state.debug_mode:
-                with st.expander("Debug: Raw Supabase Response"):
-                    st.json(supabase_data)
-            contract = parse_supabase_response(supabase_data)
             data_field = contract.get('data', {})
             metrics = data_field.get('metrics', {})
             has_real_metrics = isinstance(metrics, dict) and len(metrics) > 0
@@ -351,50 +235,6 @@ def load_last_analysis():
             st.session_state.current_data = DEFAULT_DATA.copy()
             return False
 
-def extract_metrics_from_excel(df):
-    metrics = {}
-    try:
-        if 'belegt' in df.columns:
-            metrics['belegt'] = int(df['belegt'].sum())
-        if 'frei' in df.columns:
-            metrics['frei'] = int(df['frei'].sum())
-        if 'belegt' in metrics and 'frei' in metrics:
-            total = metrics['belegt'] + metrics['frei']
-            if total > 0:
-                metrics['belegungsgrad'] = round((metrics['belegt'] / total) * 100, 1)
-        for col in ['vertragsdauer_durchschnitt', 'reminder_automat', 'social_facebook', 'social_google']:
-            if col in df.columns:
-                metrics[col] = float(df[col].mean())
-        herkunft_cols = [c for c in df.columns if 'herkunft' in c.lower()]
-        if herkunft_cols:
-            counts = df[herkunft_cols[0]].value_counts().to_dict()
-            metrics['kundenherkunft'] = {'Online': counts.get('Online', 0), 'Empfehlung': counts.get('Empfehlung', 0), 'Vorbeikommen': counts.get('Vorbeikommen', 0)}
-        status_cols = [c for c in df.columns if 'status' in c.lower()]
-        if status_cols:
-            counts = df[status_cols[0]].value_counts().to_dict()
-            metrics['zahlungsstatus'] = {'bezahlt': counts.get('bezahlt', 0), 'offen': counts.get('offen', 0), 'überfällig': counts.get('überfällig', 0)}
-    except Exception as e:
-        st.warning(f"Excel-Warnung: {str(e)[:80]}")
-    return metrics
-
-def merge_data(base_dict, new_dict):
-    result = base_dict.copy() if base_dict else {}
-    if new_dict:
-        for key, value in new_dict.items():
-            if key not in ['kundenherkunft', 'zahlungsstatus', 'recommendations', 'customer_message']:
-                result[key] = value
-        if 'kundenherkunft' in new_dict:
-            if 'kundenherkunft' not in result:
-                result['kundenherkunft'] = {'Online': 0, 'Empfehlung': 0, 'Vorbeikommen': 0}
-            for k, v in new_dict['kundenherkunft'].items():
-                result['kundenherkunft'][k] = result['kundenherkunft'].get(k, 0) + v
-        if 'zahlungsstatus' in new_dict:
-            if 'zahlungsstatus' not in result:
-                result['zahlungsstatus'] = {'bezahlt': 0, 'offen': 0, 'überfällig': 0}
-            for k, v in new_dict['zahlungsstatus'].items():
-                result['zahlungsstatus'][k] = result['zahlungsstatus'].get(k, 0) + v
-    return result
-
 def generate_fallback_recommendations(tenant_name, data):
     recs = []
     if data.get('belegungsgrad', 0) > 80:
@@ -416,27 +256,95 @@ def perform_analysis(uploaded_files):
     tenant_id = st.session_state.current_tenant['tenant_id']
     tenant_name = st.session_state.current_tenant['name']
     st.session_state.before_analysis = st.session_state.current_data.copy()
-    excel_data = {}
-    for excel_file in [f for f in uploaded_files if f.name.lower().endswith((".xlsx", ".xls", ".csv"))]:
-        try:
-            df = pd.read_csv(excel_file) if excel_file.name.endswith('.csv') else pd.read_excel(excel_file)
-            excel_data = merge_data(excel_data, extract_metrics_from_excel(df))
-        except Exception as e:
-            st.warning(f"Konnte {excel_file.name} nicht lesen: {str(e)[:50]}")
+    excel_data, excel_per_file = read_all_metrics(uploaded_files, cache=get_metrics_cache(), per_file=True)
     n8n_base_url = st.session_state.n8n_base_url
     if not n8n_base_url:
         st.error("Bitte n8n Basis-URL in der Sidebar eingeben")
         return
-    main_file = uploaded_files[0]
-    file_info = (main_file.name, main_file.getvalue(), main_file.type)
+    # getvalue() gibt die Upload-Bytes ohne Kopie zurück; getbuffer() würde den geteilten Puffer kopieren
+    files_info = [(f.name, f.getvalue(), f.type) for f in uploaded_files]
+    thins = [None] * len(uploaded_files)
+    if PAYLOAD_MODE == "thin":
+        for i, (f, metrics) in enumerate(zip(uploaded_files, excel_per_file)):
+            if not metrics:
+                continue
+            try:
+                thins[i] = build_thin_payload(f, metrics)
+            except Exception as e:
+                st.warning(f"Thin-Payload für {f.name} nicht möglich, sende ganze Datei: {str(e)[:50]}")
+    job = {
+        "tenant_id": tenant_id,
+        "tenant_name": tenant_name,
+        "files": [f.name for f in uploaded_files],
+        "excel_data": excel_data,
+        "base_url": n8n_base_url
+    }
+    if BACKGROUND_JOBS:
+        job_id = get_job_runner().submit(post_all_to_n8n_analyze, n8n_base_url, tenant_id, files_info, get_n8n_client(), thins)
+        if job_id is None:
+            st.error("Server ausgelastet – bitte in einigen Sekunden erneut versuchen.")
+            return
+        st.session_state.analysis_job = {**job, "id": job_id, "started": time.time()}
+        st.rerun()
     with st.spinner("KI analysiert Daten... (dies kann 30-60 Sekunden dauern)"):
-        result = post_to_n8n_analyze(n8n_base_url, tenant_id, str(uuid.uuid4()), file_info)
+        result = post_all_to_n8n_analyze(n8n_base_url, tenant_id, files_info, get_n8n_client(), thins)
+    finish_analysis(job, result)
+
+def poll_analysis_job():
+    """
+    Übernimmt das Ergebnis eines fertigen Hintergrund-Jobs der Session; läuft in main() vor jeder
+    Seite. True, solange er noch läuft (dann zeigt render_job_status den Fortschritt).
+    """
+    job = st.session_state.get("analysis_job")
+    if not job:
+        return False
+    runner = get_job_runner()
+    status = runner.status(job["id"])
+    if status == "running":
+        render_job_status()
+        return True
+    st.session_state.analysis_job = None
+    if status == "unknown":
+        st.warning("Analyse-Job nicht mehr auffindbar (Server neu gestartet?).")
+        return False
+    try:
+        result = runner.pop_result(job["id"])
+    except Exception as e:
+        result = {"status": "error", "message": str(e)}
+    finish_analysis(job, result)
+    return False
+
+@fragment(run_every=JOB_POLL_SECONDS)
+def render_job_status():
+    """
+    Fortschritt des laufenden Jobs, alle JOB_POLL_SECONDS neu ausgeführt, ohne den Skript-Thread
+    schlafen zu lassen. Ist der Job fertig, startet ein voller Lauf, der das Ergebnis übernimmt.
+    """
+    job = st.session_state.get("analysis_job")
+    if not job:
+        return
+    if get_job_runner().status(job["id"]) != "running":
+        st.rerun()
+    elapsed = int(time.time() - job["started"])
+    st.info(f"⏳ KI analysiert {len(job['files'])} Datei(en)... ({elapsed} s)")
+
+def finish_analysis(job, result):
+    """Übernimmt das n8n-Ergebnis in Session, History und Vergleich (nur im Skript-Thread)."""
+    tenant_id = job["tenant_id"]
+    tenant_name = job["tenant_name"]
+    excel_data = job["excel_data"]
     if st.session_state.debug_mode:
         with st.expander("Debug: n8n Kommunikation", expanded=False):
             st.write(f"Status: {result['status']}")
             st.write(f"Message: {result.get('message')}")
+            if result.get('files'):
+                st.dataframe(pd.DataFrame(result['files']), use_container_width=True)
             if result.get('data'):
                 st.json(result['data'])
+    failed_files = [f for f in result.get('files', []) if f['status'] != 'success']
+    if failed_files and result['status'] == 'success':
+        for f in failed_files:
+            st.warning(f"⚠️ {f['file']}: {f['message']}")
     if result['status'] == 'success' and result.get('data'):
         n8n_data = result['data']
         final_metrics = {}
@@ -455,21 +363,22 @@ def perform_analysis(uploaded_files):
         final_data["customer_message"] = n8n_data.get("customer_message", f"Analyse für {tenant_name} abgeschlossen.")
         final_data["analysis_date"] = n8n_data.get("analysis_date", datetime.now().isoformat())
         final_data["tenant_id"] = tenant_id
-        final_data["files"] = [f.name for f in uploaded_files]
+        final_data["files"] = list(job["files"])
         final_data["source"] = "n8n_ai"
         st.session_state.after_analysis = final_data.copy()
         st.session_state.current_data = final_data.copy()
         history_entry = {
             "ts": datetime.now().isoformat(),
             "data": final_data.copy(),
-            "files": [f.name for f in uploaded_files],
+            "files": list(job["files"]),
             "tenant_id": tenant_id,
             "tenant_name": tenant_name,
             "type": "ai_analysis",
             "source": "n8n"
         }
-        st.session_state.analyses_history.append(history_entry)
-        save_history_to_disk(tenant_id, st.session_state.analyses_history)
+        append_history_to_disk(tenant_id, history_entry)
+        # n8n hat jetzt einen neueren Stand als der Cache
+        get_last_analysis_cache().invalidate((job["base_url"].rstrip('/'), tenant_id))
         if 'analyses_used' in st.session_state.current_tenant:
             st.session_state.current_tenant['analyses_used'] += 1
         st.success(f"✅ KI-Analyse erfolgreich für {tenant_name}!")
@@ -487,21 +396,20 @@ def perform_analysis(uploaded_files):
             final_data["customer_message"] = f"Analyse basierend auf Excel-Daten für {tenant_name}"
             final_data["analysis_date"] = datetime.now().isoformat()
             final_data["tenant_id"] = tenant_id
-            final_data["files"] = [f.name for f in uploaded_files]
+            final_data["files"] = list(job["files"])
             final_data["source"] = "excel_fallback"
             st.session_state.after_analysis = final_data.copy()
             st.session_state.current_data = final_data.copy()
             history_entry = {
                 "ts": datetime.now().isoformat(),
                 "data": final_data.copy(),
-                "files": [f.name for f in uploaded_files],
+                "files": list(job["files"]),
                 "tenant_id": tenant_id,
                 "tenant_name": tenant_name,
                 "type": "excel_analysis",
                 "source": "fallback"
             }
-            st.session_state.analyses_history.append(history_entry)
-            save_history_to_disk(tenant_id, st.session_state.analyses_history)
+            append_history_to_disk(tenant_id, history_entry)
             st.success(f"✅ Excel-Analyse erfolgreich für {tenant_name}!")
             st.session_state.show_comparison = True
         else:
@@ -556,10 +464,11 @@ def render_overview():
         display_date = current_date[:10] if current_date else "Keine"
         st.info(f"Letzte Analyse: {display_date}")
     st.header("Neue Analyse durchführen")
+    job_running = bool(st.session_state.get("analysis_job"))
     uploaded_files = st.file_uploader("Dateien hochladen (Excel/CSV)", type=["xlsx", "xls", "csv"], accept_multiple_files=True, key="file_uploader")
     col1, col2 = st.columns(2)
     with col1:
-        analyze_btn = st.button("KI-Analyse starten", type="primary", use_container_width=True, disabled=not uploaded_files)
+        analyze_btn = st.button("KI-Analyse starten", type="primary", use_container_width=True, disabled=not uploaded_files or job_running)
     with col2:
         if st.button("Letzte Analyse neu laden", use_container_width=True):
             load_last_analysis()
@@ -569,146 +478,167 @@ def render_overview():
     if analyze_btn and uploaded_files:
         perform_analysis(uploaded_files)
     if st.session_state.get('show_comparison') and st.session_state.before_analysis and st.session_state.after_analysis:
-        st.header("Vergleich: Vorher vs. Nachher")
-        before = st.session_state.before_analysis
-        after = st.session_state.after_analysis
-        st.subheader("Key Performance Indicators")
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            delta = float(after.get('belegungsgrad', 0) or 0) - float(before.get('belegungsgrad', 0) or 0)
-            st.metric("Belegungsgrad", f"{float(after.get('belegungsgrad', 0) or 0)}%", f"{delta:+.1f}%")
-        with col2:
-            delta = float(after.get('vertragsdauer_durchschnitt', 0) or 0) - float(before.get('vertragsdauer_durchschnitt', 0) or 0)
-            st.metric("Ø Vertragsdauer", f"{float(after.get('vertragsdauer_durchschnitt', 0) or 0):.1f} Monate", f"{delta:+.1f}")
-        with col3:
-            delta = after.get('belegt', 0) - before.get('belegt', 0)
-            st.metric("Belegte Einheiten", after.get('belegt', 0), f"{int(delta):+d}")
-        with col4:
-            before_social = int(before.get('social_facebook', 0) or 0) + int(before.get('social_google', 0) or 0)
-            after_social = int(after.get('social_facebook', 0) or 0) + int(after.get('social_google', 0) or 0)
-            st.metric("Social Engagement", after_social, f"{after_social - before_social:+.0f}")
-        st.subheader("Detail-Vergleich")
-        col1, col2 = st.columns(2)
-        with col1:
-            fig = go.Figure(data=[
-                go.Bar(name='Vorher', x=['Vorher'], y=[before.get('belegungsgrad', 0)], marker_color='#3B82F6'),
-                go.Bar(name='Nachher', x=['Nachher'], y=[after.get('belegungsgrad', 0)], marker_color='#8B5CF6')
-            ])
-            fig = style_fig(fig, "Belegungsgrad (%)", 300)
-            st.plotly_chart(fig, use_container_width=True)
-            if 'kundenherkunft' in before and 'kundenherkunft' in after:
-                fig = make_subplots(rows=1, cols=2, subplot_titles=('Vorher', 'Nachher'), specs=[[{'type': 'domain'}, {'type': 'domain'}]])
-                fig.add_trace(go.Pie(labels=list(before['kundenherkunft'].keys()), values=list(before['kundenherkunft'].values()), name="Vorher"), 1, 1)
-                fig.add_trace(go.Pie(labels=list(after['kundenherkunft'].keys()), values=list(after['kundenherkunft'].values()), name="Nachher"), 1, 2)
-                fig = style_fig(fig, "Kundenherkunft", 300)
-                st.plotly_chart(fig, use_container_width=True)
-        with col2:
-            if 'zahlungsstatus' in before and 'zahlungsstatus' in after:
-                categories = list(before['zahlungsstatus'].keys())
-                fig = go.Figure(data=[
-                    go.Bar(name='Vorher', x=categories, y=[before['zahlungsstatus'][k] for k in categories], marker_color='#3B82F6'),
-                    go.Bar(name='Nachher', x=categories, y=[after['zahlungsstatus'][k] for k in categories], marker_color='#8B5CF6')
-                ])
-                fig = style_fig(fig, 'Zahlungsstatus Vergleich', 300)
-                fig.update_layout(barmode='group')
-                st.plotly_chart(fig, use_container_width=True)
-        recommendations = after.get('recommendations', [])
-        local_tips = build_insights(after)
-        if recommendations:
-            st.subheader("KI-Empfehlungen")
-            for i, rec in enumerate(recommendations[:5], 1):
-                st.markdown(f"**{i}.** {rec}")
-        if local_tips:
-            st.subheader("📊 Lokale Analyse-Empfehlungen")
-            for tip in local_tips[:4]:
-                with st.expander(f"💡 {tip['title']} | Impact: {tip['impact_score']}/10 | ~{tip['savings_eur']:.0f}€/Monat"):
-                    st.write(tip["analysis"])
-                    for action in tip["actions"]:
-                        st.markdown(f"- {action}")
-        if local_tips:
-            col_a, col_b = st.columns(2)
-            with col_a:
-                st.plotly_chart(tips_impact_chart(local_tips), use_container_width=True)
-            with col_b:
-                st.plotly_chart(tips_savings_chart(local_tips), use_container_width=True)
-        if after.get('customer_message'):
-            with st.expander("Zusammenfassung"):
-                st.info(after['customer_message'])
+        render_comparison_section()
     else:
-        data = st.session_state.current_data
-        st.subheader("Aktuelle KPIs")
-        kpi_deck([
-            {"label": "Belegungsgrad", "value": f"{data.get('belegungsgrad', 0)}%"},
-            {"label": "Ø Vertragsdauer", "value": f"{data.get('vertragsdauer_durchschnitt', 0)} Monate"},
-            {"label": "Belegte Einheiten", "value": str(data.get('belegt', 0))},
-            {"label": "Social Engagement", "value": str(data.get('social_facebook', 0) + data.get('social_google', 0))},
-        ])
-        local_tips = build_insights(data)
-        if local_tips and not data.get("recommendations"):
-            st.subheader("📊 Handlungsempfehlungen")
-            for tip in local_tips[:3]:
-                with st.expander(f"💡 {tip['title']} | Impact: {tip['impact_score']}/10 | ~{tip['savings_eur']:.0f}€/Monat"):
-                    st.write(tip["analysis"])
-                    for action in tip["actions"]:
-                        st.markdown(f"- {action}")
-        if local_tips:
-            col_a, col_b = st.columns(2)
-            with col_a:
-                st.plotly_chart(tips_impact_chart(local_tips), use_container_width=True)
-            with col_b:
-                st.plotly_chart(tips_savings_chart(local_tips), use_container_width=True)
-        st.subheader("Aktuelle Visualisierungen")
-        col1, col2 = st.columns(2)
-        with col1:
-            belegung = data.get('belegungsgrad', 0)
-            fig = donut_chart(belegung, "Belegungsgrad")
-            st.plotly_chart(fig, use_container_width=True)
-        with col2:
-            if 'kundenherkunft' in data:
-                df = pd.DataFrame({"Kanal": list(data['kundenherkunft'].keys()), "Anzahl": list(data['kundenherkunft'].values())})
-                fig = px.pie(df, values='Anzahl', names='Kanal')
-                fig = style_fig(fig, "Kundenherkunft", 300)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                labels = data.get('neukunden_labels', ['Jan', 'Feb', 'Mär', 'Apr', 'Mai', 'Jun'])
-                values = data.get('neukunden_monat', [5, 4, 7, 6, 8, 9])
-                min_len = min(len(labels), len(values))
-                fig = go.Figure(data=[go.Bar(x=labels[:min_len], y=values[:min_len])])
-                fig = style_fig(fig, "Neukunden pro Monat", 300)
-                st.plotly_chart(fig, use_container_width=True)
+        render_current_section()
+    render_history_section()
+
+@fragment
+def render_comparison_section():
+    before, after = st.session_state.before_analysis, st.session_state.after_analysis
+    st.header("Vergleich: Vorher vs. Nachher")
+    st.subheader("Key Performance Indicators")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        delta = float(after.get('belegungsgrad', 0) or 0) - float(before.get('belegungsgrad', 0) or 0)
+        st.metric("Belegungsgrad", f"{float(after.get('belegungsgrad', 0) or 0)}%", f"{delta:+.1f}%")
+    with col2:
+        delta = float(after.get('vertragsdauer_durchschnitt', 0) or 0) - float(before.get('vertragsdauer_durchschnitt', 0) or 0)
+        st.metric("Ø Vertragsdauer", f"{float(after.get('vertragsdauer_durchschnitt', 0) or 0):.1f} Monate", f"{delta:+.1f}")
+    with col3:
+        delta = after.get('belegt', 0) - before.get('belegt', 0)
+        st.metric("Belegte Einheiten", after.get('belegt', 0), f"{int(delta):+d}")
+    with col4:
+        before_social = int(before.get('social_facebook', 0) or 0) + int(before.get('social_google', 0) or 0)
+        after_social = int(after.get('social_facebook', 0) or 0) + int(after.get('social_google', 0) or 0)
+        st.metric("Social Engagement", after_social, f"{after_social - before_social:+.0f}")
+    st.subheader("Detail-Vergleich")
+    col1, col2 = st.columns(2)
+    with col1:
+        show_chart(compare_bar, before.get('belegungsgrad', 0), after.get('belegungsgrad', 0), title="Belegungsgrad (%)")
+        if 'kundenherkunft' in before and 'kundenherkunft' in after:
+            show_chart(pie_pair, before['kundenherkunft'], after['kundenherkunft'], title="Kundenherkunft")
+    with col2:
+        if 'zahlungsstatus' in before and 'zahlungsstatus' in after:
+            categories = list(before['zahlungsstatus'].keys())
+            show_chart(bar_grouped, categories, [before['zahlungsstatus'][k] for k in categories],
+                       [after['zahlungsstatus'][k] for k in categories], title='Zahlungsstatus Vergleich', h=300)
+    recommendations = after.get('recommendations', [])
+    local_tips = build_insights(after)
+    if recommendations:
+        st.subheader("KI-Empfehlungen")
+        for i, rec in enumerate(recommendations[:5], 1):
+            st.markdown(f"**{i}.** {rec}")
+    if local_tips:
+        st.subheader("📊 Lokale Analyse-Empfehlungen")
+        for tip in local_tips[:4]:
+            with st.expander(f"💡 {tip['title']} | Impact: {tip['impact_score']}/10 | ~{tip['savings_eur']:.0f}€/Monat"):
+                st.write(tip["analysis"])
+                for action in tip["actions"]:
+                    st.markdown(f"- {action}")
+    if local_tips:
+        col_a, col_b = st.columns(2)
+        with col_a:
+            show_chart(tips_impact_chart, local_tips)
+        with col_b:
+            show_chart(tips_savings_chart, local_tips)
+    if after.get('customer_message'):
+        with st.expander("Zusammenfassung"):
+            st.info(after['customer_message'])
+
+@fragment
+def render_current_section():
+    data = st.session_state.current_data
+    st.subheader("Aktuelle KPIs")
+    kpi_deck([
+        {"label": "Belegungsgrad", "value": f"{data.get('belegungsgrad', 0)}%"},
+        {"label": "Ø Vertragsdauer", "value": f"{data.get('vertragsdauer_durchschnitt', 0)} Monate"},
+        {"label": "Belegte Einheiten", "value": str(data.get('belegt', 0))},
+        {"label": "Social Engagement", "value": str(data.get('social_facebook', 0) + data.get('social_google', 0))},
+    ])
+    local_tips = build_insights(data)
+    if local_tips and not data.get("recommendations"):
+        st.subheader("📊 Handlungsempfehlungen")
+        for tip in local_tips[:3]:
+            with st.expander(f"💡 {tip['title']} | Impact: {tip['impact_score']}/10 | ~{tip['savings_eur']:.0f}€/Monat"):
+                st.write(tip["analysis"])
+                for action in tip["actions"]:
+                    st.markdown(f"- {action}")
+    if local_tips:
+        col_a, col_b = st.columns(2)
+        with col_a:
+            show_chart(tips_impact_chart, local_tips)
+        with col_b:
+            show_chart(tips_savings_chart, local_tips)
+    st.subheader("Aktuelle Visualisierungen")
+    col1, col2 = st.columns(2)
+    with col1:
+        belegung = data.get('belegungsgrad', 0)
+        show_chart(donut_chart, belegung, "Belegungsgrad")
+    with col2:
+        if 'kundenherkunft' in data:
+            herkunft = data['kundenherkunft']
+            show_chart(pie_chart, list(herkunft.keys()), list(herkunft.values()), 'Kanal', "Kundenherkunft")
+        else:
+            labels = data.get('neukunden_labels', ['Jan', 'Feb', 'Mär', 'Apr', 'Mai', 'Jun'])
+            values = data.get('neukunden_monat', [5, 4, 7, 6, 8, 9])
+            min_len = min(len(labels), len(values))
+            show_chart(bar_chart, labels[:min_len], values[:min_len], "Neukunden pro Monat")
+
+@fragment
+def render_history_section():
+    tenant_id = st.session_state.current_tenant['tenant_id']
     st.header("Analyse-History")
-    tenant_history = [h for h in st.session_state.analyses_history if h.get('tenant_id') == tenant['tenant_id']]
-    if tenant_history:
-        st.subheader("Entwicklung über Zeit")
-        col1, col2 = st.columns(2)
-        with col1:
-            dates, vals = [], []
-            for h in sorted(tenant_history, key=lambda x: x['ts']):
-                dates.append(h['ts'][:10])
-                vals.append(h['data'].get('belegungsgrad', 0))
-            fig = go.Figure(data=[go.Scatter(x=dates, y=vals, mode='lines+markers')])
-            fig = style_fig(fig, "Belegungsgrad (%)", 300)
-            st.plotly_chart(fig, use_container_width=True)
-        with col2:
-            dates, vals = [], []
-            for h in sorted(tenant_history, key=lambda x: x['ts']):
-                dates.append(h['ts'][:10])
-                vals.append(h['data'].get('vertragsdauer_durchschnitt', 0))
-            fig = go.Figure(data=[go.Scatter(x=dates, y=vals, mode='lines+markers')])
-            fig = style_fig(fig, "Vertragsdauer (Monate)", 300)
-            st.plotly_chart(fig, use_container_width=True)
-        history_df = []
-        for entry in reversed(tenant_history[-10:]):
-            history_df.append({
-                'Datum': entry.get('ts', '')[:16].replace('T', ' '),
-                'Dateien': len(entry.get('files', [])),
-                'Belegungsgrad': f"{entry['data'].get('belegungsgrad', 0)}%",
-                'Empfehlungen': len(entry['data'].get('recommendations', []))
-            })
-        if history_df:
-            st.dataframe(pd.DataFrame(history_df), use_container_width=True)
-    else:
+    # Gleicher History-Stand = gleiche Abfrageergebnisse; None (Fehler) rechnet jedes Mal neu
+    version = query_history("version", tenant_id)
+    key = (tenant_id, version) if version is not None else None
+    count = section_memo("history_count", key, lambda: query_history("count", tenant_id, fallback=0))
+    if not count:
         st.info("Noch keine Analysen durchgeführt. Starten Sie Ihre erste KI-Analyse!")
+        return
+    # Unterhalb der Falz: Grafiken und Tabelle erst laden, wenn sie jemand sehen will
+    # Eigener Session-Schlüssel statt key=: Widget-State verfällt, solange eine andere Seite offen ist
+    show = st.toggle("Verlauf anzeigen", value=st.session_state.get("history_overview_open", HISTORY_OVERVIEW_OPEN))
+    st.session_state.history_overview_open = show
+    st.caption(f"{count} gespeicherte Analysen")
+    if not show:
+        return
+    view = section_memo("history_view", key, lambda: history_overview(tenant_id, count))
+    st.subheader("Entwicklung über Zeit")
+    col1, col2 = st.columns(2)
+    with col1:
+        x, y, grain = view["belegungsgrad"]
+        show_chart(line_chart, x, y, f"Belegungsgrad (%){grain}")
+    with col2:
+        x, y, grain = view["vertragsdauer_durchschnitt"]
+        show_chart(line_chart, x, y, f"Vertragsdauer (Monate){grain}")
+    if view["table"] is not None:
+        st.dataframe(view["table"], use_container_width=True)
+
+GRAIN_LABELS = {"day": "Tagesmittel", "week": "Wochenmittel", "month": "Monatsmittel"}
+
+def history_overview(tenant_id: str, count: int) -> dict:
+    """
+    Verlaufsreihen (x, y, Titelzusatz) und die Tabelle der letzten 10 Analysen. Ohne
+    HISTORY_LOAD_LIMIT und ab HISTORY_ROLLUP_AFTER Analysen zeigen die Grafiken Mittelwerte je
+    Tag, Woche oder Monat (die feinste Stufe mit höchstens so vielen Buckets) aus den Rollups.
+    """
+    view = {}
+    for metric in ('belegungsgrad', 'vertragsdauer_durchschnitt'):
+        table = None
+        if HISTORY_ROLLUP_AFTER and not HISTORY_LOAD_LIMIT and count > HISTORY_ROLLUP_AFTER:
+            table = query_history("rollup", tenant_id, metric, "month")
+            grain = "month" if table is None else pick_grain(table, HISTORY_ROLLUP_AFTER)
+            if grain != "month":
+                table = query_history("rollup", tenant_id, metric, grain)
+        if table is not None:
+            # Reicht auch die Monatsstufe nicht, nur die letzten Monate
+            table = table[-HISTORY_ROLLUP_AFTER:]
+            view[metric] = (table['start'].astype('datetime64[D]'), table['sum'] / table['count'], f" – {GRAIN_LABELS[grain]}")
+            continue
+        # Spalten-Arrays direkt an Plotly, auf den Tag gekürzt
+        ts, vals = query_history("metric_series", tenant_id, metric, limit=HISTORY_LOAD_LIMIT or None, fallback=([], []))
+        view[metric] = (np.asarray(ts, dtype='datetime64[D]'), np.asarray(vals, dtype=np.float64), "")
+    history_df = []
+    for entry in query_history("latest", tenant_id, 10, fallback=[]):
+        history_df.append({
+            'Datum': entry.get('ts', '')[:16].replace('T', ' '),
+            'Dateien': len(entry.get('files', [])),
+            'Belegungsgrad': f"{entry['data'].get('belegungsgrad', 0)}%",
+            'Empfehlungen': len(entry['data'].get('recommendations', []))
+        })
+    view["table"] = pd.DataFrame(history_df) if history_df else None
+    return view
 
 def render_customers():
     st.title("Kundenanalyse")
@@ -743,9 +673,7 @@ def render_customers():
             with col1:
                 st.dataframe(pd.DataFrame({"Kanal": list(herkunft.keys()), "Anzahl": list(herkunft.values())}), use_container_width=True)
             with col2:
-                fig = px.pie(pd.DataFrame({"Kanal": list(herkunft.keys()), "Anzahl": list(herkunft.values())}), values='Anzahl', names='Kanal')
-                fig = style_fig(fig, "Kundenherkunft", 300)
-                st.plotly_chart(fig, use_container_width=True)
+                show_chart(pie_chart, list(herkunft.keys()), list(herkunft.values()), 'Kanal', "Kundenherkunft")
         else:
             st.info("Keine Kundendaten verfügbar. Führen Sie eine Analyse durch.")
 
@@ -766,7 +694,8 @@ def render_capacity():
             st.metric("Belegte Einheiten", after.get('belegt', 0))
             st.metric("Freie Einheiten", after.get('frei', 0))
             st.metric("Belegungsgrad", f"{after.get('belegungsgrad', 0)}%")
-        fig = bar_grouped(
+        show_chart(
+            bar_grouped,
             ['Belegt', 'Frei'],
             [before.get('belegt', 0), before.get('frei', 0)],
             [after.get('belegt', 0), after.get('frei', 0)],
@@ -774,7 +703,6 @@ def render_capacity():
             title='Kapazitätsverteilung Vergleich',
             h=400
         )
-        st.plotly_chart(fig, use_container_width=True)
     else:
         col1, col2 = st.columns(2)
         with col1:
@@ -782,9 +710,7 @@ def render_capacity():
             st.metric("Freie Einheiten", data.get("frei", 0))
             st.metric("Belegungsgrad", f"{data.get('belegungsgrad', 0)}%")
         with col2:
-            fig = go.Figure(data=[go.Bar(x=["Belegt", "Frei"], y=[data.get("belegt", 0), data.get("frei", 0)])])
-            fig = style_fig(fig, "Kapazitätsverteilung", 300)
-            st.plotly_chart(fig, use_container_width=True)
+            show_chart(bar_chart, ["Belegt", "Frei"], [data.get("belegt", 0), data.get("frei", 0)], "Kapazitätsverteilung")
 
 def render_finance():
     st.title("Finanzübersicht")
@@ -819,9 +745,7 @@ def render_finance():
                 total = sum(status.values())
                 moral = (status.get('bezahlt', 0) / total * 100) if total > 0 else 0
                 st.metric("Zahlungsmoral", f"{moral:.1f}%")
-                fig = px.pie(pd.DataFrame({"Status": list(status.keys()), "Anzahl": list(status.values())}), values='Anzahl', names='Status')
-                fig = style_fig(fig, "Zahlungsstatus", 300)
-                st.plotly_chart(fig, use_container_width=True)
+                show_chart(pie_chart, list(status.keys()), list(status.values()), 'Status', "Zahlungsstatus")
         else:
             st.info("Keine Finanzdaten verfügbar.")
 
@@ -837,6 +761,10 @@ def render_system():
     with col2:
         st.info(f"Abo-Plan: {tenant['plan'].upper()}")
         st.info(f"Analysen genutzt: {tenant.get('analyses_used', 0)}/{tenant.get('analyses_limit', '∞')}")
+    # Anzahl und letzte Einträge einmal je History-Stand (wie die Übersicht); None rechnet neu
+    version = query_history("version", tenant['tenant_id'])
+    history_key = (tenant['tenant_id'], version) if version is not None else None
+    history_count = section_memo("history_count", history_key, lambda: query_history("count", tenant['tenant_id'], fallback=0))
     st.header("Daten exportieren")
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -845,23 +773,29 @@ def render_system():
     with col2:
         if st.session_state.get('show_comparison') and st.session_state.before_analysis:
             comparison_data = {'vorher': st.session_state.before_analysis, 'nachher': st.session_state.after_analysis, 'vergleich_datum': datetime.now().isoformat()}
-            st.download_button("Vergleich (JSON)", json.dumps(comparison_data, indent=2, ensure_ascii=False), f"storage_comparison_{tenant['tenant_id']}_{datetime.now().strftime('%Y%m%d')}.json", "application/json", use_container_width=True)
+            st.download_button("Vergleich (JSON)", serialization.dumps(comparison_data, pretty=True), f"storage_comparison_{tenant['tenant_id']}_{datetime.now().strftime('%Y%m%d')}.json", "application/json", use_container_width=True)
         else:
             st.button("Vergleich (JSON)", disabled=True, use_container_width=True, help="Kein Vergleich verfügbar.")
     with col3:
-        tenant_history = [h for h in st.session_state.analyses_history if h.get('tenant_id') == tenant['tenant_id']]
-        if tenant_history:
-            st.download_button("Gesamte History (JSON)", json.dumps(tenant_history, indent=2, ensure_ascii=False), f"storage_history_{tenant['tenant_id']}_{datetime.now().strftime('%Y%m%d')}.json", "application/json", use_container_width=True)
+        if history_count:
+            # Die ganze History wird erst auf Klick gelesen und serialisiert, nicht bei jedem Rerun
+            if st.button("History exportieren", use_container_width=True):
+                export = query_history("load", tenant['tenant_id'], limit=HISTORY_LOAD_LIMIT or None, fallback=[])
+                st.download_button("Gesamte History (JSON)", serialization.dumps(export, pretty=True), f"storage_history_{tenant['tenant_id']}_{datetime.now().strftime('%Y%m%d')}.json", "application/json", use_container_width=True)
         else:
             st.button("History (JSON)", disabled=True, use_container_width=True, help="Keine History verfügbar")
     st.header("Analyserverlauf")
-    tenant_history = [h for h in st.session_state.analyses_history if h.get('tenant_id') == tenant['tenant_id']]
-    if tenant_history:
-        history_options = [f"{h['ts'][:16]} - {len(h.get('files', []))} Dateien" for h in reversed(tenant_history)]
-        selected = st.selectbox("Analyse auswählen", history_options, key="history_select")
+    if history_count:
+        recent = section_memo("history_recent", history_key, lambda: query_history("latest", tenant['tenant_id'], HISTORY_PAGE_SIZE, fallback=[]))
+        # Beschriftung -> Eintrag; bei gleicher Beschriftung gilt wie bisher der neueste
+        history_options = {}
+        for h in recent:
+            history_options.setdefault(f"{h['ts'][:16]} - {len(h.get('files', []))} Dateien", h)
+        if history_count > len(recent):
+            st.caption(f"Die letzten {len(recent)} von {history_count} Analysen")
+        selected = st.selectbox("Analyse auswählen", list(history_options), key="history_select")
         if selected:
-            idx = history_options.index(selected)
-            selected_entry = list(reversed(tenant_history))[idx]
+            selected_entry = history_options[selected]
             with st.expander("Analyse-Details", expanded=True):
                 st.write(f"Datum: {selected_entry['ts'][:19]}")
                 st.write(f"Dateien: {', '.join(selected_entry.get('files', []))}")
@@ -877,8 +811,7 @@ def render_system():
                     time.sleep(1)
                     st.rerun()
         if st.button("History löschen", type="secondary"):
-            st.session_state.analyses_history = [h for h in st.session_state.analyses_history if h.get('tenant_id') != tenant['tenant_id']]
-            save_history_to_disk(tenant['tenant_id'], [])
+            clear_history_on_disk(tenant['tenant_id'])
             st.session_state.current_data = DEFAULT_DATA.copy()
             st.session_state.show_comparison = False
             st.success("History gelöscht!")
@@ -887,7 +820,7 @@ def render_system():
         st.info("Noch keine Analysen für diesen Tenant")
     st.header("Systeminformation")
     col1, col2, col3, col4 = st.columns(4)
-    with col1: st.metric("Analysen gesamt", len(tenant_history))
+    with col1: st.metric("Analysen gesamt", history_count)
     with col2: st.metric("Vergleich aktiv", "Ja" if st.session_state.get('show_comparison') else "Nein")
     with col3: st.metric("Debug-Modus", "Aktiv" if st.session_state.debug_mode else "Inaktiv")
     with col4: st.metric("n8n Basis-URL", "Gesetzt" if st.session_state.n8n_base_url else "Fehlt")
@@ -911,7 +844,6 @@ def main():
                 if email in TENANTS and TENANTS[email]["password_hash"] == entered_hash:
                     st.session_state.logged_in = True
                     st.session_state.current_tenant = {k: v for k, v in TENANTS[email].items() if k != "password_hash"}
-                    st.session_state.analyses_history = load_history_from_disk(TENANTS[email]["tenant_id"])
                     load_success = load_last_analysis()
                     if load_success:
                         st.success(f"Willkommen, {TENANTS[email]['name']}!")
@@ -930,6 +862,7 @@ def main():
             if st.button("Abmelden", use_container_width=True):
                 st.session_state.logged_in = False
                 st.session_state.current_tenant = None
+                st.session_state.analysis_job = None
                 st.rerun()
         st.divider()
         if st.session_state.logged_in:
@@ -940,6 +873,8 @@ def main():
                 st.caption(f"GET-LAST: `{n8n_base_url.rstrip('/')}/get-last-analysis-only`")
                 st.caption(f"ANALYZE: `{n8n_base_url.rstrip('/')}/analyze-with-deepseek`")
             st.session_state.debug_mode = st.checkbox("Debug-Modus")
+            if st.session_state.debug_mode:
+                render_debug_panel()
             st.divider()
             st.subheader("Navigation")
             page = st.radio("Menü", ["Übersicht", "Kunden", "Kapazität", "Finanzen", "System"], key="nav_radio")
@@ -959,6 +894,8 @@ def main():
     if not st.session_state.logged_in:
         render_login_page()
     else:
+        # Hintergrund-Job auf jeder Seite verfolgen, nicht nur in der Übersicht
+        poll_analysis_job()
         if page == "Übersicht": render_overview()
         elif page == "Kunden": render_customers()
         elif page == "Kapazität": render_capacity()
@@ -0,0 +1,112 @@
+"""
+Nutzlast gegen Treue beim Ausdünnen langer Kennzahl-Reihen.
+
+Erzeugt eine Belegungsreihe (Zufallspfad mit einzelnen Ausreißern) in mehreren Längen,
+dünnt sie je Punktbudget mit charts.downsample aus und baut die Figur wie line_chart.
+Gemeldet werden je Kombination:
+
+    ms        Ausdünnen und Serialisieren (figure_spec)
+    kb / gz   Größe der Figur-Spezifikation roh und gzip-komprimiert
+    err       mittlere Abweichung der linear interpolierten Linie, in % der Wertespanne
+    max       größte Abweichung, in % der Wertespanne
+    peaks     Anteil der eingestreuten Ausreißer, die als Punkt erhalten bleiben
+
+    python bench/bench_charts.py
+    python bench/bench_charts.py --sizes 10000,100000 --budgets 500,2000 --methods lttb --json
+"""
+import argparse, gzip, json, os, sys, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plotly.graph_objects as go
+
+import charts
+from charts import downsample, figure_spec, style_fig
+
+METHODS = ("none", "lttb", "minmax")
+
+
+def make_series(n, seed=7):
+    """Tageswerte ab 2000 mit Belegung in Prozent; jeder ~500. Punkt ist ein Ausreißer (Maske)."""
+    rng = np.random.default_rng(seed)
+    x = np.datetime64("2000-01-01") + np.arange(n).astype("timedelta64[D]")
+    y = 70 + np.cumsum(rng.normal(0, 0.4, n))
+    spikes = rng.random(n) < 0.002
+    y[spikes] += rng.choice((-1, 1), spikes.sum()) * rng.uniform(10, 25, spikes.sum())
+    return x, np.clip(y, 0, 100), spikes
+
+
+def build_spec(x, y):
+    """Wie charts.line_chart, nur ohne eigenes Ausdünnen."""
+    trace = go.Scattergl if len(y) > charts.CHART_WEBGL_POINTS else go.Scatter
+    fig = go.Figure(data=[trace(x=x, y=y, mode='lines+markers')])
+    return figure_spec(style_fig(fig, "Belegungsgrad (%)", 300))
+
+
+def fidelity(x, y, spikes, xs, ys):
+    """Abweichung der ausgedünnten Linie an allen Originalpunkten und erhaltene Ausreißer."""
+    xi, xsi = x.astype(np.int64), xs.astype(np.int64)
+    span = float(y.max() - y.min()) or 1.0
+    diff = np.abs(y - np.interp(xi, xsi, ys)) / span * 100
+    kept = np.isin(x[spikes], xs).mean() if spikes.any() else 1.0
+    return float(diff.mean()), float(diff.max()), float(kept)
+
+
+def run_case(x, y, spikes, method, budget, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        xs, ys = (x, y) if method == "none" else downsample(x, y, budget, method)
+        spec = build_spec(xs, ys)
+        times.append(time.perf_counter() - started)
+    err, max_err, peaks = fidelity(x, y, spikes, xs, ys)
+    raw = spec.encode("utf-8")
+    return {
+        "points": len(ys),
+        "webgl": len(ys) > charts.CHART_WEBGL_POINTS,
+        "ms": round(min(times) * 1000, 2),
+        "kb": round(len(raw) / 1024, 1),
+        "gz_kb": round(len(gzip.compress(raw, 6)) / 1024, 1),
+        "err_pct": round(err, 3),
+        "max_err_pct": round(max_err, 2),
+        "peaks": round(peaks, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ausdünnen langer Reihen: Nutzlast gegen Treue")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Kommagetrennte Reihenlängen")
+    parser.add_argument("--budgets", default="500,1000,2000", help="Kommagetrennte Punktbudgets")
+    parser.add_argument("--methods", default=",".join(METHODS))
+    parser.add_argument("--repeat", type=int, default=3, help="Wiederholungen je Messung (bestes Ergebnis)")
+    parser.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    budgets = [int(b) for b in args.budgets.split(",") if b.strip()]
+    methods = [m.strip() for m in args.methods.split(",") if m.strip()]
+    report = []
+    for size in sizes:
+        x, y, spikes = make_series(size)
+        for method in methods:
+            if method not in METHODS:
+                parser.error(f"Unbekannte Methode {method}")
+            # Ohne Ausdünnen spielt das Budget keine Rolle
+            for budget in ([0] if method == "none" else budgets):
+                result = run_case(x, y, spikes, method, budget, args.repeat)
+                result.update(size=size, method=method, budget=budget)
+                report.append(result)
+                if not args.json:
+                    gl = "gl" if result["webgl"] else "  "
+                    print(f"n={size:<7} {method:6} budget={budget:<5} pts={result['points']:<7}{gl} "
+                          f"{result['ms']:8.1f} ms  {result['kb']:8.1f} kB  gz {result['gz_kb']:7.1f} kB  "
+                          f"err={result['err_pct']:6.3f} %  max={result['max_err_pct']:6.2f} %  "
+                          f"peaks={result['peaks']:.2f}")
+    if args.json:
+        print(json.dumps({"webgl_points": charts.CHART_WEBGL_POINTS, "results": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""
+Micro-Benchmarks der Parse- und Auswertungspfade mit synthetischen Eingaben.
+
+    python bench/bench_micro.py                      # Standardgrößen, Vergleich mit Baseline
+    python bench/bench_micro.py --preset quick       # kleine Größen, für schnelle Runden
+    python bench/bench_micro.py --preset full --save # inkl. 5 Mio. Excel-Zeilen, Baseline schreiben
+    python bench/bench_micro.py --only parse_supabase --json
+
+Baselines liegen als JSON unter bench/baselines/micro-<preset>.json (nicht im Repository,
+mit --save auf der eigenen Maschine erzeugen). Liegt eine vor,
+wird jeder Fall damit verglichen; ist die beste Laufzeit mehr als --threshold langsamer,
+gilt das als Regression und das Skript endet mit Exit-Code 1. Baselines sind nur auf
+derselben Maschine aussagekräftig; abweichende Umgebung wird angezeigt.
+"""
+import argparse, atexit, gc, json, os, platform, shutil, statistics, sys, tempfile, time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from contract import N8NResponseValidator, extract_business_data, parse_supabase_response, parse_supabase_stream
+from data_utils import extract_json_from_markdown_debug
+from ingest import HERKUNFT_KEYS, STATUS_KEYS, extract_metrics_from_excel, merge_data
+from history_store import HistoryStore, SqliteHistoryStore
+from history_columns import pick_grain
+from insights import build_insights, build_insights_batch
+from charts import FigureCache, donut_chart, figure_spec, line_chart, pie_chart, tips_impact_chart, tips_savings_chart
+from n8n_stub import shape_analyze
+import serialization
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+# Mindestdauer einer Messreihe; schnelle Fälle werden entsprechend oft wiederholt
+MIN_ROUND_SECONDS = 0.1
+REPEATS = 7
+
+
+# ========== SYNTHETISCHE EINGABEN ==========
+def make_analysis(rng, recommendations=5):
+    return {
+        "metrics": {
+            "belegt": int(rng.integers(0, 500)), "frei": int(rng.integers(0, 200)),
+            "belegungsgrad": float(rng.uniform(40, 100)), "vertragsdauer_durchschnitt": float(rng.uniform(1, 24)),
+            "reminder_automat": int(rng.integers(0, 50)), "social_facebook": int(rng.integers(0, 900)),
+            "social_google": int(rng.integers(0, 200)),
+            "kundenherkunft": {k: int(rng.integers(0, 50)) for k in HERKUNFT_KEYS},
+            "zahlungsstatus": {k: int(rng.integers(0, 50)) for k in STATUS_KEYS},
+        },
+        "recommendations": [f"Empfehlung {i}" for i in range(recommendations)],
+        "customer_message": "Synthetische Analyse",
+        "analysis_date": "2026-04-01T12:00:00",
+    }
+
+
+def make_supabase_rows(n, seed=1):
+    """Supabase-Zeilen wie von get-last-analysis-only: überwiegend unbrauchbar, die neuesten zuerst leer."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        row = {"tenant_id": "bench", "created_at": f"2026-01-01T00:00:00.{i:06d}"}
+        if i % 5 == 0:
+            row["analysis_result"] = json.dumps(make_analysis(rng), ensure_ascii=False)
+        elif i % 5 == 1:
+            row.update({"_for_supabase": True, "analysis_result": "{}"})
+        else:
+            row["analysis_result"] = "undefined"
+        rows.append(row)
+    return rows
+
+
+def make_history(n, seed=8, step_hours=None):
+    """Analyse-History wie in .history_<tenant>.jsonl bzw. der SQLite-History; step_hours verteilt ts über Jahre."""
+    rng = np.random.default_rng(seed)
+    history = []
+    start = np.datetime64("2020-01-01T00:00", "s")
+    for i in range(n):
+        analysis = make_analysis(rng)
+        data = {**analysis["metrics"], "recommendations": analysis["recommendations"],
+                "customer_message": analysis["customer_message"], "analysis_date": analysis["analysis_date"],
+                "tenant_id": "bench", "files": [f"export_{i}.xlsx"], "source": "n8n_ai"}
+        ts = str(start + np.timedelta64(i * step_hours * 3600, "s")) if step_hours else f"2026-01-01T00:00:{i % 60:02d}.{i:06d}"
+        history.append({"ts": ts, "data": data, "files": data["files"],
+                        "tenant_id": "bench", "tenant_name": "Bench GmbH", "type": "ai_analysis", "source": "n8n"})
+    return history
+
+
+def make_excel_frame(n, seed=2):
+    """DataFrame mit allen Spalten, die extract_metrics_from_excel auswertet."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "belegt": rng.integers(0, 2, n),
+        "frei": rng.integers(0, 2, n),
+        "vertragsdauer_durchschnitt": rng.uniform(1, 24, n),
+        "reminder_automat": rng.integers(0, 5, n),
+        "social_facebook": rng.integers(0, 900, n),
+        "social_google": rng.integers(0, 200, n),
+        "kundenherkunft": np.array(HERKUNFT_KEYS, dtype=object)[rng.integers(0, 3, n)],
+        "zahlungsstatus": np.array(STATUS_KEYS, dtype=object)[rng.integers(0, 3, n)],
+    })
+
+
+def make_markdown(size, variant="fenced", seed=3):
+    """
+    LLM-Antwort mit Fließtext und einem JSON-Objekt von etwa size Bytes.
+    fenced = im ```json-Block, braces = ohne Block, multi = Prosa mit {Klammern},
+    ein kaputtes Objekt und mehrere JSON-Objekte.
+    """
+    rng = np.random.default_rng(seed)
+    analysis = make_analysis(rng, recommendations=1)
+    filler = max(0, size - len(json.dumps(analysis)))
+    analysis["details"] = "x" * filler
+    body = json.dumps(analysis, ensure_ascii=False)
+    if variant == "fenced":
+        return f"Hier ist die Analyse:\n```json\n{body}\n```\nViel Erfolg!"
+    if variant == "multi":
+        return ("Vorab {wie besprochen} ein Entwurf: {\"metrics\": {\"belegt\": 1,}}\n"
+                f"```json\n{body}\n```\nZum Vergleich der Vormonat: {json.dumps(make_analysis(rng))}")
+    return f"Hier ist die Analyse {{wie besprochen}}: {body} Ende."
+
+
+# ========== FÄLLE ==========
+# name -> (Parameter je Preset, setup(param) -> aufrufbare Messfunktion)
+def _case_parse_supabase(n):
+    rows = make_supabase_rows(n)
+    return lambda: parse_supabase_response(rows)
+
+
+def _case_parse_supabase_stream(n):
+    body = json.dumps(make_supabase_rows(n), ensure_ascii=False).encode("utf-8")
+    chunks = [body[i:i + 65536] for i in range(0, len(body), 65536)]
+    return lambda: parse_supabase_stream(chunks)
+
+
+def _case_extract_business_data(shape):
+    analysis = make_analysis(np.random.default_rng(4))
+    if shape == "metrics_string":
+        contract = {"data": {**analysis, "metrics": json.dumps(analysis["metrics"])}}
+    elif shape == "toplevel":
+        contract = {"data": {**analysis["metrics"], "metrics": {}, "recommendations": analysis["recommendations"]}}
+    else:
+        contract = {"data": analysis}
+    return lambda: extract_business_data(contract)
+
+
+def _case_validate_response(shape):
+    response = shape_analyze(make_analysis(np.random.default_rng(5)), shape)
+    return lambda: N8NResponseValidator.validate_response(response)
+
+
+def _case_merge_data(n):
+    rng = np.random.default_rng(6)
+    parts = [make_analysis(rng, recommendations=0)["metrics"] for _ in range(n)]
+
+    def run():
+        merged = {}
+        for part in parts:
+            merged = merge_data(merged, part)
+        return merged
+    return run
+
+
+def _case_extract_metrics(n):
+    df = make_excel_frame(n)
+    return lambda: extract_metrics_from_excel(df, warn=lambda _: None)
+
+
+def _case_build_insights(n):
+    rng = np.random.default_rng(7)
+    datasets = [make_analysis(rng)["metrics"] for _ in range(n)]
+    return lambda: [build_insights(d) for d in datasets]
+
+
+def _case_build_insights_rerun(n):
+    """Rerun-Fall: dieselben n Kennzahlen-dicts immer wieder (n <= Cache-Größe → Treffer)."""
+    rng = np.random.default_rng(7)
+    datasets = [make_analysis(rng)["metrics"] for _ in range(n)]
+    return lambda: [build_insights(d) for d in datasets]
+
+
+def _case_build_insights_batch(n):
+    """Dieselben Snapshots wie build_insights, flach als DataFrame (pd.json_normalize)."""
+    rng = np.random.default_rng(7)
+    frame = pd.json_normalize([make_analysis(rng)["metrics"] for _ in range(n)])
+    return lambda: build_insights_batch(frame)
+
+
+def _json_backend(name):
+    """stdlib-indent = bisheriges Speichern mit indent=2, sonst kompakt mit dem Backend."""
+    backend = serialization.load_backend("stdlib" if name.startswith("stdlib") else name)
+    return backend, name.endswith("-indent")
+
+
+def _case_history_dumps(spec):
+    name, n = spec
+    backend, pretty = _json_backend(name)
+    history = make_history(n)
+    return lambda: backend.dumpb(history, pretty=pretty)
+
+
+def _case_history_loads(spec):
+    name, n = spec
+    backend, pretty = _json_backend(name)
+    payload = backend.dumpb(make_history(n), pretty=pretty)
+    return lambda: backend.loads(payload)
+
+
+def _case_history_save(spec):
+    """Eine neue Analyse speichern: bisher ganze Datei neu schreiben, jetzt eine Zeile anhängen."""
+    mode, n = spec
+    directory = tempfile.mkdtemp(prefix="bench_history_")
+    atexit.register(shutil.rmtree, directory, True)
+    history = make_history(n)
+    entry = history[-1]
+    if mode == "rewrite":
+        path = os.path.join(directory, ".history_bench.json")
+
+        def run():
+            with open(path, "wb") as f:
+                f.write(serialization.dumpb(history))
+        return run
+    store = HistoryStore(directory)
+    for e in history:
+        store.append("bench", e)
+    if mode == "recent10":
+        return lambda: store.load("bench", limit=10)
+    return lambda: store.append("bench", entry)
+
+
+def _case_history_query(spec):
+    """
+    Was ein Rerun von Übersicht/System liest: session = bisher (Liste im Session-State
+    filtern, zweimal sortieren, letzte 10), sonst die Abfragen an den Speicher. rollup = die
+    Verlaufsgrafiken aus Tages-/Wochen-/Monatswerten wie in der Übersicht (ts alle 7 Stunden).
+    """
+    query, backend, n = spec
+    history = make_history(n, step_hours=7 if query == "rollup" else None)
+    if backend == "session":
+        def run():
+            tenant_history = [h for h in history if h.get("tenant_id") == "bench"]
+            series = [h["data"].get("belegungsgrad", 0) for h in sorted(tenant_history, key=lambda x: x["ts"])]
+            series += [h["data"].get("vertragsdauer_durchschnitt", 0) for h in sorted(tenant_history, key=lambda x: x["ts"])]
+            return series, tenant_history[-10:], len(tenant_history)
+        return run
+    directory = tempfile.mkdtemp(prefix="bench_history_")
+    atexit.register(shutil.rmtree, directory, True)
+    store = SqliteHistoryStore(directory=directory) if backend == "sqlite" else HistoryStore(directory)
+    for e in history:
+        store.append("bench", e)
+    if query == "latest10":
+        return lambda: store.latest("bench", 10)
+    if query == "count":
+        return lambda: store.count("bench")
+    if query == "rollup":
+        def run():
+            tables = []
+            for metric in ("belegungsgrad", "vertragsdauer_durchschnitt"):
+                table = store.rollup("bench", metric, "month")
+                grain = pick_grain(table, 500)
+                tables.append(table if grain == "month" else store.rollup("bench", metric, grain))
+            return tables
+        return run
+    return lambda: (store.metric_series("bench", "belegungsgrad"),
+                    store.metric_series("bench", "vertragsdauer_durchschnitt"))
+
+
+def _case_overview_charts(spec):
+    """
+    Die sechs Grafiken der Übersicht je Rerun; zwei Verlaufslinien mit n Punkten.
+    build = Figur bauen, stylen und serialisieren, cached = Figur aus dem Figur-Cache, nur
+    serialisieren (das macht st.plotly_chart bei jedem Aufruf).
+    """
+    mode, n = spec
+    rng = np.random.default_rng(9)
+    tips = build_insights(make_analysis(rng)["metrics"])
+    ts = np.datetime64("2020-01-01", "D") + np.arange(n)
+    occupancy, duration = rng.uniform(50, 100, n), rng.uniform(6, 36, n)
+    charts = [(tips_impact_chart, (tips,)), (tips_savings_chart, (tips,)), (donut_chart, (82.5, "Belegungsgrad")),
+              (pie_chart, (["Google", "Facebook", "Empfehlung"], [40, 25, 35], "Kanal", "Kundenherkunft")),
+              (line_chart, (ts, occupancy, "Belegungsgrad (%)")), (line_chart, (ts, duration, "Vertragsdauer (Monate)"))]
+    if mode == "build":
+        return lambda: [figure_spec(builder(*args)) for builder, args in charts]
+    cache = FigureCache()
+    return lambda: [figure_spec(cache.figure(builder, *args)) for builder, args in charts]
+
+
+def _case_markdown(spec):
+    size, variant, debug = spec
+    text = make_markdown(size, variant)
+    return lambda: extract_json_from_markdown_debug(text, debug=debug)
+
+
+SHAPES = ["data", "flat", "analysis_result", "metrics_string", "list"]
+HISTORY_QUERIES = ["latest10", "count", "series", "rollup"]
+JSON_BACKENDS = ["stdlib-indent", "stdlib"] + (["orjson"] if serialization.backend.name == "orjson" else [])
+CASES = {
+    "parse_supabase_response": (
+        {"quick": [10, 1000], "default": [10, 1000, 100_000], "full": [10, 1000, 100_000]},
+        _case_parse_supabase),
+    "parse_supabase_stream": (
+        {"quick": [10, 1000], "default": [10, 1000, 100_000], "full": [10, 1000, 100_000]},
+        _case_parse_supabase_stream),
+    "extract_business_data": (
+        {p: ["metrics", "metrics_string", "toplevel"] for p in ("quick", "default", "full")},
+        _case_extract_business_data),
+    "validate_response": (
+        {p: SHAPES for p in ("quick", "default", "full")},
+        _case_validate_response),
+    "merge_data": (
+        {"quick": [10, 1000], "default": [10, 1000, 100_000], "full": [10, 1000, 100_000]},
+        _case_merge_data),
+    "extract_metrics_from_excel": (
+        {"quick": [1000, 100_000], "default": [1000, 100_000, 1_000_000],
+         "full": [1000, 100_000, 1_000_000, 5_000_000]},
+        _case_extract_metrics),
+    "build_insights": (
+        {"quick": [1000], "default": [1000, 100_000], "full": [1000, 100_000]},
+        _case_build_insights),
+    "build_insights_rerun": (
+        {p: [1, 100] for p in ("quick", "default", "full")},
+        _case_build_insights_rerun),
+    "build_insights_batch": (
+        {"quick": [1000], "default": [1000, 100_000], "full": [1000, 100_000, 1_000_000]},
+        _case_build_insights_batch),
+    "overview_charts": (
+        {"quick": [("build", 250), ("cached", 250)],
+         "default": [(m, n) for n in (250, 10_000) for m in ("build", "cached")],
+         "full": [(m, n) for n in (250, 10_000) for m in ("build", "cached")]},
+        _case_overview_charts),
+    "history_dumps": (
+        {"quick": [(b, 1000) for b in JSON_BACKENDS],
+         "default": [(b, n) for n in (1000, 50_000) for b in JSON_BACKENDS],
+         "full": [(b, n) for n in (1000, 50_000, 200_000) for b in JSON_BACKENDS]},
+        _case_history_dumps),
+    "history_loads": (
+        {"quick": [(b, 1000) for b in JSON_BACKENDS],
+         "default": [(b, n) for n in (1000, 50_000) for b in JSON_BACKENDS],
+         "full": [(b, n) for n in (1000, 50_000, 200_000) for b in JSON_BACKENDS]},
+        _case_history_loads),
+    "history_save": (
+        {"quick": [(m, 1000) for m in ("rewrite", "append", "recent10")],
+         "default": [(m, n) for n in (1000, 20_000) for m in ("rewrite", "append", "recent10")],
+         "full": [(m, n) for n in (1000, 20_000, 100_000) for m in ("rewrite", "append", "recent10")]},
+        _case_history_save),
+    "history_query": (
+        {"quick": [("rerun", "session", 1000)] + [(q, b, 1000) for b in ("jsonl", "sqlite") for q in HISTORY_QUERIES],
+         "default": [("rerun", "session", n) for n in (1000, 20_000)]
+                    + [(q, b, n) for n in (1000, 20_000) for b in ("jsonl", "sqlite") for q in HISTORY_QUERIES],
+         "full": [("rerun", "session", n) for n in (1000, 20_000, 100_000)]
+                 + [(q, b, n) for n in (1000, 20_000, 100_000) for b in ("jsonl", "sqlite") for q in HISTORY_QUERIES]},
+        _case_history_query),
+    "extract_json_from_markdown_debug": (
+        {"quick": [(1_000, "fenced", True), (100_000, "fenced", True), (100_000, "braces", True),
+                   (100_000, "multi", False)],
+         "default": [(1_000, "fenced", True), (100_000, "fenced", True), (1_000_000, "fenced", True),
+                     (1_000_000, "braces", True), (5_000_000, "multi", True), (5_000_000, "multi", False)],
+         "full": [(1_000, "fenced", True), (100_000, "fenced", True), (1_000_000, "fenced", True),
+                  (1_000_000, "braces", True), (5_000_000, "multi", True), (5_000_000, "multi", False),
+                  (10_000_000, "fenced", True)]},
+        _case_markdown),
+}
+
+
+def param_label(param):
+    if isinstance(param, tuple) and isinstance(param[0], str):
+        return "-".join(str(p) for p in param)
+    if isinstance(param, tuple):
+        size, variant, debug = param
+        return f"{size}B-{variant}" + ("" if debug else "-nodebug")
+    return str(param)
+
+
+# ========== MESSUNG ==========
+def measure(fn):
+    """Beste und mittlere Laufzeit je Aufruf (Sekunden) über REPEATS Messreihen, ohne GC wie timeit."""
+    start = time.perf_counter()
+    fn()
+    first = time.perf_counter() - start
+    number = max(1, int(MIN_ROUND_SECONDS / first)) if first > 0 else 1000
+    rounds = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            rounds.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+        gc.collect()
+    return {"min_s": min(rounds), "median_s": statistics.median(rounds), "number": number, "repeats": REPEATS}
+
+
+def environment():
+    return {"python": platform.python_version(), "machine": platform.machine(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__, "pandas": pd.__version__}
+
+
+def run_case(name, param):
+    setup = CASES[name][1]
+    return {"id": f"{name}[{param_label(param)}]", "case": name, "param": param_label(param), **measure(setup(param))}
+
+
+def compare(results, baseline, threshold):
+    """Ergänzt ratio/regression je Fall gegenüber der Baseline. Gibt die Regressionen zurück."""
+    previous = {r["id"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result["id"])
+        if not old:
+            continue
+        result["baseline_min_s"] = old["min_s"]
+        result["ratio"] = result["min_s"] / old["min_s"] if old["min_s"] else float("inf")
+        result["regression"] = result["ratio"] > 1 + threshold
+        if result["regression"]:
+            regressions.append(result)
+    return regressions
+
+
+def confirm(regressions, params, threshold, attempts):
+    """
+    Misst auffällige Fälle erneut und behält die beste Zeit. Einzelne Ausreißer durch
+    fremde Last auf der Maschine verschwinden dabei, echte Regressionen bleiben.
+    """
+    for result in regressions:
+        for _ in range(attempts):
+            if result["min_s"] / result["baseline_min_s"] <= 1 + threshold:
+                break
+            again = run_case(result["case"], params[result["id"]])
+            if again["min_s"] < result["min_s"]:
+                result.update({k: again[k] for k in ("min_s", "median_s", "number")})
+        result["ratio"] = result["min_s"] / result["baseline_min_s"]
+        result["regression"] = result["ratio"] > 1 + threshold
+    return [r for r in regressions if r["regression"]]
+
+
+def format_seconds(s):
+    if s >= 1:
+        return f"{s:8.2f} s "
+    if s >= 1e-3:
+        return f"{s * 1e3:8.2f} ms"
+    return f"{s * 1e6:8.2f} µs"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-Benchmarks der Parse- und Auswertungspfade")
+    parser.add_argument("--preset", choices=("quick", "default", "full"), default="default")
+    parser.add_argument("--only", help="Nur Fälle, deren Name diesen Text enthält")
+    parser.add_argument("--baseline", help="Baseline-Datei (Standard: bench/baselines/micro-<preset>.json)")
+    parser.add_argument("--save", action="store_true", help="Ergebnis als neue Baseline speichern")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Erlaubte Verlangsamung (0.25 = 25 %%)")
+    parser.add_argument("--confirm", type=int, default=2, help="Zusätzliche Messungen auffälliger Fälle")
+    parser.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"micro-{args.preset}.json")
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results, params = [], {}
+    for name, (presets, _) in CASES.items():
+        if args.only and args.only not in name:
+            continue
+        for param in presets[args.preset]:
+            result = run_case(name, param)
+            params[result["id"]] = param
+            results.append(result)
+            if not args.json:
+                print(f"{result['id']:55} {format_seconds(result['min_s'])}  (Median {format_seconds(result['median_s'])})",
+                      flush=True)
+
+    regressions = []
+    if baseline and not args.save:
+        regressions = confirm(compare(results, baseline, args.threshold), params, args.threshold, args.confirm)
+        if baseline.get("environment") != environment() and not args.json:
+            print("\nHinweis: Baseline stammt aus einer anderen Umgebung, Vergleich nur eingeschränkt aussagekräftig.")
+
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "preset": args.preset,
+              "environment": environment(), "results": results}
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    elif baseline and not args.save:
+        print(f"\nVergleich mit {baseline_path} (Schwelle +{args.threshold:.0%}):")
+        for r in results:
+            if "ratio" in r:
+                flag = "REGRESSION" if r["regression"] else ("schneller" if r["ratio"] < 1 - args.threshold else "ok")
+                print(f"  {r['id']:55} x{r['ratio']:5.2f}  {flag}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        if not args.json:
+            print(f"\nBaseline gespeichert: {baseline_path}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Lastmessung der n8n-Anbindung gegen den lokalen Stub (oder eine echte Instanz).
+
+Treibt den echten Client-Code (n8n_client.post_to_n8n_analyze, fetch_last_analysis
+samt contract.parse_supabase_response) bei mehreren Parallelitätsstufen und meldet
+p50/p95/p99 und Durchsatz je Szenario:
+
+    python bench/bench_n8n.py --latency-ms 200 --jitter-ms 50 --concurrency 1,4,16
+    python bench/bench_n8n.py --base-url http://127.0.0.1:5678/webhook --scenarios last
+
+Szenarien:
+    analyze   Upload einer Datei an analyze-with-deepseek
+    last      get-last-analysis-only ohne Cache, Antwort wird jedes Mal geparst
+    last304   get-last-analysis-only mit bekanntem Stand, Antwort ist 304
+"""
+import argparse, io, json, os, sys, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import n8n_client
+from n8n_client import N8NClient, LastAnalysisCache, post_to_n8n_analyze, fetch_last_analysis
+from n8n_stub import start_stub, ANALYZE_SHAPES, LAST_SHAPES
+
+SCENARIOS = ("analyze", "last", "last304")
+
+
+def sample_csv(rows):
+    """Erzeugt eine Storage-Export-CSV mit den Spalten, die ingest auswertet."""
+    out = io.StringIO()
+    out.write("belegt,frei,vertragsdauer_durchschnitt,reminder_automat,social_facebook,social_google,kundenherkunft,zahlungsstatus\n")
+    herkunft = ("Online", "Empfehlung", "Vorbeikommen")
+    status = ("bezahlt", "offen", "überfällig")
+    for i in range(rows):
+        out.write(f"{i % 2},{(i + 1) % 2},{6 + i % 12},{i % 3},{200 + i % 100},{40 + i % 30},"
+                  f"{herkunft[i % 3]},{status[i % 7 % 3]}\n")
+    return out.getvalue().encode("utf-8")
+
+
+def percentile(sorted_values, p):
+    """Nearest-Rank-Perzentil einer aufsteigend sortierten Liste."""
+    if not sorted_values:
+        return float("nan")
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_level(call, concurrency, requests_total):
+    """Führt requests_total Aufrufe mit concurrency Threads aus. call() gibt True bei Erfolg zurück."""
+    def timed(_):
+        start = time.perf_counter()
+        try:
+            ok = call()
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(requests_total)))
+    wall = time.perf_counter() - wall
+    latencies = sorted(r[0] * 1000 for r in results)
+    return {
+        "concurrency": concurrency,
+        "requests": requests_total,
+        "errors": sum(1 for r in results if not r[1]),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "req_per_s": requests_total / wall if wall else float("inf"),
+    }
+
+
+def make_call(scenario, client, base_url, tenant_id, file_info):
+    if scenario == "analyze":
+        def call():
+            return post_to_n8n_analyze(base_url, tenant_id, str(uuid.uuid4()), file_info, client)["status"] == "success"
+        return call
+    if scenario == "last":
+        def call():
+            contract, _ = fetch_last_analysis(client, LastAnalysisCache(ttl=0), base_url, tenant_id)
+            return bool(contract) and contract.get("status") == "success"
+        return call
+    shared = LastAnalysisCache(ttl=0)
+    fetch_last_analysis(client, shared, base_url, tenant_id)
+
+    def call():
+        contract, raw = fetch_last_analysis(client, shared, base_url, tenant_id)
+        return bool(contract) and raw is None
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lastmessung der n8n-Webhooks")
+    parser.add_argument("--base-url", help="Vorhandene Instanz statt In-Process-Stub")
+    parser.add_argument("--tenant-id", default="bench-tenant")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="Kommagetrennte Parallelitätsstufen")
+    parser.add_argument("--requests", type=int, default=64, help="Aufrufe je Stufe")
+    parser.add_argument("--file", help="Hochzuladende Datei (Standard: erzeugte CSV)")
+    parser.add_argument("--rows", type=int, default=1000, help="Zeilen der erzeugten CSV")
+    parser.add_argument("--upload-mode", choices=("json", "multipart", "raw"), default=n8n_client.UPLOAD_MODE)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--analyze-shape", choices=ANALYZE_SHAPES, default="status")
+    parser.add_argument("--last-shape", choices=LAST_SHAPES, default="rows")
+    parser.add_argument("--filler-rows", type=int, default=20)
+    parser.add_argument("--padding-kb", type=int, default=0)
+    parser.add_argument("--recommendations", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Ergebnis als JSON ausgeben")
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    if not base_url:
+        _, base_url = start_stub(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, analyze_shape=args.analyze_shape,
+            last_shape=args.last_shape, filler_rows=args.filler_rows, padding_kb=args.padding_kb,
+            recommendations=args.recommendations)
+    n8n_client.UPLOAD_MODE = args.upload_mode
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            file_info = (os.path.basename(args.file), f.read(), "application/octet-stream")
+    else:
+        file_info = ("bench.csv", sample_csv(args.rows), "text/csv")
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    report = []
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"Unbekanntes Szenario {scenario}")
+        for level in levels:
+            client = N8NClient(pool_size=level, max_concurrency=level)
+            if scenario != "analyze":
+                # get-last braucht eine gespeicherte Analyse für den Tenant
+                post_to_n8n_analyze(base_url, args.tenant_id, str(uuid.uuid4()), file_info, client)
+            result = run_level(make_call(scenario, client, base_url, args.tenant_id, file_info), level, args.requests)
+            result["scenario"] = scenario
+            result["retries"] = client.stats()["retries"]
+            client.close()
+            report.append(result)
+            if not args.json:
+                print(f"{scenario:8} c={level:<3} n={result['requests']:<5} err={result['errors']:<3} "
+                      f"p50={result['p50_ms']:8.1f} ms  p95={result['p95_ms']:8.1f} ms  "
+                      f"p99={result['p99_ms']:8.1f} ms  {result['req_per_s']:8.1f} req/s")
+    if args.json:
+        print(json.dumps({"base_url": base_url, "upload_mode": args.upload_mode, "results": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
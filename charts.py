@@ -1,8 +1,24 @@
+import hashlib, os, threading
+from collections import OrderedDict
+import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
+from plotly.subplots import make_subplots
 import pandas as pd
 from ui_theme import style_fig, PRIMARY, SECONDARY, ACCENT, SUCCESS, WARNING, DANGER
 
+# ========== KONFIGURATION ==========
+# Fertig serialisierte Figuren im Speicher (0 = kein Cache), begrenzt nach Anzahl und Größe
+FIGURE_CACHE_ENTRIES = int(os.environ.get("FIGURE_CACHE_ENTRIES", "64"))
+FIGURE_CACHE_MAX_MB = float(os.environ.get("FIGURE_CACHE_MAX_MB", "32"))
+# Punktbudget je Linie (0 = alle Punkte); lttb hält die Form, minmax je Abschnitt Minimum und Maximum
+CHART_MAX_POINTS = int(os.environ.get("CHART_MAX_POINTS", "2000"))
+CHART_DOWNSAMPLE = os.environ.get("CHART_DOWNSAMPLE", "lttb")
+# Ab so vielen Punkten zeichnet der Browser mit WebGL (Scattergl) statt SVG
+CHART_WEBGL_POINTS = int(os.environ.get("CHART_WEBGL_POINTS", "1000"))
+
+
 def bar_grouped(categories, before_values, after_values, labels=('Vorher', 'Nachher'), title='', h=400):
     """Erzeugt gruppiertes Balkendiagramm für Vorher‑Nachher‑Vergleich."""
     fig = go.Figure(data=[
@@ -61,3 +77,215 @@ def tips_savings_chart(tips, h=300):
     )])
     fig.update_layout(yaxis_title='Ersparnis (€ / Monat)')
     return style_fig(fig, 'Monatliche Ersparnis (Schätzung)', h)
+
+def line_chart(x, y, title='', h=300):
+    """
+    Linie mit Punkten, z. B. eine Kennzahl über die Zeit. Mehr als CHART_MAX_POINTS Punkte
+    werden ausgedünnt (Spitzen und Täler bleiben), ab CHART_WEBGL_POINTS wird Scattergl genutzt.
+    """
+    x, y = downsample(x, y, CHART_MAX_POINTS, CHART_DOWNSAMPLE)
+    trace = go.Scattergl if len(y) > CHART_WEBGL_POINTS else go.Scatter
+    fig = go.Figure(data=[trace(x=x, y=y, mode='lines+markers')])
+    return style_fig(fig, title, h)
+
+def bar_chart(x, y, title='', h=300):
+    """Einfaches Balkendiagramm."""
+    fig = go.Figure(data=[go.Bar(x=x, y=y)])
+    return style_fig(fig, title, h)
+
+def compare_bar(before_value, after_value, labels=('Vorher', 'Nachher'), title='', h=300):
+    """Ein Wert vorher und nachher als zwei Balken."""
+    fig = go.Figure(data=[
+        go.Bar(name=labels[0], x=[labels[0]], y=[before_value], marker_color=PRIMARY),
+        go.Bar(name=labels[1], x=[labels[1]], y=[after_value], marker_color=SECONDARY)
+    ])
+    return style_fig(fig, title, h)
+
+def pie_chart(names, values, names_label='Kanal', title='', h=300):
+    """Kreisdiagramm; names_label erscheint im Tooltip."""
+    df = pd.DataFrame({names_label: names, "Anzahl": values})
+    fig = px.pie(df, values='Anzahl', names=names_label)
+    return style_fig(fig, title, h)
+
+def pie_pair(before, after, labels=('Vorher', 'Nachher'), title='', h=300):
+    """Zwei Kreisdiagramme nebeneinander aus {Kategorie: Anzahl}."""
+    fig = make_subplots(rows=1, cols=2, subplot_titles=labels, specs=[[{'type': 'domain'}, {'type': 'domain'}]])
+    fig.add_trace(go.Pie(labels=list(before.keys()), values=list(before.values()), name=labels[0]), 1, 1)
+    fig.add_trace(go.Pie(labels=list(after.keys()), values=list(after.values()), name=labels[1]), 1, 2)
+    return style_fig(fig, title, h)
+
+
+# ========== AUSDÜNNEN ==========
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: erster und letzter Punkt, dazwischen je Bucket der Punkt,
+    der mit dem zuletzt gewählten und dem Mittel des nächsten Buckets das größte Dreieck bildet.
+    Eine Schleife über n_out Buckets, innerhalb vektorisiert. x numerisch oder datetime64.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x)
+    x = (x.astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_out - 2 Buckets über die Punkte 1 .. n-2; jeder hat mindestens einen Punkt
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    # Nach dem letzten Bucket zählt der letzte Punkt als "nächster Bucket"
+    avg_x, avg_y = np.append(avg_x[1:], x[-1]), np.append(avg_y[1:], y[-1])
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay, cx, cy = x[a], y[a], avg_x[i], avg_y[i]
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y, n_out):
+    """Je Abschnitt Index von Minimum und Maximum (vektorisiert), dazu erster und letzter Punkt."""
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = (n_out - 2) // 2
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    rows = padded.reshape(buckets, size)
+    # Auffüllung zählt nie als Extremwert; Buckets ganz aus Auffüllung fallen weg
+    base = np.arange(buckets) * size
+    filled = base < n
+    lo = base + np.where(np.isnan(rows), np.inf, rows).argmin(axis=1)
+    hi = base + np.where(np.isnan(rows), -np.inf, rows).argmax(axis=1)
+    return np.unique(np.concatenate(([0, n - 1], lo[filled], hi[filled])))
+
+
+def downsample(x, y, max_points, method="lttb"):
+    """(x, y) auf höchstens max_points Punkte (0 = unverändert); NaN in y fällt vorher weg."""
+    y = np.asarray(y, dtype=np.float64)
+    if not max_points or len(y) <= max_points:
+        return x, y
+    x = np.asarray(x)
+    keep = ~np.isnan(y)
+    if not keep.all():
+        x, y = x[keep], y[keep]
+    idx = minmax_indices(y, max_points) if method == "minmax" else lttb_indices(x, y, max_points)
+    return x[idx], y[idx]
+
+
+# ========== FIGUR-CACHE ==========
+def figure_spec(fig):
+    """Plotly-JSON einer Figur, genau so, wie st.plotly_chart sie an den Browser schickt (Größe, Benchmarks)."""
+    return pio.to_json(fig.to_dict(), validate=False)
+
+
+def _digest(h, obj):
+    # Typ geht mit ein: 1, 1.0, True und "1" ergeben verschiedene Schlüssel
+    if isinstance(obj, np.ndarray):
+        h.update(b"a" + obj.dtype.str.encode() + repr(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"l%d" % len(obj))
+        for item in obj:
+            _digest(h, item)
+    elif isinstance(obj, dict):
+        h.update(b"d%d" % len(obj))
+        for key, value in obj.items():
+            _digest(h, key)
+            _digest(h, value)
+    elif obj is None or isinstance(obj, (str, int, float, np.generic)):
+        h.update(type(obj).__name__.encode() + b":" + repr(obj).encode() + b";")
+    else:
+        raise TypeError(f"{type(obj).__name__} ist kein Cache-Schlüssel")
+
+
+def figure_key(builder, args, kwargs):
+    """
+    Inhalts-Hash (blake2b) aus Diagrammfunktion, Daten und Parametern. Reihenfolge zählt
+    (Kategorien, Zeitachsen); numpy-Arrays gehen mit dtype, Form und Rohbytes ein.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{builder.__module__}.{builder.__qualname__}".encode())
+    _digest(h, args)
+    _digest(h, sorted(kwargs.items()))
+    return h.digest()
+
+
+class FigureCache:
+    """
+    LRU der fertig gebauten und gestylten Figuren, prozessweit und für alle Sessions.
+    Ein Treffer ersetzt Aufbau, Ausdünnen und style_fig; st.plotly_chart serialisiert die
+    Figur weiterhin selbst (ohne erneute Validierung). Begrenzt nach Anzahl und Gesamtgröße
+    (Länge der Plotly-JSON, einmal beim Aufnehmen gemessen); eine einzelne Figur über dem
+    Größenlimit wird nicht aufgenommen. Zurückgegebene Figuren werden geteilt: nicht verändern.
+    """
+
+    def __init__(self, max_entries=FIGURE_CACHE_ENTRIES, max_mb=FIGURE_CACHE_MAX_MB):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats_counter = {"hits": 0, "misses": 0, "evictions": 0, "uncacheable": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats_counter["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counter["hits"] += 1
+            return entry[0]
+
+    def put(self, key, fig):
+        if not self.max_entries:
+            return
+        size = len(figure_spec(fig))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (fig, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.stats_counter["evictions"] += 1
+
+    def figure(self, builder, *args, **kwargs):
+        """Figur von builder(*args, **kwargs); gebaut wird nur bei neuem Inhalt."""
+        try:
+            key = figure_key(builder, args, kwargs)
+        except TypeError:
+            with self._lock:
+                self.stats_counter["uncacheable"] += 1
+            return builder(*args, **kwargs)
+        fig = self.get(key)
+        if fig is None:
+            fig = builder(*args, **kwargs)
+            self.put(key, fig)
+        return fig
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.stats_counter["hits"] + self.stats_counter["misses"]
+            return {**self.stats_counter, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "mb": round(self._bytes / 1024 / 1024, 2),
+                    "hit_rate": round(self.stats_counter["hits"] / lookups, 3) if lookups else None}
+
+
+cache = FigureCache()
@@ -0,0 +1,353 @@
+import codecs, json
+from datetime import datetime
+from serialization import loads
+from ingest import merge_data
+
+# ========== DEFAULT DATEN ==========
+DEFAULT_DATA = {
+    "belegt": 18, "frei": 6, "vertragsdauer_durchschnitt": 7.2, "reminder_automat": 15,
+    "social_facebook": 280, "social_google": 58, "belegungsgrad": 75,
+    "kundenherkunft": {"Online": 12, "Empfehlung": 6, "Vorbeikommen": 4},
+    "neukunden_labels": ["Jan", "Feb", "Mär", "Apr", "Mai", "Jun"],
+    "neukunden_monat": [5, 4, 7, 6, 8, 9],
+    "zahlungsstatus": {"bezahlt": 21, "offen": 2, "überfällig": 1},
+    "recommendations": [], "customer_message": ""
+}
+
+# ========== N8NResponseValidator ==========
+class N8NResponseValidator:
+    @staticmethod
+    def validate_response(response):
+        if not response:
+            return None, "Leere Response erhalten"
+        if isinstance(response, dict) and "data" in response:
+            data = response.get("data", {})
+            if isinstance(data, dict):
+                return data, None
+            return None, "Data-Feld ist kein Dictionary"
+        if isinstance(response, dict):
+            metrics = {}
+            if "metrics" in response:
+                metrics = response["metrics"]
+            elif "analysis_result" in response:
+                ar = response["analysis_result"]
+                if isinstance(ar, dict):
+                    metrics = ar.get("metrics", ar)
+            elif any(k in response for k in ["belegt", "frei", "belegungsgrad"]):
+                metrics = response
+            else:
+                return None, "Keine Metriken gefunden"
+            recommendations = response.get("recommendations", response.get("recommendation_list", []))
+            customer_message = response.get("customer_message", response.get("summary", ""))
+            analysis_date = response.get("analysis_date", response.get("timestamp", response.get("processed_at", datetime.now().isoformat())))
+            if isinstance(metrics, str):
+                try:
+                    metrics = loads(metrics)
+                except json.JSONDecodeError:
+                    return None, "Metrics ist ungültiger JSON-String"
+            return {
+                "metrics": metrics if isinstance(metrics, dict) else {},
+                "recommendations": recommendations if isinstance(recommendations, list) else [],
+                "customer_message": customer_message or "Analyse geladen",
+                "analysis_date": analysis_date
+            }, None
+        if isinstance(response, list):
+            if len(response) > 0:
+                return N8NResponseValidator.validate_response(response[0])
+            return None, "Leere Liste"
+        return None, f"Unbekanntes Response-Format: {type(response)}"
+
+# ========== SUPABASE-/N8N-CONTRACT ==========
+def extract_business_data(contract: dict) -> dict:
+    data = contract.get("data", {})
+    result = DEFAULT_DATA.copy()
+    metrics = data.get("metrics", {})
+    if isinstance(metrics, str):
+        try:
+            metrics = loads(metrics)
+        except json.JSONDecodeError:
+            metrics = {}
+    if not metrics or (isinstance(metrics, dict) and len(metrics) == 0):
+        for key in ["belegt", "frei", "belegungsgrad", "vertragsdauer_durchschnitt",
+                     "reminder_automat", "social_facebook", "social_google"]:
+            if key in data and data[key] is not None:
+                metrics[key] = data[key]
+        for special in ["kundenherkunft", "zahlungsstatus"]:
+            if special in data and isinstance(data[special], dict):
+                metrics[special] = data[special]
+    def safe_num(v):
+        if isinstance(v, (int, float)):
+            return v
+        try:
+            return float(v)
+        except:
+            return v
+    for key in result:
+        if key in metrics:
+            result[key] = safe_num(metrics[key])
+    for special in ["kundenherkunft", "zahlungsstatus"]:
+        if special in metrics:
+            result[special] = metrics[special]
+    result["recommendations"] = data.get("recommendations", [])
+    result["customer_message"] = data.get("customer_message", "")
+    result["analysis_date"] = data.get("analysis_date", datetime.now().isoformat())
+    return result
+
+# ========== AUSWAHL DER LETZTEN ANALYSE ==========
+# Zeilen aus get-last-analysis-only: gesucht ist die neueste Zeile mit nicht-leeren
+# Metriken, ersatzweise die neueste mit irgendeinem analysis_result. Bei gleichem
+# Zeitstempel gewinnt die frühere Zeile. analysis_result wird nur bei Bedarf und
+# höchstens einmal je Zeile dekodiert.
+def _decode_analysis(ar):
+    try:
+        return loads(ar) if isinstance(ar, str) else ar
+    except ValueError:
+        return None
+
+
+def _has_metrics(parsed):
+    return isinstance(parsed, dict) and isinstance(parsed.get('metrics'), dict) and len(parsed['metrics']) > 0
+
+
+def _row_key(row):
+    key = row.get('created_at', row.get('updated_at', ''))
+    return '' if key is None else key
+
+
+def select_analysis_row(rows):
+    """
+    Wählt die maßgebliche Zeile einer Liste. Gibt (row, analysis) oder None zurück.
+    Ein linearer Durchlauf sammelt die Kandidaten, max() findet die neueste; hat sie
+    Metriken (der Normalfall), ist die Auswahl fertig. Nur sonst wird sortiert und
+    von neu nach alt weiter dekodiert.
+    """
+    keyed = [(_row_key(r), -i) for i, r in enumerate(rows)
+             if isinstance(r, dict) and not r.get('_for_supabase')
+             and (ar := r.get('analysis_result')) and ar != 'undefined']
+    if not keyed:
+        return None
+    newest = max(keyed)
+    newest_row = rows[-newest[1]]
+    newest_parsed = _decode_analysis(newest_row['analysis_result'])
+    if _has_metrics(newest_parsed):
+        return newest_row, newest_parsed
+    keyed.sort(reverse=True)
+    for _, neg_index in keyed[1:]:
+        parsed = _decode_analysis(rows[-neg_index]['analysis_result'])
+        if _has_metrics(parsed):
+            return rows[-neg_index], parsed
+    return newest_row, newest_parsed
+
+
+def select_analysis_row_online(rows):
+    """
+    Dieselbe Auswahl für einen Strom von Zeilen mit konstantem Speicher: gehalten werden
+    nur die bisher neueste Zeile und die neueste mit Metriken. Dekodiert wird eine Zeile
+    nur, wenn sie neuer ist als der bisherige Treffer.
+    """
+    best = newest = None
+    best_key = newest_key = None
+    for row in rows:
+        if not isinstance(row, dict) or row.get('_for_supabase'):
+            continue
+        ar = row.get('analysis_result')
+        if not ar or ar == 'undefined':
+            continue
+        key = _row_key(row)
+        if newest is None or key > newest_key:
+            newest, newest_key = [row, ar, False], key
+        if best is None or key > best_key:
+            parsed = _decode_analysis(ar)
+            if newest[0] is row:
+                newest[1:] = [parsed, True]
+            if _has_metrics(parsed):
+                best, best_key = (row, parsed), key
+    if best is not None:
+        return best
+    if newest is None:
+        return None
+    row, parsed, decoded = newest
+    return row, parsed if decoded else _decode_analysis(parsed)
+
+
+def _contract_from_row(selected):
+    if selected is None:
+        return {"status": "success", "count": 0, "data": DEFAULT_DATA.copy()}
+    row, analysis_data = selected
+    if not isinstance(analysis_data, dict):
+        return {"status": "error", "message": "Unbekanntes Format", "data": DEFAULT_DATA.copy()}
+    return {
+        "status": "success",
+        "tenant_id": row.get('tenant_id'),
+        "count": 1,
+        "data": {
+            "metrics": analysis_data.get('metrics', {}),
+            "recommendations": analysis_data.get('recommendations', []),
+            "customer_message": analysis_data.get('customer_message', ''),
+            "analysis_date": analysis_data.get('analysis_date', row.get('created_at', ''))
+        }
+    }
+
+
+def parse_supabase_response(response_data):
+    if isinstance(response_data, list):
+        return _contract_from_row(select_analysis_row(response_data))
+    if isinstance(response_data, dict):
+        if 'data' in response_data:
+            return response_data
+        ar = response_data.get('analysis_result')
+        if ar and ar not in ('undefined', None):
+            try:
+                analysis_data = loads(ar) if isinstance(ar, str) else ar
+                return {
+                    "status": "success",
+                    "tenant_id": response_data.get('tenant_id'),
+                    "count": 1,
+                    "data": {
+                        "metrics": analysis_data.get('metrics', {}),
+                        "recommendations": analysis_data.get('recommendations', []),
+                        "customer_message": analysis_data.get('customer_message', ''),
+                        "analysis_date": analysis_data.get('analysis_date', '')
+                    }
+                }
+            except:
+                pass
+    return {"status": "error", "message": "Unbekanntes Format", "data": DEFAULT_DATA.copy()}
+
+# ========== STREAMING ==========
+_WHITESPACE = " \t\n\r"
+_SEPARATORS = ",]" + _WHITESPACE
+
+
+class _ChunkBuffer:
+    """Text aus einem Strom von Byte-/Text-Chunks; verbrauchte Teile werden verworfen."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self, minimum=1):
+        """Liest nach, bis mindestens minimum Zeichen ab pos vorliegen oder der Strom endet."""
+        parts = [self.text[self.pos:]]
+        size = len(parts[0])
+        while size < minimum and not self.exhausted:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.exhausted = True
+                chunk = self._decoder.decode(b"", final=True)
+            elif isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            parts.append(chunk)
+            size += len(chunk)
+        self.text, self.pos = "".join(parts), 0
+        return size >= minimum
+
+    def skip(self, chars):
+        """Überspringt die Zeichen aus chars; gibt das nächste andere Zeichen zurück ('' am Ende)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in chars:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.fill():
+                return self.text[self.pos] if self.pos < len(self.text) else ""
+
+
+def iter_json_array(chunks):
+    """
+    Liefert die Elemente eines JSON-Arrays einzeln aus einem Strom von Chunks,
+    ohne das ganze Array aufzubauen. Ein Element wird erst dekodiert, wenn es
+    vollständig vorliegt; reicht der Puffer nicht, wird er jeweils verdoppelt.
+    """
+    decoder = json.JSONDecoder()
+    buf = _ChunkBuffer(chunks)
+    if buf.skip(_WHITESPACE) != "[":
+        raise ValueError("Kein JSON-Array")
+    buf.pos += 1
+    if buf.skip(_WHITESPACE) == "]":
+        return
+    while True:
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf.text, buf.pos)
+            except json.JSONDecodeError:
+                value, end = None, None
+            # Eine Zahl am Pufferende könnte noch weitergehen ("2." + "5"), daher erst mit Trennzeichen gültig
+            if end is not None and (buf.exhausted or (end < len(buf.text) and buf.text[end] in _SEPARATORS)):
+                break
+            if buf.exhausted:
+                raise ValueError("JSON-Array unvollständig")
+            buf.fill(2 * (len(buf.text) - buf.pos) + 1)
+        yield value
+        buf.pos = end
+        separator = buf.skip(_WHITESPACE)
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("Ungültiges JSON-Array")
+        buf.pos += 1
+        buf.skip(_WHITESPACE)
+
+
+def parse_supabase_stream(chunks, stats=None):
+    """
+    Wie parse_supabase_response, aber direkt aus dem Antwortstrom. Arrays werden
+    zeilenweise mit select_analysis_row_online ausgewertet und nie vollständig
+    aufgebaut; andere Antworten werden normal geparst. stats erhält die Zeilenzahl ("rows").
+    """
+    buf = _ChunkBuffer(chunks)
+    first = buf.skip(_WHITESPACE)
+    if first != "[":
+        # Rest einmal zusammensetzen; fill() bis zum Ende kopierte den Puffer bei jedem Chunk
+        text = "".join(_replay(buf))
+        return parse_supabase_response(loads(text) if first else None)
+    rows = _counted(iter_json_array(_replay(buf)), stats)
+    return _contract_from_row(select_analysis_row_online(rows))
+
+
+def _replay(buf):
+    """Bereits gepufferten Text und danach den Rest des ursprünglichen Stroms liefern."""
+    yield buf.text[buf.pos:]
+    buf.text, buf.pos = "", 0
+    while buf.fill():
+        yield buf.text
+        buf.text = ""
+
+
+def _counted(rows, stats):
+    count = 0
+    for row in rows:
+        count += 1
+        yield row
+    if stats is not None:
+        stats["rows"] = count
+
+
+def merge_n8n_results(parts):
+    """
+    Führt die n8n-Antworten mehrerer Dateien zu einer zusammen:
+    Metriken per merge_data in Upload-Reihenfolge, Empfehlungen ohne Duplikate.
+    """
+    merged = {"metrics": {}, "recommendations": [], "customer_message": "", "analysis_date": ""}
+    messages = []
+    for data in parts:
+        metrics = data.get("metrics", {})
+        if isinstance(metrics, dict) and metrics:
+            merged["metrics"] = merge_data(merged["metrics"], metrics)
+        for rec in data.get("recommendations", []) or []:
+            if rec not in merged["recommendations"]:
+                merged["recommendations"].append(rec)
+        message = data.get("customer_message")
+        if message and message not in messages:
+            messages.append(message)
+        merged["analysis_date"] = max(merged["analysis_date"], str(data.get("analysis_date", "")))
+    if not merged["metrics"]:
+        del merged["metrics"]
+    if messages:
+        merged["customer_message"] = "\n\n".join(messages)
+    else:
+        del merged["customer_message"]
+    if not merged["analysis_date"]:
+        del merged["analysis_date"]
+    return merged
@@ -1,52 +1,107 @@
 import json, re, streamlit as st
 
-def extract_json_from_markdown_debug(text, debug_name="n8n"):
+_decoder = json.JSONDecoder()
+
+
+# Überspringt alles bis zur nächsten Klammer außerhalb eines Strings (Escapes beachtet);
+# ein String ohne schließendes " läuft bis zum Textende. Zeichenklassen statt Alternation je Zeichen
+_SKIP_TO_BRACE = re.compile(r'[^{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"?[^{}"]*)*', re.S)
+
+
+# Fehlversuche des C-Decoders direkt im Text; danach werden nur noch Spannen dekodiert
+# (eine Fehlermeldung mit Zeile/Spalte kostet O(pos), viele davon wären quadratisch)
+_FAST_FAILURES = 8
+
+
+def _span_end(text, pos):
+    """Ende der ausgeglichenen Spanne ab der { bei pos; None, wenn sie nicht schließt."""
+    n = len(text)
+    depth, end = 1, pos + 1
+    while depth:
+        end = _SKIP_TO_BRACE.match(text, end).end()
+        if end >= n:
+            return None
+        depth += 1 if text[end] == '{' else -1
+        end += 1
+    return end
+
+
+def iter_json_objects(text, errors=None):
+    """
+    Liefert (start, end, obj) für jedes Top-Level-JSON-Objekt in text, in Textreihenfolge.
+    Ein Durchlauf: außerhalb von Objekten springt str.find zur nächsten {. Gelingt der
+    C-Decoder ab dort, ist das Objekt genau die ausgeglichene Spanne. Sonst bestimmt ein
+    Scanner das Ende der Spanne (Klammertiefe, Strings und Escapes ausgenommen), und es
+    geht dahinter weiter, nie in ihr. Eine nicht geschlossene Spanne (abgeschnittene
+    Antwort) liefert nichts. Optional sammelt errors (start, Fehler).
     """
-    Extrahiert JSON mit ausführlichem Debugging.
-    Gibt (json_data, debug_log) zurück.
+    failures = 0
+    pos = text.find('{')
+    while pos != -1:
+        error = None
+        if failures < _FAST_FAILURES:
+            try:
+                obj, end = _decoder.raw_decode(text, pos)
+            except (ValueError, RecursionError) as e:
+                error, failures = e, failures + 1
+            else:
+                yield pos, end, obj
+                pos = text.find('{', end)
+                continue
+        end = _span_end(text, pos)
+        if end is None:
+            if errors is not None:
+                errors.append((pos, error or json.JSONDecodeError("Objekt nicht geschlossen", text, pos)))
+            return
+        if error is None:
+            try:
+                obj = _decoder.decode(text[pos:end])
+            except (ValueError, RecursionError) as e:
+                error = e
+            else:
+                yield pos, end, obj
+        if error is not None and errors is not None:
+            errors.append((pos, error))
+        pos = text.find('{', end)
+
+
+def extract_json_from_markdown_debug(text, debug_name="n8n", debug=True):
+    """
+    Extrahiert das erste gültige JSON-Objekt aus einer LLM-Antwort (mit oder ohne Codeblock).
+    Gibt (json_data, debug_log) zurück. Mit debug=False bleibt das Log leer und kostet nichts.
     """
     debug_log = []
-    
+
     if not text or not isinstance(text, str):
-        debug_log.append("❌ Eingabe ist leer oder kein String")
+        if debug:
+            debug_log.append("❌ Eingabe ist leer oder kein String")
         return None, debug_log
-    
-    debug_log.append(f"📏 Eingabelänge: {len(text)} Zeichen")
-    
-    # Versuch 1: Codeblock
-    pattern = r'```(?:json)?\s*(\{.*?\})\s*```'
-    matches = re.findall(pattern, text, re.DOTALL)
-    debug_log.append(f"🔍 Codeblock-Matches: {len(matches)}")
-    
-    if matches:
-        try:
-            result = json.loads(matches[0])
-            debug_log.append("✅ JSON aus Codeblock geparst")
-            return result, debug_log
-        except json.JSONDecodeError as e:
-            debug_log.append(f"❌ JSON-Decode-Fehler: {e}")
-    
-    # Versuch 2: Erste geschweifte Klammern
-    start, end = text.find('{'), text.rfind('}')+1
-    debug_log.append(f"🔍 Klammern gefunden: Start {start}, End {end}")
-    
-    if start != -1 and end > start:
-        try:
-            json_str = text[start:end]
-            debug_log.append(f"📄 JSON-Stringlänge: {len(json_str)}")
-            result = json.loads(json_str)
-            debug_log.append("✅ JSON aus Klammern geparst")
-            return result, debug_log
-        except Exception as e:
+
+    if debug:
+        debug_log.append(f"📏 Eingabelänge: {len(text)} Zeichen")
+    errors = [] if debug else None
+
+    for start, end, result in iter_json_objects(text, errors):
+        if debug:
+            debug_log.append(f"🔍 Verworfene {{-Stellen davor: {len(errors)}")
+            debug_log.append(f"✅ JSON geparst ({start}–{end}, {end - start} Zeichen)")
+        return result, debug_log
+
+    if debug:
+        debug_log.append(f"🔍 Verworfene {{-Stellen: {len(errors)}")
+        if errors:
+            # Zeige Ausschnitt um den ersten Problembereich
+            start, e = errors[0]
             debug_log.append(f"❌ Parse-Fehler: {e}")
-            # Zeige Ausschnitt des Problembereichs
-            snippet_start = max(0, start-100)
-            snippet_end = min(len(text), end+100)
-            debug_log.append(f"🔍 Ausschnitt:\n{text[snippet_start:snippet_end]}")
-    
-    debug_log.append("❌ Kein JSON gefunden")
+            debug_log.append(f"🔍 Ausschnitt:\n{text[max(0, start - 100):start + 300]}")
+        debug_log.append("❌ Kein JSON gefunden")
     return None, debug_log
 
+
+def extract_json_from_markdown(text):
+    """Wie extract_json_from_markdown_debug, ohne Log."""
+    return extract_json_from_markdown_debug(text, debug=False)[0]
+
 # In deiner app.py ersetze extract_json_from_markdown() durch:
-# json_data, debug_info = extract_json_from_markdown_debug(response.text)
+# json_data, debug_info = extract_json_from_markdown_debug(response.text, debug=st.session_state.debug_mode)
 # for line in debug_info: st.sidebar.text(line)  # Debug in Sidebar
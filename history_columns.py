@@ -0,0 +1,279 @@
+import os, pathlib, re, shutil, struct
+import numpy as np
+
+# Metriknamen werden zu Dateinamen; alles andere bleibt nur im Log
+_METRIC_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+_TS_DTYPE = np.dtype("<i8")
+_VALUE_DTYPE = np.dtype("<f8")
+_NAT = np.iinfo(np.int64).min
+
+EMPTY_TS = np.array([], dtype="datetime64[us]")
+EMPTY_VALUES = np.array([], dtype=np.float64)
+
+# Rollups: ein Datensatz je Bucket; Mittelwert = sum / count, last = Wert mit dem größten ts
+GRAINS = ("day", "week", "month")
+ROLLUP_DTYPE = np.dtype([("start", "<i8"), ("count", "<i8"), ("min", "<f8"), ("max", "<f8"),
+                         ("sum", "<f8"), ("last_ts", "<i8"), ("last", "<f8")])
+# Dieselben Felder mit Zeitstempeln als datetime64[us] (Sicht ohne Kopie)
+ROLLUP_VIEW = np.dtype([("start", "M8[us]"), ("count", "<i8"), ("min", "<f8"), ("max", "<f8"),
+                        ("sum", "<f8"), ("last_ts", "M8[us]"), ("last", "<f8")])
+_US_PER_DAY = 86_400_000_000
+# Ein Datensatz bzw. rollup.rows ohne numpy (beim Anhängen zählt jede Mikrosekunde)
+_RECORD = struct.Struct("<qqdddqd")
+_ROLLUP_ROWS = struct.Struct("<q")
+
+
+def to_datetime64(values):
+    """ISO-Strings → datetime64[us]-Array; unlesbare Werte werden NaT."""
+    try:
+        return np.array(values, dtype="datetime64[us]")
+    except (TypeError, ValueError):
+        out = np.empty(len(values), dtype="datetime64[us]")
+        for i, value in enumerate(values):
+            try:
+                out[i] = np.datetime64(value, "us")
+            except (TypeError, ValueError):
+                out[i] = np.datetime64("NaT")
+        return out
+
+
+def window(ts, values, start=None, end=None, limit=None):
+    """Schneidet nach ts sortierte Arrays auf start <= ts < end (searchsorted) und die letzten limit zu."""
+    lo = 0 if start is None else int(np.searchsorted(ts, np.datetime64(start, "us"), "left"))
+    hi = len(ts) if end is None else int(np.searchsorted(ts, np.datetime64(end, "us"), "left"))
+    if limit:
+        lo = max(lo, hi - limit)
+    return ts[lo:hi], values[lo:hi]
+
+
+class MetricColumns:
+    """
+    Spaltenablage der History eines Tenants neben dem JSONL-Log (.history_<tenant>.cols/):
+    - ts.i8: Zeitstempel als int64-Mikrosekunden, eine Zeile je Log-Eintrag
+    - <metric>.f8: float64 je Kennzahl aus entry["data"], NaN wo sie fehlt
+    Alle Dateien sind gleich lang (Zeile i = i-ter Log-Eintrag). Beim Anhängen wird an jede
+    Datei ein Wert geschrieben; eine neue Kennzahl bekommt eine mit NaN aufgefüllte Datei.
+    - <metric>.day/.week/.month: Rollups je Bucket (ROLLUP_DTYPE), beim Anhängen fortgeschrieben;
+      rollup.rows sagt, wie viele Zeilen sie abdecken
+    Gelesen wird mit np.fromfile ohne Python-Schleife je Punkt. Passen die Längen nicht zum
+    Log (Absturz, Kompaktierung, fremder Prozess), baut der Aufrufer die Spalten neu auf.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def _file(self, name, suffix):
+        return self.path / f"{name}.{suffix}"
+
+    def rollup_rows(self):
+        """Zeilen, die die Rollup-Dateien abdecken (rollup.rows); 0, wenn es keine gibt."""
+        try:
+            data = self._file("rollup", "rows").read_bytes()
+        except FileNotFoundError:
+            return 0
+        return _ROLLUP_ROWS.unpack(data)[0] if len(data) == _ROLLUP_ROWS.size else None
+
+    def layout(self):
+        """(Zeilen laut ts.i8, vorhandene Kennzahlen); Zeilen None, wenn eine Datei nicht dazu passt."""
+        try:
+            rows, rest = divmod(self._file("ts", "i8").stat().st_size, _TS_DTYPE.itemsize)
+        except FileNotFoundError:
+            return (0 if not self.path.exists() else None), set()
+        known = set()
+        for file in self.path.glob("*.f8"):
+            if rest or file.stat().st_size != rows * _VALUE_DTYPE.itemsize:
+                return None, known
+            known.add(file.stem)
+        return (None if rest else rows), known
+
+    def append(self, ts, metrics, rows, known):
+        """Hängt eine Zeile an; rows und known wie von layout() geliefert. Aktuelle Rollups wachsen mit."""
+        self.path.mkdir(exist_ok=True)
+        rolled = self.rollup_rows() == rows
+        known = set(known)
+        for metric in metrics:
+            if metric not in known and _METRIC_NAME.match(metric):
+                self._file(metric, "f8").write_bytes(np.full(rows, np.nan, dtype=_VALUE_DTYPE).tobytes())
+                known.add(metric)
+        for metric in known:
+            with open(self._file(metric, "f8"), "ab") as f:
+                f.write(np.array([metrics.get(metric, np.nan)], dtype=_VALUE_DTYPE).tobytes())
+        # ts zuletzt: bricht es vorher ab, stimmen die Längen nicht und rows() meldet None
+        ts = self._ts_int(ts)
+        with open(self._file("ts", "i8"), "ab") as f:
+            f.write(np.array([ts], dtype=_TS_DTYPE).tobytes())
+        if rolled:
+            # Bucketgrenzen einmal je Zeile, nicht je Kennzahl
+            starts = None if ts == _NAT else bucket_starts(ts)
+            if all(self._roll(metric, ts, value, starts) for metric, value in metrics.items()
+                   if _METRIC_NAME.match(metric)):
+                self._file("rollup", "rows").write_bytes(_ROLLUP_ROWS.pack(rows + 1))
+
+    def _roll(self, metric, ts, value, starts):
+        """
+        Nimmt einen Wert in die Rollups jeder Granularität auf: letzten Bucket überschreiben oder
+        einen neuen anhängen. False bei einem Zeitstempel vor dem letzten Bucket (nachträglicher
+        Eintrag); dann bleibt rollup.rows stehen und der nächste Lesezugriff baut neu auf.
+        """
+        if starts is None or np.isnan(value):
+            return True
+        for grain, start in zip(GRAINS, starts):
+            # Rohe Dateideskriptoren: je Zeile werden Kennzahlen × 3 Dateien angefasst
+            fd = os.open(os.path.join(self.path, f"{metric}.{grain}"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size >= _RECORD.size:
+                    last_start, count, lo, hi, total, last_ts, last = _RECORD.unpack(
+                        os.pread(fd, _RECORD.size, size - _RECORD.size))
+                    if start < last_start:
+                        return False
+                    if start == last_start:
+                        if ts >= last_ts:
+                            last_ts, last = ts, value
+                        os.pwrite(fd, _RECORD.pack(start, count + 1, min(lo, value), max(hi, value), total + value,
+                                                   last_ts, last), size - _RECORD.size)
+                        continue
+                os.pwrite(fd, _RECORD.pack(start, 1, value, value, value, ts, value), size - size % _RECORD.size)
+            finally:
+                os.close(fd)
+        return True
+
+    def rebuild(self, rows):
+        """Schreibt alle Spalten aus [(ts, {metric: value})] neu (über ein Temp-Verzeichnis)."""
+        tmp = self.path.with_suffix(".cols.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        ts = to_datetime64([r[0] for r in rows]).astype(np.int64)
+        (tmp / "ts.i8").write_bytes(ts.astype(_TS_DTYPE).tobytes())
+        names = {m for _, metrics in rows for m in metrics if _METRIC_NAME.match(m)}
+        for metric in names:
+            column = np.array([metrics.get(metric, np.nan) for _, metrics in rows], dtype=_VALUE_DTYPE)
+            (tmp / f"{metric}.f8").write_bytes(column.tobytes())
+        self.clear()
+        os.replace(tmp, self.path)
+        self.rebuild_rollups()
+
+    def rebuild_rollups(self):
+        """Alle Rollups aus den Spaltendateien neu (vektorisiert); rollup.rows zuletzt."""
+        self._file("rollup", "rows").unlink(missing_ok=True)
+        try:
+            ts = np.fromfile(self._file("ts", "i8"), dtype=_TS_DTYPE)
+        except FileNotFoundError:
+            return
+        for file in self.path.glob("*.f8"):
+            values = np.fromfile(file, dtype=_VALUE_DTYPE)
+            for grain in GRAINS:
+                self._file(file.stem, grain).write_bytes(rollup(ts, values, grain).tobytes())
+        self._file("rollup", "rows").write_bytes(_ROLLUP_ROWS.pack(len(ts)))
+
+    def read_rollup(self, metric, grain):
+        """Rollup-Datensätze (ROLLUP_DTYPE) einer Kennzahl, nach Bucket sortiert."""
+        try:
+            return np.fromfile(self._file(metric, grain), dtype=ROLLUP_DTYPE)
+        except FileNotFoundError:
+            return np.zeros(0, dtype=ROLLUP_DTYPE)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def read_ts(self):
+        """ts.i8 als int64-Mikrosekunden je Log-Zeile; ohne gültigen ts steht dort das int64-Minimum."""
+        try:
+            return np.fromfile(self._file("ts", "i8"), dtype=_TS_DTYPE)
+        except FileNotFoundError:
+            return np.array([], dtype=_TS_DTYPE)
+
+    def read(self, metric):
+        """(ts, values) einer Kennzahl in Log-Reihenfolge; Zeilen ohne Wert fehlen."""
+        try:
+            ts = np.fromfile(self._file("ts", "i8"), dtype=_TS_DTYPE)
+            values = np.fromfile(self._file(metric, "f8"), dtype=_VALUE_DTYPE)
+        except FileNotFoundError:
+            return EMPTY_TS, EMPTY_VALUES
+        keep = ~np.isnan(values)
+        return ts[keep].view("datetime64[us]"), values[keep]
+
+    @staticmethod
+    def _ts_int(ts):
+        try:
+            return int(np.datetime64(ts, "us").astype(np.int64))
+        except (TypeError, ValueError):
+            return _NAT
+
+
+def sort_series(ts, values):
+    """Entfernt Zeilen ohne gültigen Zeitstempel und sortiert stabil nach ts, falls nötig."""
+    valid = ~np.isnat(ts)
+    if not valid.all():
+        ts, values = ts[valid], values[valid]
+    if len(ts) > 1 and (ts[1:] < ts[:-1]).any():
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[order]
+    return ts, values
+
+
+def bucket_start(ts, grain):
+    """Beginn von Tag, ISO-Woche (Montag) oder Monat je Zeitstempel, alles int64-Mikrosekunden (UTC-naiv)."""
+    if grain not in GRAINS:
+        raise ValueError(f"Unbekannte Granularität: {grain}")
+    days = np.asarray(ts, dtype=np.int64) // _US_PER_DAY
+    if grain == "week":
+        # 1970-01-01 war ein Donnerstag
+        days = days - (days + 3) % 7
+    elif grain == "month":
+        days = days.astype("datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    return days * _US_PER_DAY
+
+
+def bucket_starts(ts):
+    """Bucketbeginn eines Zeitstempels (int64-Mikrosekunden) je Eintrag in GRAINS."""
+    days = ts // _US_PER_DAY
+    month = np.array([days], dtype="datetime64[D]").astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)[0]
+    return days * _US_PER_DAY, (days - (days + 3) % 7) * _US_PER_DAY, int(month) * _US_PER_DAY
+
+
+def rollup(ts, values, grain):
+    """
+    Aggregiert eine Kennzahl (ts als int64-Mikrosekunden, NaT/NaN fallen weg) je Bucket zu
+    ROLLUP_DTYPE. Bei gleichem ts gilt der spätere Wert als last, wie beim Anhängen.
+    """
+    ts, values = np.asarray(ts, dtype=np.int64), np.asarray(values, dtype=np.float64)
+    keep = (ts != _NAT) & ~np.isnan(values)
+    ts, values = ts[keep], values[keep]
+    if not len(ts):
+        return np.zeros(0, dtype=ROLLUP_DTYPE)
+    order = np.argsort(ts, kind="stable")
+    ts, values = ts[order], values[order]
+    starts = bucket_start(ts, grain)
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:], len(ts)] - 1
+    out = np.empty(len(first), dtype=ROLLUP_DTYPE)
+    out["start"] = starts[first]
+    out["count"] = last - first + 1
+    out["min"] = np.minimum.reduceat(values, first)
+    out["max"] = np.maximum.reduceat(values, first)
+    out["sum"] = np.add.reduceat(values, first)
+    out["last_ts"] = ts[last]
+    out["last"] = values[last]
+    return out
+
+
+def rollup_window(table, start=None, end=None, limit=None):
+    """Buckets mit start <= Bucketbeginn < end, davon die letzten limit; als ROLLUP_VIEW."""
+    table = table.view(ROLLUP_VIEW)
+    return window(table["start"], table, start, end, limit)[1]
+
+
+def pick_grain(months, max_buckets):
+    """
+    Feinste Granularität mit höchstens max_buckets Buckets, geschätzt aus der Spanne der
+    Monatswerte (months wie von rollup_window); so wird nur die gewählte Stufe gelesen.
+    """
+    if not len(months):
+        return "day"
+    span = int((months["last_ts"].max() - months["start"][0]) // np.timedelta64(1, "D")) + 1
+    if span <= max_buckets:
+        return "day"
+    if span // 7 + 2 <= max_buckets:
+        return "week"
+    return "month"
@@ -0,0 +1,758 @@
+import os, pathlib, sqlite3, struct, threading
+import numpy as np
+import serialization
+from history_columns import (GRAINS, MetricColumns, bucket_start, rollup, rollup_window, sort_series,
+                             to_datetime64, window, ROLLUP_DTYPE)
+
+# ========== KONFIGURATION ==========
+HISTORY_DIR = os.environ.get("HISTORY_DIR", ".")
+# Einträge je Tenant, die bei der Kompaktierung erhalten bleiben (0 = alle)
+MAX_ENTRIES = int(os.environ.get("HISTORY_MAX_ENTRIES", "0"))
+# Verlaufsgrafiken und Export nur über die letzten N Analysen (0 = alle)
+LOAD_LIMIT = int(os.environ.get("HISTORY_LOAD_LIMIT", "0"))
+# Analysen in der Auswahlliste des System-Tabs
+PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "100"))
+# Mehr Analysen als das: Verlaufsgrafiken aus Tages-, Wochen- oder Monatswerten (0 = immer Einzelwerte)
+ROLLUP_AFTER = int(os.environ.get("HISTORY_ROLLUP_AFTER", "500"))
+# Verlaufsgrafiken und -tabelle in der Übersicht sofort zeigen (0 = erst auf Klick laden)
+OVERVIEW_OPEN = os.environ.get("HISTORY_OVERVIEW_OPEN", "0") == "1"
+# Jede Zeile zusätzlich auf die Platte zwingen (langsamer, übersteht auch Stromausfall)
+FSYNC = os.environ.get("HISTORY_FSYNC", "0") == "1"
+# jsonl = Dateien je Tenant (Standard), sqlite = eine Datenbank mit Index auf (tenant_id, ts)
+BACKEND = os.environ.get("HISTORY_BACKEND", "jsonl")
+# Datenbankdatei für HISTORY_BACKEND=sqlite (leer = HISTORY_DIR/.history.sqlite3)
+SQLITE_PATH = os.environ.get("HISTORY_SQLITE_PATH", "")
+
+_OFFSET = struct.Struct("<Q")
+_OFFSET_DTYPE = np.dtype("<u8")
+
+
+def _ts_bound(value):
+    """Zeitgrenze als ISO-String (ts wird als ISO-String gespeichert und so verglichen)."""
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat()
+
+
+def _numeric_metrics(entry):
+    """Zahlenwerte aus entry["data"] als {metric: float}; Texte, Listen und bool zählen nicht."""
+    data = entry.get("data")
+    if not isinstance(data, dict):
+        return {}
+    metrics = {}
+    for key, value in data.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[key] = float(value)
+    return metrics
+
+
+class HistoryStore:
+    """
+    Append-only History je Tenant als JSON Lines (.history_<tenant>.jsonl).
+    - Neue Analyse = eine angehängte Zeile mit einem einzigen write() (O_APPEND),
+      statt die ganze Datei neu zu schreiben
+    - .history_<tenant>.idx hält den Byte-Offset jeder Zeile (8 Byte je Eintrag);
+      die letzten N Einträge werden gelesen, ohne den Rest zu parsen
+    - ein Absturz mitten im Schreiben hinterlässt höchstens eine halbe letzte Zeile;
+      sie wird beim Lesen ignoriert und vor dem nächsten Anhängen abgeschnitten
+    - Kompaktierung schreibt Log und Index neu (ohne kaputte Zeilen, mit
+      MAX_ENTRIES-Begrenzung) und tauscht sie atomar aus
+    - .history_<tenant>.cols/ hält jede Kennzahl als Spalte (history_columns.MetricColumns)
+      und wird beim Anhängen mitgeschrieben; Verlaufsgrafiken lesen nur diese Arrays
+    - range() sucht per searchsorted in den nach ts sortierten Zeilen (aus cols/ts.i8, bis zur
+      nächsten Änderung im Speicher) und liest über den Index nur die passenden Zeilen
+    - alte .history_<tenant>.json-Dateien werden beim ersten Zugriff übernommen
+    """
+
+    def __init__(self, directory=HISTORY_DIR, max_entries=MAX_ENTRIES, fsync=FSYNC):
+        self.directory = pathlib.Path(directory)
+        self.max_entries = max_entries
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        # tenant_id -> (Log-Stand, ts aufsteigend, Log-Zeilen dazu, Zeilenanfänge, Zeilenenden)
+        self._ts_index = {}
+        self.stats_counter = {"appends": 0, "compactions": 0, "repairs": 0, "index_rebuilds": 0,
+                              "migrations": 0, "bad_lines": 0, "column_rebuilds": 0, "rollup_rebuilds": 0,
+                              "ts_index_hits": 0, "ts_index_builds": 0}
+
+    # ---------- Pfade ----------
+    def _log_path(self, tenant_id):
+        return self.directory / f".history_{tenant_id}.jsonl"
+
+    def _index_path(self, tenant_id):
+        return self.directory / f".history_{tenant_id}.idx"
+
+    def _legacy_path(self, tenant_id):
+        return self.directory / f".history_{tenant_id}.json"
+
+    def _columns(self, tenant_id):
+        return MetricColumns(self.directory / f".history_{tenant_id}.cols")
+
+    # ---------- Schreiben ----------
+    def append(self, tenant_id, entry):
+        line = serialization.dumpb(entry) + b"\n"
+        with self._lock:
+            self._migrate(tenant_id)
+            log_path = self._log_path(tenant_id)
+            offset = self._repair_tail(log_path)
+            fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            count = self._entry_count(tenant_id, log_end=offset)
+            if count is not None:
+                with open(self._index_path(tenant_id), "ab") as f:
+                    f.write(_OFFSET.pack(offset))
+                columns = self._columns(tenant_id)
+                # Passen die Spalten nicht (mehr) zum Log, baut metric_series sie beim Lesen neu auf
+                rows, known = columns.layout()
+                if rows == count:
+                    columns.append(entry.get("ts"), _numeric_metrics(entry), rows, known)
+            self.stats_counter["appends"] += 1
+            if self.max_entries and count is not None and count + 1 > self.max_entries * 1.25:
+                # Amortisiert: erst bei 25 % Überhang neu schreiben
+                self._compact(tenant_id)
+
+    def clear(self, tenant_id):
+        with self._lock:
+            self._ts_index.pop(tenant_id, None)
+            self._columns(tenant_id).clear()
+            for path in (self._log_path(tenant_id), self._index_path(tenant_id), self._legacy_path(tenant_id)):
+                path.unlink(missing_ok=True)
+
+    def compact(self, tenant_id):
+        with self._lock:
+            self._migrate(tenant_id)
+            self._compact(tenant_id)
+
+    def _compact(self, tenant_id):
+        entries = self._read_all(tenant_id)
+        if self.max_entries:
+            entries = entries[-self.max_entries:]
+        self._write_all(tenant_id, entries)
+        self.stats_counter["compactions"] += 1
+
+    def _write_all(self, tenant_id, entries):
+        """Log und Index über Temp-Dateien neu schreiben und atomar ersetzen."""
+        log_path, index_path = self._log_path(tenant_id), self._index_path(tenant_id)
+        lines = [serialization.dumpb(e) + b"\n" for e in entries]
+        offsets, pos = [], 0
+        for line in lines:
+            offsets.append(pos)
+            pos += len(line)
+        tmp_log, tmp_index = log_path.with_suffix(".jsonl.tmp"), index_path.with_suffix(".idx.tmp")
+        with open(tmp_log, "wb") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_index.write_bytes(b"".join(_OFFSET.pack(o) for o in offsets))
+        os.replace(tmp_log, log_path)
+        # Stürzt es hier ab, passt der alte Index nicht zum Log und wird neu aufgebaut
+        os.replace(tmp_index, index_path)
+        self._columns(tenant_id).rebuild([(e.get("ts"), _numeric_metrics(e)) for e in entries])
+
+    def _repair_tail(self, log_path):
+        """Schneidet eine halb geschriebene letzte Zeile ab. Gibt die Dateigröße zurück."""
+        try:
+            size = log_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+        if size == 0:
+            return 0
+        with open(log_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return size
+            # Rückwärts bis zum letzten vollständigen Zeilenende suchen
+            end, block = size, 65536
+            while end > 0:
+                start = max(0, end - block)
+                f.seek(start)
+                chunk = f.read(end - start)
+                cut = chunk.rfind(b"\n")
+                if cut != -1:
+                    end = start + cut + 1
+                    break
+                end = start
+            f.truncate(end)
+        self.stats_counter["repairs"] += 1
+        return end
+
+    # ---------- Index ----------
+    def _entry_count(self, tenant_id, log_end=None):
+        """
+        Anzahl der Zeilen laut Index. Geprüft wird nur der letzte Offset gegen das Logende (O(1));
+        passt er nicht (Absturz, Kompaktierung, fremder Prozess), wird der Index durch Suchen der
+        Zeilenenden neu aufgebaut, ohne JSON zu parsen. log_end: Logende vor einem gerade
+        angehängten Eintrag; dann None, wenn der Neuaufbau diesen schon enthält.
+        """
+        log_path, index_path = self._log_path(tenant_id), self._index_path(tenant_id)
+        if not log_path.exists():
+            return 0
+        size = log_path.stat().st_size if log_end is None else log_end
+        if size == 0:
+            index_path.write_bytes(b"")
+            return 0
+        try:
+            with open(index_path, "rb") as f:
+                index_size = f.seek(0, os.SEEK_END)
+                if index_size % _OFFSET.size == 0:
+                    count = index_size // _OFFSET.size
+                    if count:
+                        f.seek(index_size - _OFFSET.size)
+                        (last,) = _OFFSET.unpack(f.read(_OFFSET.size))
+                        if self._line_ends_at(log_path, last, size):
+                            return count
+        except FileNotFoundError:
+            pass
+        count = self._rebuild_index(tenant_id)
+        return None if log_end is not None else count
+
+    @staticmethod
+    def _line_ends_at(log_path, offset, size):
+        """True, wenn ab offset genau eine vollständige Zeile bis size steht."""
+        if offset >= size:
+            return False
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            tail = f.read(size - offset)
+        return tail.endswith(b"\n") and tail.count(b"\n") == 1
+
+    def _offset_at(self, tenant_id, position):
+        with open(self._index_path(tenant_id), "rb") as f:
+            f.seek(position * _OFFSET.size)
+            return _OFFSET.unpack(f.read(_OFFSET.size))[0]
+
+    def _rebuild_index(self, tenant_id):
+        """Baut den Index für das ganze Log neu auf. Gibt die Zeilenzahl zurück."""
+        data = self._log_path(tenant_id).read_bytes()
+        offsets, pos = [], 0
+        while True:
+            end = data.find(b"\n", pos)
+            if end == -1:
+                break
+            offsets.append(pos)
+            pos = end + 1
+        self._index_path(tenant_id).write_bytes(b"".join(_OFFSET.pack(o) for o in offsets))
+        self.stats_counter["index_rebuilds"] += 1
+        return len(offsets)
+
+    # ---------- Lesen ----------
+    def load(self, tenant_id, limit=None):
+        """Alle Einträge des Tenants in Schreibreihenfolge, mit limit nur die letzten limit."""
+        with self._lock:
+            self._migrate(tenant_id)
+            if not limit:
+                return self._read_all(tenant_id)
+            count = self._entry_count(tenant_id)
+            if not count:
+                return []
+            start = self._offset_at(tenant_id, count - limit) if limit < count else 0
+            with open(self._log_path(tenant_id), "rb") as f:
+                f.seek(start)
+                return self._parse(f.read())
+
+    def count(self, tenant_id):
+        with self._lock:
+            self._migrate(tenant_id)
+            return self._entry_count(tenant_id)
+
+    def version(self, tenant_id):
+        """Stand der History; ändert sich bei jedem Schreibzugriff, auch aus anderen Prozessen."""
+        with self._lock:
+            self._migrate(tenant_id)
+            return self._log_version(tenant_id)
+
+    def _log_version(self, tenant_id):
+        try:
+            stat = self._log_path(tenant_id).stat()
+        except FileNotFoundError:
+            return (0, 0, 0)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    # ---------- Abfragen ----------
+    def latest(self, tenant_id, n):
+        """
+        Die neuesten n Einträge nach ts, neueste zuerst (gleiche ts: zuletzt geschriebene zuerst, wie
+        SQLite). Kommt aus dem Ende des sortierten ts-Index; gelesen werden nur diese Zeilen.
+        """
+        return list(reversed(self.range(tenant_id, limit=n))) if n else []
+
+    def range(self, tenant_id, start=None, end=None, limit=None):
+        """
+        Einträge mit start <= ts < end, nach ts sortiert (gleiche ts in Schreibreihenfolge); limit = nur
+        die letzten limit. Die Grenzen werden im sortierten ts-Index gesucht (O(log n)), gelesen und
+        geparst werden nur die Treffer. Einträge ohne gültigen ts zählen wie bisher als kleinster ts.
+        """
+        start, end = _ts_bound(start), _ts_bound(end)
+        try:
+            bounds = [None if b is None else np.datetime64(b, "us").astype(np.int64) for b in (start, end)]
+        except ValueError:
+            return self._range_scan(tenant_id, start, end, limit)
+        with self._lock:
+            self._migrate(tenant_id)
+            _, ts, rows, starts, ends = self._sorted_ts(tenant_id)
+            lo = 0 if bounds[0] is None else int(np.searchsorted(ts, bounds[0], "left"))
+            hi = len(ts) if bounds[1] is None else int(np.searchsorted(ts, bounds[1], "left"))
+            first = lo
+            if limit:
+                lo = max(lo, hi - limit)
+            entries = self._read_rows(tenant_id, rows[lo:hi], starts, ends)
+            # Kaputte Zeilen fallen weg; für limit davor im Fenster nachlesen
+            while limit and len(entries) < limit and lo > first:
+                lo, hi = max(first, lo - (limit - len(entries))), lo
+                entries = self._read_rows(tenant_id, rows[lo:hi], starts, ends) + entries
+            return entries
+
+    def _range_scan(self, tenant_id, start, end, limit):
+        """range() für Grenzen, die kein Zeitpunkt sind: ISO-Stringvergleich über das ganze Log."""
+        entries = [e for e in self.load(tenant_id)
+                   if (start is None or (e.get("ts") or "") >= start) and (end is None or (e.get("ts") or "") < end)]
+        entries.sort(key=lambda e: e.get("ts") or "")
+        return entries[-limit:] if limit else entries
+
+    def _sorted_ts(self, tenant_id):
+        """Der ts-Index des Tenants; neu aufgebaut (ts.i8 und .idx lesen, ggf. stabil sortieren) nur nach Änderungen."""
+        version = self._log_version(tenant_id)
+        cached = self._ts_index.get(tenant_id)
+        if cached and cached[0] == version:
+            self.stats_counter["ts_index_hits"] += 1
+            return cached
+        ts = self._current_columns(tenant_id).read_ts()
+        try:
+            starts = np.fromfile(self._index_path(tenant_id), dtype=_OFFSET_DTYPE)
+        except FileNotFoundError:
+            starts = np.array([], dtype=_OFFSET_DTYPE)
+        # Ein fremder Prozess kann seit dem stat() angehängt haben: nur gemeinsame Zeilen nehmen
+        n = min(len(ts), len(starts))
+        ends = np.append(starts[1:], np.uint64(version[1]))[:n]
+        ts, starts = ts[:n], starts[:n]
+        rows = np.arange(n)
+        # Meist wird in Zeitreihenfolge angehängt, dann ist nichts zu sortieren
+        if len(ts) > 1 and (ts[1:] < ts[:-1]).any():
+            rows = np.argsort(ts, kind="stable")
+            ts = ts[rows]
+        cached = self._ts_index[tenant_id] = (version, ts, rows, starts, ends)
+        self.stats_counter["ts_index_builds"] += 1
+        return cached
+
+    def _read_rows(self, tenant_id, rows, starts, ends):
+        """Einträge der Log-Zeilen rows in dieser Reihenfolge; aufeinanderfolgende Zeilen mit einem pread."""
+        if not len(rows):
+            return []
+        wanted = np.unique(rows)
+        entries = {}
+        with open(self._log_path(tenant_id), "rb") as f:
+            for run in np.split(wanted, np.flatnonzero(np.diff(wanted) != 1) + 1):
+                first, last = int(run[0]), int(run[-1])
+                data = os.pread(f.fileno(), int(ends[last] - starts[first]), int(starts[first]))
+                for row, line in zip(run.tolist(), data.split(b"\n")):
+                    try:
+                        entries[row] = serialization.loads(line) if line else None
+                    except ValueError:
+                        entries[row] = None
+                        self.stats_counter["bad_lines"] += 1
+        return [entries[row] for row in rows.tolist() if entries[row] is not None]
+
+    def metric_series(self, tenant_id, metric, start=None, end=None, limit=None):
+        """
+        (ts, values) einer Kennzahl aus entry["data"] als datetime64[us]- und float64-Array,
+        nach ts sortiert; Einträge ohne Zahlenwert fehlen. Gelesen werden nur die Spaltendateien.
+        """
+        with self._lock:
+            self._migrate(tenant_id)
+            ts, values = self._current_columns(tenant_id).read(metric)
+        return window(*sort_series(ts, values), start, end, limit)
+
+    def rollup(self, tenant_id, metric, grain, start=None, end=None, limit=None):
+        """
+        Tages-, Wochen- oder Monatswerte einer Kennzahl (grain: day|week|month) als Array mit den
+        Feldern start, count, min, max, sum, last_ts, last (Mittelwert = sum / count). Die Rollups
+        werden beim Anhängen fortgeschrieben; gelesen wird je Bucket ein Datensatz.
+        """
+        if grain not in GRAINS:
+            raise ValueError(f"Unbekannte Granularität: {grain}")
+        with self._lock:
+            self._migrate(tenant_id)
+            count = self._entry_count(tenant_id)
+            columns = self._columns(tenant_id)
+            if columns.layout()[0] != count:
+                columns.rebuild(self._column_rows(tenant_id))
+                self.stats_counter["column_rebuilds"] += 1
+            elif columns.rollup_rows() != count:
+                columns.rebuild_rollups()
+                self.stats_counter["rollup_rebuilds"] += 1
+            table = columns.read_rollup(metric, grain)
+        return rollup_window(table, start, end, limit)
+
+    def _current_columns(self, tenant_id):
+        """Die Spalten des Tenants, vorher neu aufgebaut, falls sie nicht (mehr) zum Log passen."""
+        count = self._entry_count(tenant_id)
+        columns = self._columns(tenant_id)
+        if columns.layout()[0] != count:
+            columns.rebuild(self._column_rows(tenant_id))
+            self.stats_counter["column_rebuilds"] += 1
+        return columns
+
+    def _column_rows(self, tenant_id):
+        """(ts, Kennzahlen) je Logzeile wie im Index, auch für leere und kaputte Zeilen."""
+        try:
+            data = self._log_path(tenant_id).read_bytes()
+        except FileNotFoundError:
+            return []
+        rows = []
+        for line in data.split(b"\n")[:-1]:
+            try:
+                entry = serialization.loads(line) if line else None
+            except ValueError:
+                entry = None
+            rows.append((entry.get("ts"), _numeric_metrics(entry)) if isinstance(entry, dict) else (None, {}))
+        return rows
+
+    def _read_all(self, tenant_id):
+        try:
+            return self._parse(self._log_path(tenant_id).read_bytes())
+        except FileNotFoundError:
+            return []
+
+    def _parse(self, data):
+        entries = []
+        lines = data.split(b"\n")
+        # Die letzte Zeile ohne \n ist leer oder halb geschrieben
+        for line in lines[:-1]:
+            if not line:
+                continue
+            try:
+                entries.append(serialization.loads(line))
+            except ValueError:
+                self.stats_counter["bad_lines"] += 1
+        return entries
+
+    # ---------- Migration ----------
+    def _migrate(self, tenant_id):
+        """Übernimmt einmalig .history_<tenant>.json; die alte Datei bleibt als .json.migrated liegen."""
+        legacy = self._legacy_path(tenant_id)
+        if not legacy.exists() or self._log_path(tenant_id).exists():
+            return
+        try:
+            entries = serialization.loads(legacy.read_bytes())
+        except (OSError, ValueError) as e:
+            print(f"History-Migration fehlgeschlagen: {e}")
+            return
+        self._write_all(tenant_id, entries if isinstance(entries, list) else [])
+        legacy.replace(legacy.with_suffix(".json.migrated"))
+        self.stats_counter["migrations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.stats_counter, "backend": "jsonl", "max_entries": self.max_entries,
+                    "fsync": self.fsync, "directory": str(self.directory)}
+
+
+class SqliteHistoryStore:
+    """
+    History aller Tenants in einer SQLite-Datenbank (HISTORY_BACKEND=sqlite).
+    - history: ein Eintrag je Analyse als JSON-Text, Index auf (tenant_id, ts);
+      neueste N, Zeitfenster und Anzahl lesen nur die betroffenen Indexbereiche
+    - history_metrics: jede Zahl aus entry["data"] als eigene Zeile, Primärschlüssel
+      (tenant_id, metric, ts); eine Kennzahl-Reihe ist ein zusammenhängender Indexbereich
+    - history_rollups: Tages-/Wochen-/Monatswerte je Kennzahl, beim Einfügen per UPSERT
+      fortgeschrieben; history_rollup_tenants listet die Tenants, deren Rollups vollständig sind
+    - WAL-Modus: Lesen blockiert das Schreiben nicht, auch über mehrere Prozesse
+    - vorhandene JSONL-History eines Tenants wird beim ersten Zugriff übernommen
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            tenant_id TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            entry TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_tenant_ts ON history (tenant_id, ts);
+        CREATE TABLE IF NOT EXISTS history_metrics (
+            tenant_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            entry_id INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (tenant_id, metric, ts, entry_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS history_rollups (
+            tenant_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            grain TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            lo REAL NOT NULL,
+            hi REAL NOT NULL,
+            total REAL NOT NULL,
+            last_ts INTEGER NOT NULL,
+            last_value REAL NOT NULL,
+            PRIMARY KEY (tenant_id, metric, grain, start)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS history_rollup_tenants (tenant_id TEXT PRIMARY KEY) WITHOUT ROWID;
+    """
+
+    # Ein Wert mehr im Bucket; last gilt bei gleichem ts für den neueren Eintrag
+    _ROLLUP_UPSERT = """
+        INSERT INTO history_rollups (tenant_id, metric, grain, start, n, lo, hi, total, last_ts, last_value)
+        VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+        ON CONFLICT (tenant_id, metric, grain, start) DO UPDATE SET
+            n = n + 1, lo = min(lo, excluded.lo), hi = max(hi, excluded.hi), total = total + excluded.total,
+            last_value = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_value ELSE last_value END,
+            last_ts = max(last_ts, excluded.last_ts)
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES, fsync=FSYNC, directory=HISTORY_DIR):
+        self.directory = pathlib.Path(directory)
+        self.path = str(path or SQLITE_PATH or self.directory / ".history.sqlite3")
+        self.max_entries = max_entries
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        # Eine Verbindung für alle Threads; der Lock serialisiert die Zugriffe
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.executescript(self._SCHEMA)
+        self._checked = set()
+        # Kennzahl-Reihen bleiben als Arrays im Speicher, bis die Datenbank sich ändert: eigene
+        # Schreibzugriffe zählt _writes, fremde Verbindungen (andere Prozesse) meldet PRAGMA data_version
+        self._writes = 0
+        self._series = {}
+        self.stats_counter = {"appends": 0, "compactions": 0, "pruned": 0, "migrations": 0,
+                              "bad_lines": 0, "queries": 0, "series_hits": 0, "rollup_rebuilds": 0}
+
+    # ---------- Schreiben ----------
+    def append(self, tenant_id, entry):
+        text = serialization.dumps(entry)
+        with self._lock:
+            self._migrate(tenant_id)
+            with self._conn:
+                self._insert(tenant_id, [(entry, text)])
+            self._writes += 1
+            self.stats_counter["appends"] += 1
+            if self.max_entries and self._count(tenant_id) > self.max_entries * 1.25:
+                self._prune(tenant_id)
+
+    def _insert(self, tenant_id, rows):
+        """rows: [(entry, json_text)]; läuft in der Transaktion des Aufrufers."""
+        cur = self._conn.cursor()
+        rolled = cur.execute("SELECT 1 FROM history_rollup_tenants WHERE tenant_id = ?", (tenant_id,)).fetchone()
+        if not rolled and not self._count(tenant_id):
+            # Neuer Tenant: Rollups von Anfang an mitführen
+            cur.execute("INSERT INTO history_rollup_tenants (tenant_id) VALUES (?)", (tenant_id,))
+            rolled = True
+        for entry, text in rows:
+            ts = entry.get("ts") or ""
+            cur.execute("INSERT INTO history (tenant_id, ts, entry) VALUES (?, ?, ?)", (tenant_id, ts, text))
+            entry_id = cur.lastrowid
+            metrics = _numeric_metrics(entry)
+            cur.executemany(
+                "INSERT OR REPLACE INTO history_metrics (tenant_id, metric, ts, entry_id, value) VALUES (?, ?, ?, ?, ?)",
+                [(tenant_id, metric, ts, entry_id, value) for metric, value in metrics.items()])
+            if rolled:
+                cur.executemany(self._ROLLUP_UPSERT, self._rollup_rows(tenant_id, ts, metrics))
+
+    @staticmethod
+    def _rollup_rows(tenant_id, ts, metrics):
+        """UPSERT-Parameter für einen Eintrag; ohne lesbaren Zeitstempel keine (wie bei rollup())."""
+        ts = MetricColumns._ts_int(ts)
+        if ts == np.iinfo(np.int64).min:
+            return []
+        starts = {grain: int(bucket_start(np.array([ts]), grain)[0]) for grain in GRAINS}
+        return [(tenant_id, metric, grain, starts[grain], value, value, value, ts, value)
+                for metric, value in metrics.items() if not np.isnan(value) for grain in GRAINS]
+
+    def _rebuild_rollups(self, tenant_id):
+        """Rollups eines Tenants aus history_metrics neu (vektorisiert, wie beim JSONL-Speicher)."""
+        rows = self._conn.execute(
+            "SELECT metric, ts, value FROM history_metrics WHERE tenant_id = ? ORDER BY metric, entry_id",
+            (tenant_id,)).fetchall()
+        with self._conn:
+            self._conn.execute("DELETE FROM history_rollups WHERE tenant_id = ?", (tenant_id,))
+            start = 0
+            while start < len(rows):
+                metric, stop = rows[start][0], start
+                while stop < len(rows) and rows[stop][0] == metric:
+                    stop += 1
+                ts = to_datetime64([r[1] for r in rows[start:stop]]).astype(np.int64)
+                values = np.array([r[2] for r in rows[start:stop]], dtype=np.float64)
+                for grain in GRAINS:
+                    self._conn.executemany(
+                        "INSERT INTO history_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(tenant_id, metric, grain, *r) for r in rollup(ts, values, grain).tolist()])
+                start = stop
+            self._conn.execute("INSERT OR IGNORE INTO history_rollup_tenants (tenant_id) VALUES (?)", (tenant_id,))
+        self._writes += 1
+        self.stats_counter["rollup_rebuilds"] += 1
+
+    def clear(self, tenant_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM history WHERE tenant_id = ?", (tenant_id,))
+            self._conn.execute("DELETE FROM history_metrics WHERE tenant_id = ?", (tenant_id,))
+            self._conn.execute("DELETE FROM history_rollups WHERE tenant_id = ?", (tenant_id,))
+            # Leer ist vollständig: ab jetzt wachsen die Rollups mit
+            self._conn.execute("INSERT OR IGNORE INTO history_rollup_tenants (tenant_id) VALUES (?)", (tenant_id,))
+            self._writes += 1
+
+    def compact(self, tenant_id):
+        with self._lock:
+            self._migrate(tenant_id)
+            if self.max_entries:
+                self._prune(tenant_id)
+            self._conn.execute("PRAGMA optimize")
+            self.stats_counter["compactions"] += 1
+
+    def _prune(self, tenant_id):
+        """Löscht alles vor den neuesten max_entries Einträgen (amortisiert, wie beim JSONL-Log)."""
+        cut = self._conn.execute(
+            "SELECT ts, id FROM history WHERE tenant_id = ? ORDER BY ts DESC, id DESC LIMIT 1 OFFSET ?",
+            (tenant_id, self.max_entries - 1)).fetchone()
+        if cut is None:
+            return
+        ts, entry_id = cut
+        with self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM history WHERE tenant_id = ? AND (ts < ? OR (ts = ? AND id < ?))",
+                (tenant_id, ts, ts, entry_id)).rowcount
+            self._conn.execute(
+                "DELETE FROM history_metrics WHERE tenant_id = ? AND (ts < ? OR (ts = ? AND entry_id < ?))",
+                (tenant_id, ts, ts, entry_id))
+        self._writes += 1
+        self.stats_counter["pruned"] += deleted
+        if deleted:
+            self._rebuild_rollups(tenant_id)
+
+    # ---------- Lesen ----------
+    def load(self, tenant_id, limit=None):
+        """Alle Einträge nach ts (mit limit nur die letzten limit), wie HistoryStore.load."""
+        if limit:
+            return list(reversed(self.latest(tenant_id, limit)))
+        return self.range(tenant_id)
+
+    def count(self, tenant_id):
+        with self._lock:
+            self._migrate(tenant_id)
+            return self._count(tenant_id)
+
+    def _count(self, tenant_id):
+        return self._conn.execute("SELECT COUNT(*) FROM history WHERE tenant_id = ?", (tenant_id,)).fetchone()[0]
+
+    def version(self, tenant_id):
+        """Stand der Datenbank (eigene Schreibzugriffe und PRAGMA data_version für fremde)."""
+        with self._lock:
+            self._migrate(tenant_id)
+            return (self._conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+
+    # ---------- Abfragen ----------
+    def latest(self, tenant_id, n):
+        """Die neuesten n Einträge, neueste zuerst."""
+        if not n:
+            return []
+        return self._entries(
+            "SELECT entry FROM history WHERE tenant_id = ? ORDER BY ts DESC, id DESC LIMIT ?", (tenant_id, n))
+
+    def range(self, tenant_id, start=None, end=None, limit=None):
+        """Einträge mit start <= ts < end, nach ts sortiert; limit = nur die letzten limit."""
+        where, params = self._window(tenant_id, start, end)
+        if limit:
+            rows = self._entries(f"SELECT entry FROM history WHERE {where} ORDER BY ts DESC, id DESC LIMIT ?",
+                                 params + (limit,))
+            return list(reversed(rows))
+        return self._entries(f"SELECT entry FROM history WHERE {where} ORDER BY ts, id", params)
+
+    def metric_series(self, tenant_id, metric, start=None, end=None, limit=None):
+        """
+        (ts, values) einer Kennzahl als datetime64[us]- und float64-Array, nach ts sortiert. Gelesen
+        wird nur der Indexbereich (tenant_id, metric) ohne JSON; bis zur nächsten Änderung aus dem Speicher.
+        """
+        with self._lock:
+            self._migrate(tenant_id)
+            version = (self._conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+            cached = self._series.get((tenant_id, metric))
+            if cached and cached[0] == version:
+                self.stats_counter["series_hits"] += 1
+            else:
+                rows = self._conn.execute(
+                    "SELECT ts, value FROM history_metrics WHERE tenant_id = ? AND metric = ? ORDER BY ts, entry_id",
+                    (tenant_id, metric)).fetchall()
+                ts, values = sort_series(to_datetime64([r[0] for r in rows]),
+                                         np.array([r[1] for r in rows], dtype=np.float64))
+                cached = (version, ts, values)
+                self._series[(tenant_id, metric)] = cached
+                self.stats_counter["queries"] += 1
+        return window(cached[1], cached[2], start, end, limit)
+
+    def rollup(self, tenant_id, metric, grain, start=None, end=None, limit=None):
+        """Wie HistoryStore.rollup; gelesen wird nur der Indexbereich (tenant_id, metric, grain)."""
+        if grain not in GRAINS:
+            raise ValueError(f"Unbekannte Granularität: {grain}")
+        with self._lock:
+            self._migrate(tenant_id)
+            if not self._conn.execute("SELECT 1 FROM history_rollup_tenants WHERE tenant_id = ?", (tenant_id,)).fetchone():
+                # Datenbank von vor den Rollups oder übernommene JSONL-History
+                self._rebuild_rollups(tenant_id)
+            rows = self._conn.execute(
+                "SELECT start, n, lo, hi, total, last_ts, last_value FROM history_rollups"
+                " WHERE tenant_id = ? AND metric = ? AND grain = ? ORDER BY start",
+                (tenant_id, metric, grain)).fetchall()
+            self.stats_counter["queries"] += 1
+        return rollup_window(np.array(rows, dtype=ROLLUP_DTYPE), start, end, limit)
+
+    @staticmethod
+    def _window(tenant_id, start, end):
+        where, params = "tenant_id = ? AND ", (tenant_id,)
+        start, end = _ts_bound(start), _ts_bound(end)
+        if start is not None:
+            where, params = where + "ts >= ? AND ", params + (start,)
+        if end is not None:
+            where, params = where + "ts < ? AND ", params + (end,)
+        return where[:-len(" AND ")], params
+
+    def _entries(self, sql, params):
+        with self._lock:
+            self._migrate(params[0])
+            rows = self._conn.execute(sql, params).fetchall()
+            self.stats_counter["queries"] += 1
+        entries = []
+        for (text,) in rows:
+            try:
+                entries.append(serialization.loads(text))
+            except ValueError:
+                self.stats_counter["bad_lines"] += 1
+        return entries
+
+    # ---------- Migration ----------
+    def _migrate(self, tenant_id):
+        """Übernimmt einmalig die JSONL- (oder alte JSON-)History des Tenants aus HISTORY_DIR."""
+        if tenant_id in self._checked:
+            return
+        self._checked.add(tenant_id)
+        files = HistoryStore(self.directory, max_entries=0)
+        log_path = files._log_path(tenant_id)
+        if not (log_path.exists() or files._legacy_path(tenant_id).exists()) or self._count(tenant_id):
+            return
+        entries = files.load(tenant_id)
+        with self._conn:
+            self._insert(tenant_id, [(e, serialization.dumps(e)) for e in entries if isinstance(e, dict)])
+        self._writes += 1
+        if log_path.exists():
+            log_path.replace(log_path.with_suffix(".jsonl.migrated"))
+        files._index_path(tenant_id).unlink(missing_ok=True)
+        self.stats_counter["migrations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.stats_counter, "backend": "sqlite", "max_entries": self.max_entries,
+                    "fsync": self.fsync, "path": self.path}
+
+
+def open_store(backend=BACKEND):
+    """History-Speicher nach HISTORY_BACKEND."""
+    if backend == "sqlite":
+        return SqliteHistoryStore()
+    return HistoryStore()
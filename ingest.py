@@ -0,0 +1,517 @@
+import copy, hashlib, importlib.util, io, math, os, pathlib, threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+import multiprocessing
+import pandas as pd
+import streamlit as st
+import serialization
+
+# ========== KONFIGURATION ==========
+# Ab dieser Dateigröße (MB) wird gestreamt statt komplett eingelesen. 0 = immer streamen.
+STREAM_THRESHOLD_MB = float(os.environ.get("INGEST_STREAM_THRESHOLD_MB", "25"))
+CSV_CHUNK_ROWS = int(os.environ.get("INGEST_CSV_CHUNK_ROWS", "100000"))
+# Prozesse für das parallele Einlesen mehrerer Dateien. 1 = seriell.
+WORKERS = int(os.environ.get("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Unter dieser Gesamtgröße (MB) lohnt der Start der Worker-Prozesse nicht.
+PARALLEL_MIN_MB = float(os.environ.get("INGEST_PARALLEL_MIN_MB", "5"))
+# Excel-Backend: auto = calamine falls installiert, sonst openpyxl (bzw. xlrd für .xls)
+EXCEL_ENGINE = os.environ.get("INGEST_EXCEL_ENGINE", "auto")
+# Zeilen der Stichprobe im Thin-Payload an n8n
+SAMPLE_ROWS = int(os.environ.get("N8N_SAMPLE_ROWS", "50"))
+# Cache der extrahierten Metriken je Dateiinhalt. Leeres Verzeichnis = nur Speicher.
+CACHE_ENTRIES = int(os.environ.get("METRICS_CACHE_ENTRIES", "128"))
+CACHE_DIR = os.environ.get("METRICS_CACHE_DIR", "")
+CACHE_MAX_MB = float(os.environ.get("METRICS_CACHE_MAX_MB", "100"))
+# Erhöhen, sobald sich die Extraktion ändert, damit alte Einträge nicht mehr treffen.
+CACHE_VERSION = 1
+
+SUM_COLS = ['belegt', 'frei']
+MEAN_COLS = ['vertragsdauer_durchschnitt', 'reminder_automat', 'social_facebook', 'social_google']
+HERKUNFT_KEYS = ('Online', 'Empfehlung', 'Vorbeikommen')
+STATUS_KEYS = ('bezahlt', 'offen', 'überfällig')
+
+
+def extract_metrics_from_excel(df, warn=None):
+    metrics = {}
+    try:
+        if 'belegt' in df.columns:
+            metrics['belegt'] = int(df['belegt'].sum())
+        if 'frei' in df.columns:
+            metrics['frei'] = int(df['frei'].sum())
+        if 'belegt' in metrics and 'frei' in metrics:
+            total = metrics['belegt'] + metrics['frei']
+            if total > 0:
+                metrics['belegungsgrad'] = round((metrics['belegt'] / total) * 100, 1)
+        for col in MEAN_COLS:
+            if col in df.columns:
+                metrics[col] = float(df[col].mean())
+        herkunft_cols = [c for c in df.columns if 'herkunft' in c.lower()]
+        if herkunft_cols:
+            counts = df[herkunft_cols[0]].value_counts().to_dict()
+            metrics['kundenherkunft'] = {k: counts.get(k, 0) for k in HERKUNFT_KEYS}
+        status_cols = [c for c in df.columns if 'status' in c.lower()]
+        if status_cols:
+            counts = df[status_cols[0]].value_counts().to_dict()
+            metrics['zahlungsstatus'] = {k: counts.get(k, 0) for k in STATUS_KEYS}
+    except Exception as e:
+        (warn or st.warning)(f"Excel-Warnung: {str(e)[:80]}")
+    return metrics
+
+
+def merge_data(base_dict, new_dict):
+    """
+    Führt zwei Metrik-Dicts zusammen: Skalare vom neueren Dict, Zählungen addiert.
+    Assoziativ, daher als Reducer für Teilergebnisse geeignet.
+    """
+    result = base_dict.copy() if base_dict else {}
+    if new_dict:
+        for key, value in new_dict.items():
+            if key not in ['kundenherkunft', 'zahlungsstatus', 'recommendations', 'customer_message']:
+                result[key] = value
+        if 'kundenherkunft' in new_dict:
+            result['kundenherkunft'] = dict(result.get('kundenherkunft') or {'Online': 0, 'Empfehlung': 0, 'Vorbeikommen': 0})
+            for k, v in new_dict['kundenherkunft'].items():
+                result['kundenherkunft'][k] = result['kundenherkunft'].get(k, 0) + v
+        if 'zahlungsstatus' in new_dict:
+            result['zahlungsstatus'] = dict(result.get('zahlungsstatus') or {'bezahlt': 0, 'offen': 0, 'überfällig': 0})
+            for k, v in new_dict['zahlungsstatus'].items():
+                result['zahlungsstatus'][k] = result['zahlungsstatus'].get(k, 0) + v
+    return result
+
+
+# ========== STREAMING-AGGREGATION ==========
+class MetricsAccumulator:
+    """
+    Laufende Aggregation für extract_metrics_from_excel über Chunks oder Zeilen.
+    Speicherbedarf hängt nur von der Spaltenzahl ab, nicht von der Zeilenzahl.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.sums = {c: 0 for c in SUM_COLS if c in self.columns}
+        self.means = {c: [0.0, 0] for c in MEAN_COLS if c in self.columns}
+        herkunft = [c for c in self.columns if 'herkunft' in c.lower()]
+        status = [c for c in self.columns if 'status' in c.lower()]
+        self.herkunft_col = herkunft[0] if herkunft else None
+        self.status_col = status[0] if status else None
+        self.counts = {c: Counter() for c in (self.herkunft_col, self.status_col) if c is not None}
+        # Erste Fehlermeldung je Spalte; die Auswertung bricht dort ab wie im Vollmodus
+        self.errors = {}
+        self._idx = {c: self.columns.index(c) for c in [*self.sums, *self.means, *self.counts]}
+
+    def add_frame(self, chunk):
+        for col in self.sums:
+            if col not in self.errors:
+                self._guard(col, lambda: self._add_sum(col, chunk[col].sum()))
+        for col in self.means:
+            if col not in self.errors:
+                self._guard(col, lambda: self._add_mean(col, chunk[col].sum(), int(chunk[col].count())))
+        for col, counter in self.counts.items():
+            counter.update(chunk[col].value_counts().to_dict())
+
+    def add_row(self, row):
+        for col in self.sums:
+            value = row[self._idx[col]]
+            if value is not None and col not in self.errors:
+                self._guard(col, lambda: self._add_sum(col, value))
+        for col in self.means:
+            value = row[self._idx[col]]
+            if value is not None and col not in self.errors:
+                self._guard(col, lambda: self._add_mean(col, value, 1))
+        for col, counter in self.counts.items():
+            value = row[self._idx[col]]
+            if value is not None:
+                counter[value] += 1
+
+    def _guard(self, col, fn):
+        try:
+            fn()
+        except Exception as e:
+            self.errors[col] = e
+
+    def _add_sum(self, col, value):
+        if isinstance(value, (str, bytes)):
+            raise TypeError(f"Spalte '{col}' enthält Text statt Zahlen")
+        self.sums[col] = self.sums[col] + value
+
+    def _add_mean(self, col, value, count):
+        if isinstance(value, (str, bytes)):
+            raise TypeError(f"Spalte '{col}' enthält Text statt Zahlen")
+        acc = self.means[col]
+        acc[0] += float(value)
+        acc[1] += count
+
+    def result(self, warn=None):
+        metrics = {}
+        try:
+            for col in SUM_COLS:
+                if col in self.sums:
+                    self._raise_if_failed(col)
+                    metrics[col] = int(self.sums[col])
+            if 'belegt' in metrics and 'frei' in metrics:
+                total = metrics['belegt'] + metrics['frei']
+                if total > 0:
+                    metrics['belegungsgrad'] = round((metrics['belegt'] / total) * 100, 1)
+            for col in MEAN_COLS:
+                if col in self.means:
+                    self._raise_if_failed(col)
+                    total, count = self.means[col]
+                    metrics[col] = total / count if count else float('nan')
+            if self.herkunft_col is not None:
+                counts = self.counts[self.herkunft_col]
+                metrics['kundenherkunft'] = {k: counts.get(k, 0) for k in HERKUNFT_KEYS}
+            if self.status_col is not None:
+                counts = self.counts[self.status_col]
+                metrics['zahlungsstatus'] = {k: counts.get(k, 0) for k in STATUS_KEYS}
+        except Exception as e:
+            (warn or st.warning)(f"Excel-Warnung: {str(e)[:80]}")
+        return metrics
+
+    def _raise_if_failed(self, col):
+        if col in self.errors:
+            raise self.errors[col]
+
+
+def stream_metrics_from_csv(file, chunksize=None, warn=None):
+    """Liest CSV in Chunks fester Zeilenzahl und aggregiert laufend."""
+    acc = None
+    for chunk in pd.read_csv(file, chunksize=chunksize or CSV_CHUNK_ROWS):
+        if acc is None:
+            acc = MetricsAccumulator(chunk.columns)
+        acc.add_frame(chunk)
+    if acc is None:
+        return {}
+    return acc.result(warn)
+
+
+def stream_metrics_from_xlsx(file, warn=None):
+    """Liest das erste Tabellenblatt zeilenweise über den Read-only-Iterator von openpyxl."""
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return {}
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        acc = MetricsAccumulator(columns)
+        width = len(columns)
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            acc.add_row(row)
+        return acc.result(warn)
+    finally:
+        wb.close()
+
+
+# ========== EINSTIEG FÜR UPLOADS ==========
+def _file_size(file):
+    size = getattr(file, "size", None)
+    if size is None:
+        pos = file.tell()
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(pos)
+    return size
+
+
+def should_stream(file):
+    name = file.name.lower()
+    if not name.endswith((".csv", ".xlsx")):
+        return False  # .xls kann openpyxl nicht zeilenweise lesen
+    return _file_size(file) >= STREAM_THRESHOLD_MB * 1024 * 1024
+
+
+def excel_engine(filename):
+    """Wählt das pandas-Engine für read_excel: calamine (Rust) wenn vorhanden, sonst Standard."""
+    if EXCEL_ENGINE != "auto":
+        return EXCEL_ENGINE
+    if importlib.util.find_spec("python_calamine") is not None:
+        return "calamine"
+    return None if filename.lower().endswith(".xls") else "openpyxl"
+
+
+def needed_columns(columns):
+    """
+    Spalten, die extract_metrics_from_excel tatsächlich liest, in Dateireihenfolge:
+    belegt, frei, die KPI-Spalten und jeweils die erste *herkunft*/*status*-Spalte.
+    """
+    columns = [str(c) for c in columns]
+    wanted = {c for c in SUM_COLS + MEAN_COLS if c in columns}
+    for marker in ('herkunft', 'status'):
+        first = next((c for c in columns if marker in c.lower()), None)
+        if first is not None:
+            wanted.add(first)
+    return [c for c in columns if c in wanted]
+
+
+def _category_dtypes(usecols):
+    # Text-Spalten nur für value_counts gebraucht → category spart Speicher
+    return {c: "category" for c in usecols if c not in SUM_COLS and c not in MEAN_COLS}
+
+
+def read_projected(file):
+    """
+    Liest nur die benötigten Spalten: erst die Kopfzeile, dann usecols + dtype-Hinweise.
+    Bei breiten Exporten entfällt so das Parsen und Konvertieren aller übrigen Spalten.
+    """
+    name = file.name.lower()
+    file.seek(0)
+    if name.endswith('.csv'):
+        header = pd.read_csv(file, nrows=0).columns
+        usecols = needed_columns(header)
+        file.seek(0)
+        return pd.read_csv(file, usecols=usecols, dtype=_category_dtypes(usecols))
+    engine = excel_engine(name)
+    header = pd.read_excel(file, nrows=0, engine=engine).columns
+    usecols = needed_columns(header)
+    file.seek(0)
+    return pd.read_excel(file, usecols=usecols, dtype=_category_dtypes(usecols), engine=engine)
+
+
+def read_metrics(file, warn=None):
+    """Liest eine hochgeladene Excel-/CSV-Datei und liefert das Metrik-Dict."""
+    name = file.name.lower()
+    if should_stream(file):
+        file.seek(0)
+        if name.endswith('.csv'):
+            return stream_metrics_from_csv(file, warn=warn)
+        return stream_metrics_from_xlsx(file, warn=warn)
+    return extract_metrics_from_excel(read_projected(file), warn=warn)
+
+
+# ========== PARALLELES EINLESEN ==========
+class _NamedBuffer(io.BytesIO):
+    """BytesIO mit .name/.size, damit read_metrics es wie ein UploadedFile behandelt."""
+
+    def __init__(self, name, content):
+        super().__init__(content)
+        self.name = name
+        self.size = len(content)
+
+
+def _read_metrics_worker(name, content):
+    """Läuft im Worker-Prozess. Warnungen werden gesammelt statt direkt angezeigt."""
+    warnings = []
+    try:
+        metrics = read_metrics(_NamedBuffer(name, content), warn=warnings.append)
+    except Exception as e:
+        return None, warnings, str(e)
+    return metrics, warnings, None
+
+
+def read_all_metrics(files, workers=None, warn=None, cache=None, per_file=False):
+    """
+    Liest alle Excel-/CSV-Dateien und faltet die Metriken mit merge_data zusammen.
+    Bei mehreren großen Dateien läuft das Einlesen in einem Prozess-Pool; die
+    Reihenfolge der Faltung entspricht immer der Upload-Reihenfolge.
+    Mit cache werden bereits bekannte Dateiinhalte gar nicht erst geparst.
+    Mit per_file=True zusätzlich die Einzelergebnisse, parallel zu files
+    (None für Nicht-Tabellen und unlesbare Dateien).
+    """
+    warn = warn or st.warning
+    workers = WORKERS if workers is None else workers
+    all_files = list(files)
+    files = [f for f in all_files if f.name.lower().endswith((".xlsx", ".xls", ".csv"))]
+    contents = [f.getvalue() for f in files]
+    keys = [cache.key(f.name, c) if cache else None for f, c in zip(files, contents)]
+    results = [None] * len(files)
+    todo = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            results[i] = (cached, [], None)
+        else:
+            todo.append(i)
+    total_mb = sum(len(contents[i]) for i in todo) / (1024 * 1024)
+    if workers > 1 and len(todo) > 1 and total_mb >= PARALLEL_MIN_MB:
+        ctx = multiprocessing.get_context("spawn")  # kein fork im Tornado-Prozess
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)), mp_context=ctx) as pool:
+            futures = {i: pool.submit(_read_metrics_worker, files[i].name, contents[i]) for i in todo}
+            for i, fut in futures.items():
+                try:
+                    results[i] = fut.result()
+                except Exception:
+                    # Worker abgestürzt (BrokenProcessPool, MemoryError) oder Ergebnis nicht
+                    # übertragbar: die Datei unten seriell lesen
+                    pass
+    for i in todo:
+        if results[i] is None:
+            results[i] = _read_metrics_worker(files[i].name, contents[i])
+    if cache:
+        for i in todo:
+            metrics, warnings, error = results[i]
+            if error is None and not warnings:
+                cache.put(keys[i], metrics)
+    partials = []
+    by_file = {}
+    for f, (metrics, warnings, error) in zip(files, results):
+        for w in warnings:
+            warn(w)
+        if error is not None:
+            warn(f"Konnte {f.name} nicht lesen: {error[:50]}")
+            continue
+        partials.append(metrics)
+        by_file[id(f)] = metrics
+    merged = reduce(merge_data, partials, {})
+    if per_file:
+        return merged, [by_file.get(id(f)) for f in all_files]
+    return merged
+
+
+# ========== THIN-PAYLOAD ==========
+def to_jsonable(obj):
+    """numpy-Skalare → Python, NaN/Inf → None, damit strikte JSON-Encoder nicht scheitern."""
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    if hasattr(obj, "item") and not isinstance(obj, (str, bytes)):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def profile_upload(file, sample_rows=None):
+    """
+    Kompaktes Spaltenprofil und Stichprobe der ersten Zeilen einer Excel-/CSV-Datei.
+    Liest nur sample_rows Zeilen; das Profil beschreibt daher die Stichprobe.
+    """
+    sample_rows = SAMPLE_ROWS if sample_rows is None else sample_rows
+    name = file.name.lower()
+    file.seek(0)
+    if name.endswith('.csv'):
+        df = pd.read_csv(file, nrows=sample_rows)
+    else:
+        df = pd.read_excel(file, nrows=sample_rows, engine=excel_engine(name))
+    file.seek(0)
+    columns = [{
+        "name": str(c),
+        "dtype": str(df[c].dtype),
+        "non_null": int(df[c].notna().sum()),
+        "unique": int(df[c].nunique()),
+    } for c in df.columns]
+    sample = serialization.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+    return {"columns": columns, "sample": sample, "sample_rows": len(df)}
+
+
+def build_thin_payload(file, metrics, sample_rows=None):
+    """Lokal extrahierte Metriken + Profil + Stichprobe statt der ganzen Datei."""
+    return {
+        "metrics": to_jsonable(metrics),
+        "profile": profile_upload(file, sample_rows),
+        "file": {"filename": file.name, "content_type": getattr(file, "type", None), "size": _file_size(file)},
+    }
+
+
+# ========== METRIK-CACHE ==========
+def _json_default(o):
+    # numpy-Skalare aus value_counts() & Co.
+    return o.item() if hasattr(o, "item") else str(o)
+
+
+class MetricsCache:
+    """
+    Inhaltsadressierter Cache für extrahierte Metriken.
+    Stufe 1: LRU im Speicher (prozessweit, sitzungsübergreifend).
+    Stufe 2 (optional): JSON-Dateien in disk_dir, älteste zuerst gelöscht ab disk_max_mb.
+    """
+
+    def __init__(self, max_entries=128, disk_dir=None, disk_max_mb=100.0):
+        self.max_entries = max_entries
+        self.disk_dir = pathlib.Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(filename, content):
+        # Endung gehört zum Schlüssel: dieselben Bytes als .csv und .xlsx parsen unterschiedlich
+        suffix = pathlib.Path(filename.lower()).suffix
+        digest = hashlib.sha256(content).hexdigest()
+        return f"v{CACHE_VERSION}-{suffix.lstrip('.')}-{digest}"
+
+    def get(self, key):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._mem[key])
+        metrics = self._disk_get(key)
+        with self._lock:
+            if metrics is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._mem_put(key, metrics)
+        return copy.deepcopy(metrics)
+
+    def put(self, key, metrics):
+        # Über JSON normalisieren, damit Speicher- und Platten-Treffer identisch aussehen
+        payload = serialization.dumpb(metrics, default=_json_default)
+        with self._lock:
+            self._mem_put(key, serialization.loads(payload))
+        self._disk_put(key, payload)
+
+    def _mem_put(self, key, metrics):
+        self._mem[key] = metrics
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self.disk_dir / f"{key}.json"
+        try:
+            metrics = serialization.loads(path.read_bytes())
+            os.utime(path)  # mtime dient als LRU-Zeitstempel
+            return metrics
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, payload):
+        if not self.disk_dir:
+            return
+        try:
+            tmp = self.disk_dir / f"{key}.json.tmp"
+            tmp.write_bytes(payload)
+            tmp.replace(self.disk_dir / f"{key}.json")
+            self._disk_evict()
+        except OSError as e:
+            print(f"Metrik-Cache schreiben fehlgeschlagen: {e}")
+
+    def _disk_evict(self):
+        files = []
+        for path in self.disk_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "entries": len(self._mem),
+                "disk": str(self.disk_dir) if self.disk_dir else "aus",
+            }
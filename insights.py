@@ -1,3 +1,13 @@
+import operator, os, string, threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# ========== KONFIGURATION ==========
+# Ergebnisse von build_insights im Speicher, je Kennzahlen-Stand (0 = kein Cache)
+CACHE_ENTRIES = int(os.environ.get("INSIGHTS_CACHE_ENTRIES", "256"))
+
+
 def _safe_int(v, default=0):
     try:
         return int(float(v))
@@ -11,142 +21,356 @@ def _safe_float(v, default=0.0):
         return default
 
 
-def build_insights(data: dict) -> list[dict]:
+# ========== REGELN ==========
+# when: alle Bedingungen müssen gelten, when_any: mindestens eine. Eine Bedingung ist
+# (Merkmal, Operator, Zahl oder anderes Merkmal); die Merkmale liefert _features.
+# analysis wird mit den Merkmalen formatiert. Regel 2 war ein elif zu Regel 1; die
+# Bereiche occ < 85 und occ >= 95 schließen sich ohnehin aus.
+RULES = (
+    dict(
+        id="auslastung", when=[("occ", "<", 85)],
+        title="Auslastung steigern (Kurzfrist-Aktion)",
+        impact="hoch", impact_score=9, effort="low", savings_eur=300.0,
+        kpis=["Belegungsgrad", "Belegt", "Frei"],
+        analysis="Aktuelle Auslastung {occ:.1f} % bei {belegt}/{tot} Einheiten.",
+        actions=[
+            "2-Wochen-Aktion: −10 % für Neukunden (Mindestlaufzeit ≥ 3 Monate).",
+            "Bundles: Vorauszahlung → 1. Monat gratis.",
+            "Preisstaffel für kleine Einheiten."
+        ]
+    ),
+    dict(
+        id="preis", when=[("occ", ">=", 95)],
+        title="Preisoptimierung bei Vollauslastung",
+        impact="mittel", impact_score=7, effort="low", savings_eur=200.0,
+        kpis=["Belegungsgrad"],
+        analysis="Sehr hohe Auslastung ({occ:.1f} %): Preissensitivität sinkt.",
+        actions=[
+            "Preise kleiner Einheiten testweise +3–5 %.",
+            "Warteliste & Lead-Capture auf Landingpage."
+        ]
+    ),
+    dict(
+        id="mahnwesen", when_any=[("over", ">", 0), ("open_", ">", 0)],
+        title="Mahnwesen automatisieren",
+        impact="hoch", impact_score=8, effort="medium", savings_eur=250.0,
+        kpis=["Zahlungsstatus"],
+        analysis="{paid} bezahlt, {open_} offen, {over} überfällig.",
+        actions=[
+            "E-Mail + SMS am Fälligkeitstag; nach 7 Tagen Mahnstufe 1.",
+            "Skonto 2 % bei Zahlung ≤ 7 Tage (Cashflow-Boost)."
+        ]
+    ),
+    dict(
+        id="retention", when=[("vd", "!=", 0), ("vd", "<", 6)],
+        title="Retention-Programm (Vertragsverlängerung)",
+        impact="mittel", impact_score=6, effort="medium", savings_eur=150.0,
+        kpis=["Ø Vertragsdauer", "Belegt"],
+        analysis="Ø Vertragsdauer {vd:.1f} Monate → erhöhtes Kündigungsrisiko.",
+        actions=[
+            "4 Wochen vor Ende: Upgrade-Angebot (größere Einheit −5 % im 1. Monat).",
+            "Reminder-Sequenz (E-Mail/SMS) inkl. Vorteilsargumentation."
+        ]
+    ),
+    dict(
+        # Online-Leads skalieren, wenn Empfehlungen > Online-Leads
+        id="online_leads", when=[("tot_leads", ">", 0), ("online", "<", "emp")],
+        title="Online-Leads skalieren",
+        impact="mittel", impact_score=7, effort="low", savings_eur=120.0,
+        kpis=["Social/Online", "Leads"],
+        analysis="Lead-Mix: Online {online}, Empfehlung {emp}, Vorbeikommen {walk}.",
+        actions=[
+            "Google Business: 10 neue Fotos + 5 frische Bewertungen.",
+            "LP-Optimierung (sofortige Preisabfrage)."
+        ]
+    ),
+    dict(
+        id="referral", when=[("emp", "<", 5)],
+        title="Referral-Programm",
+        impact="niedrig", impact_score=5, effort="low", savings_eur=80.0,
+        kpis=["Leads", "Empfehlungen"],
+        analysis="Empfehlungsrate ist gering.",
+        actions=[
+            "25 € Guthaben pro geworbenem Neukunden.",
+            "Dankes-Karte + QR-Code zur Bewertung."
+        ]
+    ),
+    dict(
+        id="reviews", when=[("google", "<", 60)],
+        title="Review-Boost (Google)",
+        impact="mittel", impact_score=6, effort="low", savings_eur=60.0,
+        kpis=["Google Reviews"],
+        analysis="Nur {google} Google-Reviews → Social Proof ausbaufähig.",
+        actions=[
+            "2-wöchige Bewertungsaktion mit Follow-up E-Mail.",
+        ]
+    ),
+    dict(
+        # Facebook Spend feintunen
+        id="fb_targeting", when=[("fb", ">", 200), ("occ", "<", 90)],
+        title="FB-Targeting schärfen",
+        impact="niedrig", impact_score=4, effort="medium", savings_eur=50.0,
+        kpis=["Facebook", "Belegungsgrad"],
+        analysis="Hoher FB-Traffic ({fb}) bei Auslastung {occ:.0f} %.",
+        actions=[
+            "Zielgruppe: Umzug/Studierende, Click-to-Call.",
+            "Budget auf performante Anzeigengruppen bündeln."
+        ]
+    ),
+)
+
+_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+        "==": operator.eq, "!=": operator.ne}
+# Felder jeder Empfehlung, in der Reihenfolge der Ausgabe
+_FIELDS = ("id", "title", "impact", "impact_score", "effort", "savings_eur", "kpis", "analysis", "actions")
+# Merkmale in der Reihenfolge von _features
+_FEATURES = ("belegt", "frei", "tot", "occ", "vd", "paid", "open_", "over",
+             "online", "emp", "walk", "tot_leads", "google", "fb")
+
+
+def _compile_condition(name, op, value):
     """
-    Liefert priorisierte Empfehlungen mit zusätzliche Feldern:
-    - impact_score: 0–10
-    - effort: 'low' | 'medium' | 'high'
-    - savings_eur: geschätzte monatliche Ersparnis / Mehrertrag (float)
-    - kpis: betroffene KPIs (Liste)
+    Bedingung → Funktion über das Merkmals-Tupel (Reihenfolge wie _FEATURES). Funktioniert mit
+    Zahlen (build_insights) und mit NumPy-Arrays (insight_mask). Unbekannte Merkmale oder
+    Operatoren fallen beim Import auf.
+    """
+    if isinstance(value, str):
+        valid = value in _FEATURES
+    else:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if name not in _FEATURES or op not in _OPS or not valid:
+        raise ValueError(f"Ungültige Regelbedingung: {(name, op, value)}")
+    fn, i = _OPS[op], _FEATURES.index(name)
+    if isinstance(value, str):
+        j = _FEATURES.index(value)
+        return lambda f: fn(f[i], f[j])
+    return lambda f: fn(f[i], value)
+
+
+def _rule_test(all_of, any_of):
+    """Skalarer Test einer Regel: alle Bedingungen aus all_of und, falls vorhanden, eine aus any_of."""
+    def test(f):
+        for c in all_of:
+            if not c(f):
+                return False
+        if not any_of:
+            return True
+        for c in any_of:
+            if c(f):
+                return True
+        return False
+    return test
+
+
+def _check_analysis(template):
+    # Platzhalter dürfen nur Merkmale sein; formatiert wird mit str.format_map
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field is not None and field not in _FEATURES:
+            raise ValueError(f"Unbekanntes Merkmal in analysis: {field}")
+    return template
+
+
+def _compile(rules):
+    """
+    Bereitet die Tabelle einmal beim Import vor: Regeln sortiert wie die Ausgabe von
+    build_insights (impact_score, dann savings_eur; stabil), je Regel (Regel, feste Felder,
+    analysis-Vorlage, Test für build_insights, alle-Bedingungen, irgendeine-Bedingungen);
+    die Bedingungslisten nutzt insight_mask für NumPy-Arrays.
     """
-    out = []
-    
-    # Daten extrahieren und sicher konvertieren
+    ordered = sorted(rules, key=lambda r: (r["impact_score"], r["savings_eur"]), reverse=True)
+    compiled = []
+    for rule in ordered:
+        all_of = [_compile_condition(*c) for c in rule.get("when", ())]
+        any_of = [_compile_condition(*c) for c in rule.get("when_any", ())]
+        compiled.append((rule, {k: rule[k] for k in _FIELDS}, _check_analysis(rule["analysis"]),
+                         _rule_test(all_of, any_of), all_of, any_of))
+    return tuple(compiled)
+
+
+_COMPILED = _compile(RULES)
+
+
+def _features(data):
+    """Eingangswerte der Regeln (Reihenfolge wie _FEATURES), wie bisher sicher konvertiert."""
     belegt = _safe_int(data.get("belegt", 0))
     frei = _safe_int(data.get("frei", 0))
     tot = belegt + frei
-    occ = (belegt / tot * 100) if tot > 0 else _safe_float(data.get("belegungsgrad", 0))
-    
-    vd = _safe_float(data.get("vertragsdauer_durchschnitt", 0))
-    
     pay = data.get("zahlungsstatus", {}) or {}
-    paid = _safe_int(pay.get("bezahlt", 0))
-    open_ = _safe_int(pay.get("offen", 0))
-    over = _safe_int(pay.get("überfällig", 0))
-    
     her = data.get("kundenherkunft", {}) or {}
     online = _safe_int(her.get("Online", 0))
     emp = _safe_int(her.get("Empfehlung", 0))
     walk = _safe_int(her.get("Vorbeikommen", 0))
-    
-    google = _safe_int(data.get("social_google", 0))
-    fb = _safe_int(data.get("social_facebook", 0))
-
-    # 1) Auslastung zu niedrig
-    if occ < 85:
-        out.append(dict(
-            title="Auslastung steigern (Kurzfrist-Aktion)",
-            impact="hoch", impact_score=9, effort="low", savings_eur=300.0,
-            kpis=["Belegungsgrad", "Belegt", "Frei"],
-            analysis=f"Aktuelle Auslastung {occ:.1f} % bei {belegt}/{tot} Einheiten.",
-            actions=[
-                "2-Wochen-Aktion: −10 % für Neukunden (Mindestlaufzeit ≥ 3 Monate).",
-                "Bundles: Vorauszahlung → 1. Monat gratis.",
-                "Preisstaffel für kleine Einheiten."
-            ]
-        ))
-
-    # 2) Vollauslastung → Preise anheben
-    elif occ >= 95:
-        out.append(dict(
-            title="Preisoptimierung bei Vollauslastung",
-            impact="mittel", impact_score=7, effort="low", savings_eur=200.0,
-            kpis=["Belegungsgrad"],
-            analysis=f"Sehr hohe Auslastung ({occ:.1f} %): Preissensitivität sinkt.",
-            actions=[
-                "Preise kleiner Einheiten testweise +3–5 %.",
-                "Warteliste & Lead-Capture auf Landingpage."
-            ]
-        ))
-
-    # 3) Forderungen
-    if over > 0 or open_ > 0:
-        out.append(dict(
-            title="Mahnwesen automatisieren",
-            impact="hoch", impact_score=8, effort="medium", savings_eur=250.0,
-            kpis=["Zahlungsstatus"],
-            analysis=f"{paid} bezahlt, {open_} offen, {over} überfällig.",
-            actions=[
-                "E-Mail + SMS am Fälligkeitstag; nach 7 Tagen Mahnstufe 1.",
-                "Skonto 2 % bei Zahlung ≤ 7 Tage (Cashflow-Boost)."
-            ]
-        ))
-
-    # 4) Vertragsdauer / Churn-Risiko
-    if vd and vd < 6:
-        out.append(dict(
-            title="Retention-Programm (Vertragsverlängerung)",
-            impact="mittel", impact_score=6, effort="medium", savings_eur=150.0,
-            kpis=["Ø Vertragsdauer", "Belegt"],
-            analysis=f"Ø Vertragsdauer {vd:.1f} Monate → erhöhtes Kündigungsrisiko.",
-            actions=[
-                "4 Wochen vor Ende: Upgrade-Angebot (größere Einheit −5 % im 1. Monat).",
-                "Reminder-Sequenz (E-Mail/SMS) inkl. Vorteilsargumentation."
-            ]
-        ))
-
-    # 5) Online-Leads skalieren (wenn Empfehlungen > Online-Leads)
-    tot_leads = online + emp + walk
-    if tot_leads > 0 and online < emp:
-        out.append(dict(
-            title="Online-Leads skalieren",
-            impact="mittel", impact_score=7, effort="low", savings_eur=120.0,
-            kpis=["Social/Online", "Leads"],
-            analysis=f"Lead-Mix: Online {online}, Empfehlung {emp}, Vorbeikommen {walk}.",
-            actions=[
-                "Google Business: 10 neue Fotos + 5 frische Bewertungen.",
-                "LP-Optimierung (sofortige Preisabfrage)."
-            ]
-        ))
-
-    # 6) Empfehlungsrate
-    if emp < 5:
-        out.append(dict(
-            title="Referral-Programm",
-            impact="niedrig", impact_score=5, effort="low", savings_eur=80.0,
-            kpis=["Leads", "Empfehlungen"],
-            analysis="Empfehlungsrate ist gering.",
-            actions=[
-                "25 € Guthaben pro geworbenem Neukunden.",
-                "Dankes-Karte + QR-Code zur Bewertung."
-            ]
-        ))
-
-    # 7) Reviews
-    if google < 60:
-        out.append(dict(
-            title="Review-Boost (Google)",
-            impact="mittel", impact_score=6, effort="low", savings_eur=60.0,
-            kpis=["Google Reviews"],
-            analysis=f"Nur {google} Google-Reviews → Social Proof ausbaufähig.",
-            actions=[
-                "2-wöchige Bewertungsaktion mit Follow-up E-Mail.",
-            ]
-        ))
-
-    # 8) Facebook Spend feintunen
-    if fb > 200 and occ < 90:
-        out.append(dict(
-            title="FB-Targeting schärfen",
-            impact="niedrig", impact_score=4, effort="medium", savings_eur=50.0,
-            kpis=["Facebook", "Belegungsgrad"],
-            analysis=f"Hoher FB-Traffic ({fb}) bei Auslastung {occ:.0f} %.",
-            actions=[
-                "Zielgruppe: Umzug/Studierende, Click-to-Call.",
-                "Budget auf performante Anzeigengruppen bündeln."
-            ]
-        ))
-
-    # Sortierung: erst Impact-Score, dann Ersparnis
-    out.sort(key=lambda x: (x.get("impact_score", 0), x.get("savings_eur", 0)), reverse=True)
-    return out
+    return (
+        belegt, frei, tot,
+        (belegt / tot * 100) if tot > 0 else _safe_float(data.get("belegungsgrad", 0)),
+        _safe_float(data.get("vertragsdauer_durchschnitt", 0)),
+        _safe_int(pay.get("bezahlt", 0)), _safe_int(pay.get("offen", 0)), _safe_int(pay.get("überfällig", 0)),
+        online, emp, walk, online + emp + walk,
+        _safe_int(data.get("social_google", 0)),
+        _safe_int(data.get("social_facebook", 0)),
+    )
+
+
+def _evaluate(features):
+    named = dict(zip(_FEATURES, features))
+    return [{**fields, "analysis": template.format_map(named)}
+            for _, fields, template, test, _, _ in _COMPILED if test(features)]
+
+
+# ========== CACHE ==========
+class InsightsCache:
+    """
+    LRU der Ergebnisse von build_insights, prozessweit. Schlüssel ist das Tupel der
+    Regel-Eingangswerte (nicht das ganze dict): Empfehlungstexte, Dateilisten usw. ändern
+    ihn nicht, ein anderer Wert in einer Regel-Kennzahl schon. Der Hash von int/float ist
+    in Python deterministisch; NaN trifft nie und wird jedes Mal neu ausgewertet.
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counter = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            tips = self._entries.get(key)
+            if tips is None:
+                self.stats_counter["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counter["hits"] += 1
+            return tips
+
+    def put(self, key, tips):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = tips
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counter["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.stats_counter["hits"] + self.stats_counter["misses"]
+            return {**self.stats_counter, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "hit_rate": round(self.stats_counter["hits"] / lookups, 3) if lookups else None}
+
+
+cache = InsightsCache()
+
+
+def build_insights(data: dict) -> list[dict]:
+    """
+    Liefert priorisierte Empfehlungen mit zusätzliche Feldern:
+    - id: stabiler Schlüssel der Regel (siehe RULES)
+    - impact_score: 0–10
+    - effort: 'low' | 'medium' | 'high'
+    - savings_eur: geschätzte monatliche Ersparnis / Mehrertrag (float)
+    - kpis: betroffene KPIs (Liste)
+    Gleiche Regel-Eingangswerte kommen aus dem Cache; jeder Aufruf bekommt eigene Kopien.
+    """
+    features = _features(data)
+    tips = cache.get(features)
+    if tips is None:
+        tips = _evaluate(features)
+        cache.put(features, tips)
+    return [{**t, "kpis": list(t["kpis"]), "actions": list(t["actions"])} for t in tips]
+
+
+# ========== BATCH ==========
+def _nested(v, key):
+    return v.get(key, 0) if isinstance(v, dict) else 0
+
+
+def _column(frame, path, n):
+    """
+    Spalte als float64 wie _safe_float: NaN bleibt NaN, None und Unlesbares → 0, fehlende
+    Spalte → 0. Verschachtelte Felder als "zahlungsstatus.offen" (pd.json_normalize), als
+    Spalte mit dicts oder aus einer Liste von Kennzahlen-dicts (fehlender Schlüssel → 0).
+    """
+    dotted = ".".join(path)
+    if isinstance(frame, list):
+        values = [d.get(path[0], 0) if len(path) == 1 else _nested(d.get(path[0]), path[1]) for d in frame]
+    elif dotted in frame:
+        values = frame[dotted]
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            return values.to_numpy(dtype=np.float64)
+        values = values.tolist()
+    elif len(path) == 2 and path[0] in frame:
+        values = [_nested(v, path[1]) for v in frame[path[0]]]
+    else:
+        return np.zeros(n)
+    # Gemischte Spalten einzeln: pd.to_numeric machte aus None und NaN dasselbe
+    return np.fromiter((_safe_float(v) for v in values), dtype=np.float64, count=n)
+
+
+def insight_mask(frame) -> pd.DataFrame:
+    """
+    Wertet alle Regeln von build_insights als NumPy-Masken aus, eine Zeile je Snapshot.
+    frame: DataFrame, dict von Arrays oder Liste von Kennzahlen-dicts. In einem DataFrame
+    zählt eine Lücke (NaN) als NaN; fehlende Schlüssel wie build_insights (→ 0) nur als Liste.
+    Ergebnis: bool-DataFrame (Index wie frame, Spalten = Regel-ids in Ausgabereihenfolge).
+    """
+    if isinstance(frame, list):
+        index = pd.RangeIndex(len(frame))
+    else:
+        frame = frame if isinstance(frame, pd.DataFrame) else pd.DataFrame(frame)
+        index = frame.index
+    n = len(index)
+    col = lambda *path: _column(frame, path, n)
+    # _safe_int: Richtung 0 abgeschnitten, NaN → 0
+    whole = lambda *path: np.nan_to_num(np.trunc(col(*path)), nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+    # Dieselben Merkmale wie _features, als Arrays
+    belegt, frei = whole("belegt"), whole("frei")
+    tot = belegt + frei
+    with np.errstate(divide="ignore", invalid="ignore"):
+        occ = np.where(tot > 0, belegt / tot * 100, col("belegungsgrad"))
+    online, emp = whole("kundenherkunft", "Online"), whole("kundenherkunft", "Empfehlung")
+    walk = whole("kundenherkunft", "Vorbeikommen")
+    features = (
+        belegt, frei, tot, occ,
+        col("vertragsdauer_durchschnitt"),
+        whole("zahlungsstatus", "bezahlt"),
+        whole("zahlungsstatus", "offen"),
+        whole("zahlungsstatus", "überfällig"),
+        online, emp, walk, online + emp + walk,
+        whole("social_google"), whole("social_facebook"),
+    )
+    masks = {}
+    for rule, _, _, _, all_of, any_of in _COMPILED:
+        mask = np.ones(n, dtype=bool)
+        for c in all_of:
+            mask &= c(features)
+        if any_of:
+            mask &= np.logical_or.reduce([c(features) for c in any_of])
+        masks[rule["id"]] = mask
+    return pd.DataFrame(masks, index=index)
+
+
+def build_insights_batch(frame) -> pd.DataFrame:
+    """
+    build_insights für viele Snapshots auf einmal (Trendansichten, Portfolio-Berichte).
+    Ergebnis im Langformat, eine Zeile je Empfehlung, je Snapshot in derselben Reihenfolge
+    wie build_insights: row (Index von frame), rank, id, title, impact_score, savings_eur.
+    """
+    mask = insight_mask(frame)
+    hits = mask.to_numpy()
+    rows, cols = np.nonzero(hits)
+    ranks = (np.cumsum(hits, axis=1) - 1)[rows, cols]
+    rules = [c[0] for c in _COMPILED]
+    return pd.DataFrame({
+        "row": mask.index.to_numpy()[rows],
+        "rank": ranks,
+        "id": np.array([r["id"] for r in rules], dtype=object)[cols],
+        "title": np.array([r["title"] for r in rules], dtype=object)[cols],
+        "impact_score": np.array([r["impact_score"] for r in rules])[cols],
+        "savings_eur": np.array([r["savings_eur"] for r in rules])[cols],
+    })
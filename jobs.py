@@ -0,0 +1,71 @@
+import os, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ========== KONFIGURATION ==========
+# Analysen laufen als Hintergrund-Jobs statt im Skript-Thread. 0 = klassisch blockierend.
+BACKGROUND = os.environ.get("ANALYSIS_BACKGROUND", "1") != "0"
+WORKERS = int(os.environ.get("ANALYSIS_WORKERS", "4"))
+MAX_PENDING = int(os.environ.get("ANALYSIS_MAX_PENDING", "16"))
+POLL_SECONDS = float(os.environ.get("ANALYSIS_POLL_SECONDS", "2"))
+# Abgeschlossene, nie abgeholte Jobs (Session geschlossen) werden danach verworfen.
+RESULT_TTL = float(os.environ.get("ANALYSIS_RESULT_TTL", "3600"))
+
+
+class JobRunner:
+    """
+    Begrenzter Thread-Pool für lange n8n-Aufrufe.
+    Jobs sind über ihre ID abrufbar; die Session speichert nur die ID.
+    Die Job-Funktion darf st.* nicht verwenden, sie läuft ohne Skript-Kontext.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self._capacity = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, fn, *args, **kwargs):
+        """Startet fn im Hintergrund. Gibt die Job-ID zurück oder None, wenn alles belegt ist."""
+        self._prune()
+        if not self._capacity.acquire(blocking=False):
+            return None
+        job_id = str(uuid.uuid4())
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._capacity.release())
+        with self._lock:
+            self._jobs[job_id] = {"future": future, "submitted": time.time(), "finished": None}
+        future.add_done_callback(lambda _: self._mark_finished(job_id))
+        return job_id
+
+    def _mark_finished(self, job_id):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["finished"] = time.time()
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return "unknown"
+        future = job["future"]
+        if not future.done():
+            return "running"
+        return "failed" if future.exception() is not None else "done"
+
+    def pop_result(self, job_id):
+        """Holt das Ergebnis eines fertigen Jobs ab und entfernt ihn aus der Registry."""
+        with self._lock:
+            job = self._jobs.pop(job_id)
+        return job["future"].result()
+
+    def _prune(self):
+        cutoff = time.time() - RESULT_TTL
+        with self._lock:
+            stale = [jid for jid, job in self._jobs.items() if job["finished"] and job["finished"] < cutoff]
+            for jid in stale:
+                del self._jobs[jid]
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if not job["future"].done())
+            return {"running_or_queued": running, "finished_uncollected": len(self._jobs) - running}
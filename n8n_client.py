@@ -0,0 +1,400 @@
+import base64, copy, os, random, threading, time, uuid, zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import serialization
+from serialization import response_json
+from contract import N8NResponseValidator, merge_n8n_results, parse_supabase_response, parse_supabase_stream
+
+# ========== KONFIGURATION ==========
+CONNECT_TIMEOUT = float(os.environ.get("N8N_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("N8N_READ_TIMEOUT", "120"))
+POOL_SIZE = int(os.environ.get("N8N_POOL_SIZE", "10"))
+MAX_CONCURRENCY = int(os.environ.get("N8N_MAX_CONCURRENCY", "8"))
+RETRIES = int(os.environ.get("N8N_RETRIES", "3"))
+BACKOFF = float(os.environ.get("N8N_BACKOFF", "0.5"))
+RETRY_STATUS = (429, 502, 503, 504)
+# Upload an /analyze-with-deepseek: json (Base64 im JSON, bisheriges Format), multipart oder raw
+UPLOAD_MODE = os.environ.get("N8N_UPLOAD_MODE", "json")
+UPLOAD_GZIP = os.environ.get("N8N_UPLOAD_GZIP", "0") == "1"
+UPLOAD_CHUNK = 64 * 1024
+# full = immer die ganze Datei senden; thin = bei Tabellen nur Metriken, Profil und Stichprobe
+PAYLOAD_MODE = os.environ.get("N8N_PAYLOAD_MODE", "full")
+# Gleichzeitige Analyse-Aufrufe beim Fan-out über mehrere Dateien einer Analyse
+FANOUT_PARALLEL = int(os.environ.get("N8N_FANOUT_PARALLEL", "4"))
+# Wie lange ein geladener get-last-analysis-Contract ohne Rückfrage gilt (Sekunden)
+LAST_ANALYSIS_TTL = float(os.environ.get("N8N_LAST_ANALYSIS_TTL", "300"))
+# Antworten von get-last-analysis-only ab dieser Größe (oder ohne Content-Length) zeilenweise parsen
+STREAM_MIN_BYTES = int(float(os.environ.get("N8N_STREAM_MIN_KB", "1024")) * 1024)
+
+
+class N8NClient:
+    """
+    Gemeinsamer HTTP-Client für alle n8n-Webhooks.
+    - Keep-Alive-Pool (requests.Session), Verbindungen werden über Aufrufe hinweg wiederverwendet
+    - begrenzte Parallelität über Semaphore und blockierenden Pool
+    - getrennte Connect-/Read-Timeouts
+    - Verbindungsaufbau wird immer wiederholt (Request ist dann noch nicht raus),
+      Read-Fehler und 429/5xx nur bei idempotenten Aufrufen, mit Jitter-Backoff
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, pool_size=POOL_SIZE,
+                 max_concurrency=MAX_CONCURRENCY, retries=RETRIES, backoff=BACKOFF):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.stats_counter = {"requests": 0, "retries": 0, "errors": 0}
+        self.session = requests.Session()
+        connect_retry = Retry(total=None, connect=retries, read=0, status=0, other=0, redirect=0,
+                              backoff_factor=backoff, backoff_jitter=backoff, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True,
+                              max_retries=connect_retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats_counter[key] += 1
+
+    def _sleep_backoff(self, attempt):
+        # Full Jitter: zufällig zwischen 0 und backoff * 2^attempt
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def post(self, url, idempotent=False, read_timeout=None, **kwargs):
+        """POST mit Pool, Timeouts und – bei idempotent=True – Wiederholungen."""
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        if "json" in kwargs:
+            # Body selbst kodieren: schnelles Backend statt requests' stdlib-json
+            kwargs["data"] = serialization.dumpb(kwargs.pop("json"))
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), "Content-Type": "application/json"}
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            self._count("requests")
+            try:
+                with self._slots:
+                    response = self.session.post(url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    self._count("errors")
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS or last:
+                    return response
+                response.close()
+            self._count("retries")
+            self._sleep_backoff(attempt)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.stats_counter)
+
+    def close(self):
+        self.session.close()
+
+
+# ========== UPLOAD-KODIERUNG ==========
+class _ChainReader:
+    """
+    Liest mehrere Puffer (bytes/memoryview) nacheinander, ohne sie zu kopieren.
+    Hat __len__, damit requests einen Content-Length-Header setzt statt chunked zu senden.
+    """
+
+    def __init__(self, parts):
+        self._parts = [memoryview(p).cast("B") for p in parts]
+        self._len = sum(len(p) for p in self._parts)
+        self._idx = 0
+        self._pos = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(UPLOAD_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._len
+        out = []
+        while size > 0 and self._idx < len(self._parts):
+            part = self._parts[self._idx]
+            piece = part[self._pos:self._pos + size]
+            out.append(bytes(piece))
+            size -= len(piece)
+            self._pos += len(piece)
+            if self._pos >= len(part):
+                self._idx += 1
+                self._pos = 0
+        return b"".join(out)
+
+
+def _gzip_stream(reader):
+    """Komprimiert chunkweise; der Body geht dann per Transfer-Encoding: chunked raus."""
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → gzip-Container
+    for chunk in reader:
+        data = comp.compress(chunk)
+        if data:
+            yield data
+    yield comp.flush()
+
+
+def build_upload(mode, fields, filename, content, content_type, gzip_body=False):
+    """
+    Erzeugt die requests-Argumente für den Datei-Upload.
+    - json: bisheriges Format, Datei Base64-kodiert im JSON (mehrere Kopien im Speicher)
+    - multipart: fields als JSON-Teil "meta", Datei als Teil "file", ohne Base64
+    - raw: Datei als Body, fields als X-N8N-*-Header
+    content darf bytes oder memoryview sein (z. B. UploadedFile.getvalue(), ohne Kopie).
+    """
+    content_type = content_type or "application/octet-stream"
+    if mode == "json":
+        payload = dict(fields)
+        payload["file"] = {"filename": filename, "content_type": content_type,
+                           "data": base64.b64encode(content).decode("utf-8")}
+        return {"json": payload, "headers": {"Content-Type": "application/json"}}
+    if mode == "multipart":
+        boundary = uuid.uuid4().hex
+        meta = serialization.dumpb(fields)
+        safe_name = filename.replace('"', "'")
+        head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="meta"\r\n'
+            f"Content-Type: application/json\r\n\r\n"
+        ).encode("utf-8") + meta + (
+            f"\r\n--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{safe_name}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        body = _ChainReader([head, content, tail])
+        headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    elif mode == "raw":
+        body = _ChainReader([content])
+        headers = {"Content-Type": content_type, "X-N8N-Filename": quote(filename)}
+        for key, value in fields.items():
+            header = "X-N8N-" + key.replace("_", "-").title()
+            headers[header] = quote(value if isinstance(value, str) else serialization.dumps(value))
+    else:
+        raise ValueError(f"Unbekannter Upload-Modus: {mode}")
+    if gzip_body:
+        headers["Content-Encoding"] = "gzip"
+        return {"data": _gzip_stream(body), "headers": headers}
+    return {"data": body, "headers": headers}
+
+
+def wants_full_file(json_response):
+    """Antwort auf einen Thin-Payload, mit der n8n doch die vollständige Datei anfordert."""
+    return isinstance(json_response, dict) and (
+        json_response.get("need_file") is True or json_response.get("status") == "need_file")
+
+
+def content_length(response):
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def is_not_modified(response):
+    """HTTP 304: der zuletzt geladene Stand ist noch aktuell. Entschieden nur am Status, der Body bleibt ungelesen."""
+    return response.status_code == 304
+
+
+def is_not_modified_body(body):
+    """{"status": "not_modified"} als bereits gelesener (kleiner) Body: gleichbedeutend mit 304."""
+    return isinstance(body, dict) and body.get("status") == "not_modified"
+
+
+# ========== CACHE FÜR get-last-analysis-only ==========
+class LastAnalysisCache:
+    """
+    Sitzungsübergreifender Cache des geparsten Contracts je (Basis-URL, Tenant).
+    Innerhalb der TTL wird n8n gar nicht gefragt. Danach bleibt der Eintrag als
+    Vergleichsstand erhalten: analysis_date und ETag gehen mit der Anfrage raus,
+    und eine not-modified-Antwort verlängert ihn, ohne neu zu parsen.
+    """
+
+    def __init__(self, ttl=LAST_ANALYSIS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.stats_counter = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Contract innerhalb der TTL, sonst None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry["fetched_at"] < self.ttl:
+                self.stats_counter["hits"] += 1
+                return copy.deepcopy(entry["contract"])
+            self.stats_counter["misses"] += 1
+            return None
+
+    def validators(self, key):
+        """(analysis_date, etag) des letzten Stands für die bedingte Anfrage."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return (entry["version"], entry["etag"]) if entry else (None, None)
+
+    def revalidate(self, key):
+        """Nach not-modified: Eintrag verlängern und zurückgeben."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry["fetched_at"] = time.time()
+            self.stats_counter["not_modified"] += 1
+            return copy.deepcopy(entry["contract"])
+
+    def put(self, key, contract, version=None, etag=None):
+        with self._lock:
+            self._entries[key] = {"contract": copy.deepcopy(contract), "version": version,
+                                  "etag": etag, "fetched_at": time.time()}
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats_counter["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.stats_counter, "entries": len(self._entries), "ttl_s": self.ttl}
+
+
+# ========== WEBHOOK-AUFRUFE ==========
+def post_to_n8n_analyze(base_url, tenant_id, uuid_str, file_info, client, thin=None):
+    """
+    Schickt eine Datei an analyze-with-deepseek. Mit thin (siehe ingest.build_thin_payload)
+    gehen zuerst nur Metriken, Spaltenprofil und Stichprobe raus; die Datei folgt nur,
+    wenn n8n sie mit need_file anfordert.
+    """
+    url = f"{base_url.rstrip('/')}/analyze-with-deepseek"
+    filename, file_content, file_type = file_info
+    fields = {
+        "tenant_id": tenant_id,
+        "uuid": uuid_str,
+        "action": "analyze_with_deepseek",
+        "metadata": {"source": "streamlit", "timestamp": datetime.now().isoformat()}
+    }
+    try:
+        json_response = None
+        if thin is not None:
+            response = client.post(url, json={**fields, "action": "analyze_metrics", **thin})
+            if response.status_code != 200:
+                return {"status": "error", "message": f"HTTP {response.status_code}"}
+            json_response = response_json(response)
+            if wants_full_file(json_response):
+                json_response = None
+        if json_response is None:
+            upload = build_upload(UPLOAD_MODE, fields, filename, file_content, file_type, gzip_body=UPLOAD_GZIP)
+            response = client.post(url, **upload)
+            if response.status_code != 200:
+                return {"status": "error", "message": f"HTTP {response.status_code}"}
+            json_response = response_json(response)
+        if isinstance(json_response, dict) and "status" in json_response:
+            standardized = json_response
+        else:
+            validated_data, error = N8NResponseValidator.validate_response(json_response)
+            if validated_data:
+                standardized = {"status": "success", "data": validated_data}
+            else:
+                standardized = {"status": "error", "data": {}}
+        return {
+            "status": "success",
+            "message": "Analyse erfolgreich",
+            "data": standardized.get("data", {}) if standardized.get("status") == "success" else None
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+def post_all_to_n8n_analyze(base_url, tenant_id, files_info, client, thins=None):
+    """
+    Fan-out: analysiert alle Dateien parallel (höchstens FANOUT_PARALLEL gleichzeitig)
+    und führt die Antworten zusammen. Fehler werden je Datei in "files" gemeldet.
+    """
+    thins = thins or [None] * len(files_info)
+    with ThreadPoolExecutor(max_workers=max(1, min(FANOUT_PARALLEL, len(files_info)))) as pool:
+        futures = [pool.submit(post_to_n8n_analyze, base_url, tenant_id, str(uuid.uuid4()), info, client, thin)
+                   for info, thin in zip(files_info, thins)]
+        results = [f.result() for f in futures]
+    files = []
+    parts = []
+    for (filename, _, _), res in zip(files_info, results):
+        if res["status"] == "success" and res.get("data"):
+            parts.append(res["data"])
+            files.append({"file": filename, "status": "success", "message": res.get("message", "")})
+        else:
+            files.append({"file": filename, "status": "error", "message": res.get("message") if res["status"] != "success" else "Keine verwertbaren Daten"})
+    if not parts:
+        messages = "; ".join(f"{f['file']}: {f['message']}" for f in files)
+        return {"status": "error", "message": messages or "Keine Dateien", "files": files}
+    return {
+        "status": "success",
+        "message": f"{len(parts)}/{len(files)} Dateien erfolgreich analysiert",
+        "data": merge_n8n_results(parts),
+        "files": files
+    }
+
+
+def fetch_last_analysis(client, cache, base_url, tenant_id):
+    """
+    Holt den Contract der letzten Analyse, bevorzugt aus dem TTL-Cache.
+    Nach Ablauf der TTL wird bedingt angefragt (if_analysis_date / If-None-Match).
+    Gibt (contract, rohe Antwort) zurück; contract ist None bei einem HTTP-Fehlerstatus,
+    die rohe Antwort None, wenn nichts neu geparst wurde. Große Antworten werden
+    zeilenweise aus dem Strom ausgewertet; statt der rohen Antwort kommt dann nur
+    eine Zusammenfassung zurück.
+    """
+    key = (base_url.rstrip('/'), tenant_id)
+    contract = cache.get(key)
+    if contract is not None:
+        return contract, None
+    version, etag = cache.validators(key)
+    payload = {"tenant_id": tenant_id, "uuid": str(uuid.uuid4())}
+    headers = {}
+    if version:
+        payload["if_analysis_date"] = version
+    if etag:
+        headers["If-None-Match"] = etag
+    # Reiner Lesezugriff, daher als idempotent wiederholbar
+    response = client.post(
+        f"{base_url.rstrip('/')}/get-last-analysis-only",
+        json=payload,
+        headers=headers,
+        idempotent=True,
+        read_timeout=10,
+        stream=True
+    )
+    with response:
+        if (version or etag) and is_not_modified(response):
+            contract = cache.revalidate(key)
+            if contract is not None:
+                return contract, None
+        if response.status_code != 200:
+            return None, None
+        length = content_length(response)
+        if length is None or length >= STREAM_MIN_BYTES:
+            stats = {}
+            contract = parse_supabase_stream(response.iter_content(chunk_size=UPLOAD_CHUNK), stats)
+            supabase_data = {"streamed": True, "rows": stats.get("rows"), "bytes": length}
+        else:
+            supabase_data = response_json(response)
+            if (version or etag) and is_not_modified_body(supabase_data):
+                contract = cache.revalidate(key)
+                if contract is not None:
+                    return contract, None
+            contract = parse_supabase_response(supabase_data)
+    if contract.get('status') == 'success':
+        cache.put(key, contract, version=contract.get('data', {}).get('analysis_date') or None, etag=response.headers.get('ETag'))
+    return contract, supabase_data
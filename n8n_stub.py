@@ -0,0 +1,262 @@
+"""
+Lokaler Ersatz für die n8n-Webhooks, um Upload und Antwortverarbeitung ohne echte
+n8n-Instanz zu testen.
+
+    python n8n_stub.py --port 5678
+    N8N_BASE_URL=http://127.0.0.1:5678/webhook streamlit run app.py
+
+/analyze-with-deepseek nimmt alle Upload-Modi aus n8n_client.build_upload an
+(json, multipart, raw, jeweils optional gzip), wertet Excel/CSV lokal mit
+ingest.read_metrics aus und merkt sich das Ergebnis je Tenant.
+Thin-Payloads (action analyze_metrics) werden direkt beantwortet, mit
+--require-file stattdessen mit need_file.
+/get-last-analysis-only liefert die gemerkten Analysen im Supabase-Zeilenformat,
+mit ETag; bei passendem if_analysis_date oder If-None-Match nur 304.
+
+Für Last- und Robustheitstests (bench/bench_n8n.py) lassen sich Latenz,
+Antwortgröße und Antwortform einstellen:
+
+    python n8n_stub.py --latency-ms 800 --jitter-ms 200 --analyze-shape flat \
+        --last-shape rows --filler-rows 50 --padding-kb 64 --recommendations 20
+"""
+import argparse, base64, gzip, hashlib, json, random, threading, time
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+
+def _read_body(handler):
+    if handler.headers.get("Transfer-Encoding", "").lower() == "chunked":
+        parts = []
+        while True:
+            size = int(handler.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                handler.rfile.readline()
+                break
+            parts.append(handler.rfile.read(size))
+            handler.rfile.readline()
+        body = b"".join(parts)
+    else:
+        body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+    if handler.headers.get("Content-Encoding", "").lower() == "gzip":
+        body = gzip.decompress(body)
+    return body
+
+
+def decode_upload(headers, body):
+    """Gibt (mode, fields, filename, content) für jeden Upload-Modus zurück."""
+    content_type = headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        payload = json.loads(body)
+        file = payload.pop("file", {}) or {}
+        return "json", payload, file.get("filename", ""), base64.b64decode(file.get("data", ""))
+    if content_type.startswith("multipart/form-data"):
+        msg = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+        fields, filename, content = {}, "", b""
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "meta":
+                fields = json.loads(part.get_payload(decode=True))
+            elif name == "file":
+                filename = part.get_filename() or ""
+                content = part.get_payload(decode=True)
+        return "multipart", fields, filename, content
+    fields = {}
+    for key, value in headers.items():
+        if key.lower().startswith("x-n8n-") and key.lower() != "x-n8n-filename":
+            fields[key[6:].lower().replace("-", "_")] = unquote(value)
+    return "raw", fields, unquote(headers.get("X-N8N-Filename", "")), body
+
+
+# Antwortformen, die n8n-Workflows in freier Wildbahn liefern (siehe contract.py)
+ANALYZE_SHAPES = ("status", "data", "flat", "analysis_result", "metrics_string", "list")
+LAST_SHAPES = ("rows", "rows_dict", "row", "contract")
+
+
+def shape_analyze(analysis, shape, received=None):
+    """Verpackt eine Analyse wie ein bestimmter analyze-with-deepseek-Workflow."""
+    if shape == "data":
+        return {"data": analysis}
+    if shape == "flat":
+        return analysis
+    if shape == "analysis_result":
+        return {"analysis_result": analysis, "recommendations": analysis["recommendations"],
+                "customer_message": analysis["customer_message"], "analysis_date": analysis["analysis_date"]}
+    if shape == "metrics_string":
+        return {**analysis, "metrics": json.dumps(analysis["metrics"], ensure_ascii=False)}
+    if shape == "list":
+        return [analysis]
+    return {"status": "success", "data": analysis, "received": received}
+
+
+def filler_rows(tenant_id, count):
+    """Ältere Supabase-Zeilen ohne verwertbare Analyse, wie sie der Parser überspringen muss."""
+    rows = []
+    for i in range(count):
+        row = {"tenant_id": tenant_id, "created_at": f"2000-01-01T00:00:{i % 60:02d}"}
+        if i % 2:
+            row.update({"_for_supabase": True, "analysis_result": "{}"})
+        else:
+            row["analysis_result"] = "undefined"
+        rows.append(row)
+    return rows
+
+
+def shape_last(rows, shape, filler=0):
+    """Verpackt die gemerkten Zeilen wie ein bestimmter get-last-analysis-Workflow."""
+    if shape == "row":
+        return rows[-1] if rows else {}
+    if shape == "contract":
+        if not rows:
+            return {"status": "success", "count": 0, "data": {}}
+        return {"status": "success", "tenant_id": rows[-1]["tenant_id"], "count": 1,
+                "data": json.loads(rows[-1]["analysis_result"])}
+    tenant_id = rows[-1]["tenant_id"] if rows else None
+    out = filler_rows(tenant_id, filler) + rows
+    if shape == "rows_dict":
+        out = [dict(r, analysis_result=json.loads(r["analysis_result"]))
+               if r["analysis_result"] != "undefined" else r for r in out]
+    return out
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {}        # tenant_id -> Liste von Supabase-Zeilen
+        self.requests = []    # Protokoll der empfangenen Uploads
+        self.require_file = False  # Thin-Payloads mit need_file beantworten
+        self.latency_ms = 0.0      # künstliche Bearbeitungszeit je Anfrage
+        self.jitter_ms = 0.0       # gleichverteilt ± um latency_ms
+        self.analyze_shape = "status"
+        self.last_shape = "rows"
+        self.filler_rows = 0       # zusätzliche unbrauchbare Zeilen in get-last
+        self.padding_kb = 0        # Füllfeld je Analyse, für große Antworten
+        self.recommendations = 1   # Anzahl Empfehlungen je Analyse
+
+    def configure(self, **options):
+        for key, value in options.items():
+            if not hasattr(self, key):
+                raise TypeError(f"Unbekannte Stub-Option {key}")
+            setattr(self, key, value)
+        return self
+
+    def delay(self):
+        seconds = (self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Kopfzeilen und Body gehen getrennt raus; mit Nagle wartet der Body auf das verzögerte ACK (~40 ms)
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200, headers=None):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = _read_body(self)
+        self.state.delay()
+        if self.path.endswith("/analyze-with-deepseek"):
+            self._send_json(self._analyze(body))
+        elif self.path.endswith("/get-last-analysis-only"):
+            request = json.loads(body or b"{}")
+            with self.state.lock:
+                rows = list(self.state.rows.get(request.get("tenant_id"), []))
+            latest = json.loads(rows[-1]["analysis_result"])["analysis_date"] if rows else None
+            etag = f'"{hashlib.sha1(latest.encode()).hexdigest()}"' if latest else None
+            if latest and (request.get("if_analysis_date") == latest or self.headers.get("If-None-Match") == etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._send_json(shape_last(rows, self.state.last_shape, self.state.filler_rows),
+                            headers={"ETag": etag} if etag else None)
+        else:
+            self._send_json({"status": "error", "message": f"Unbekannter Pfad {self.path}"}, 404)
+
+    def _analyze(self, body):
+        mode, fields, filename, content = decode_upload(self.headers, body)
+        metrics, warnings = {}, []
+        if mode == "json" and fields.get("action") == "analyze_metrics":
+            # Thin-Payload: Metriken kommen schon fertig, die Datei nur auf Anforderung
+            if self.state.require_file:
+                return {"status": "need_file"}
+            metrics = fields.get("metrics") or {}
+            filename = (fields.get("file") or {}).get("filename", "")
+        elif filename.lower().endswith((".xlsx", ".xls", ".csv")):
+            from ingest import read_metrics, _NamedBuffer
+            try:
+                metrics = read_metrics(_NamedBuffer(filename, content), warn=warnings.append)
+            except Exception as e:
+                warnings.append(str(e))
+        analysis = {
+            "metrics": json.loads(json.dumps(metrics, default=lambda o: o.item() if hasattr(o, "item") else str(o))),
+            "recommendations": [f"Stub-Empfehlung {i + 1} für {filename or 'Upload'}"
+                                for i in range(self.state.recommendations)],
+            "customer_message": "Analyse durch lokalen n8n-Stub",
+            "analysis_date": datetime.now().isoformat(),
+        }
+        if self.state.padding_kb:
+            analysis["details"] = "x" * (self.state.padding_kb * 1024)
+        tenant_id = fields.get("tenant_id")
+        received = {"mode": mode, "bytes": len(content), "sha256": hashlib.sha256(content).hexdigest(),
+                    "filename": filename, "warnings": warnings}
+        with self.state.lock:
+            self.state.requests.append(received)
+            self.state.rows.setdefault(tenant_id, []).append({
+                "tenant_id": tenant_id,
+                "created_at": analysis["analysis_date"],
+                "analysis_result": json.dumps(analysis, ensure_ascii=False),
+            })
+        return shape_analyze(analysis, self.state.analyze_shape, received)
+
+
+def start_stub(host="127.0.0.1", port=0, **options):
+    """
+    Startet den Stub in einem Daemon-Thread. Gibt (server, base_url) zurück.
+    options setzen die StubState-Felder (latency_ms, analyze_shape, ...);
+    server.RequestHandlerClass.state erlaubt Änderungen im laufenden Betrieb.
+    """
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState().configure(**options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/webhook"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokaler n8n-Stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5678)
+    parser.add_argument("--require-file", action="store_true", help="Thin-Payloads mit need_file beantworten")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Bearbeitungszeit je Anfrage")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Zufällige Abweichung der Latenz (±)")
+    parser.add_argument("--analyze-shape", choices=ANALYZE_SHAPES, default="status")
+    parser.add_argument("--last-shape", choices=LAST_SHAPES, default="rows")
+    parser.add_argument("--filler-rows", type=int, default=0, help="Unbrauchbare Zusatzzeilen in get-last")
+    parser.add_argument("--padding-kb", type=int, default=0, help="Füllfeld je Analyse in KB")
+    parser.add_argument("--recommendations", type=int, default=1, help="Empfehlungen je Analyse")
+    args = parser.parse_args()
+    state = StubState().configure(
+        require_file=args.require_file, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        analyze_shape=args.analyze_shape, last_shape=args.last_shape, filler_rows=args.filler_rows,
+        padding_kb=args.padding_kb, recommendations=args.recommendations)
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"n8n-Stub läuft: N8N_BASE_URL=http://{args.host}:{args.port}/webhook")
+    server.serve_forever()
@@ -0,0 +1,123 @@
+import json, math, os
+
+# ========== KONFIGURATION ==========
+# auto = orjson, falls installiert, sonst stdlib json; stdlib/orjson erzwingen das Backend
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def _has_nonfinite(obj):
+    """NaN/Infinity irgendwo in obj (dicts, Listen, numpy-Werte über tolist)."""
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if o is None or isinstance(o, (str, int)):
+            continue
+        if isinstance(o, float):
+            if not math.isfinite(o):
+                return True
+        elif isinstance(o, dict):
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif getattr(o, "dtype", None) is not None and o.dtype.kind == "f" and hasattr(o, "tolist"):
+            stack.append(o.tolist())
+    return False
+
+
+def _numpy_default(o):
+    # numpy-Skalare und -Arrays wie bei orjson mit OPT_SERIALIZE_NUMPY
+    if hasattr(o, "tolist"):
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class StdlibJSON:
+    """Standardbibliothek; langsamer, versteht aber auch NaN/Infinity und beliebig große Zahlen."""
+    name = "stdlib"
+
+    def dumps(self, obj, pretty=False, default=None):
+        default = default or _numpy_default
+        if pretty:
+            return json.dumps(obj, ensure_ascii=False, indent=2, default=default)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default)
+
+    def dumpb(self, obj, pretty=False, default=None):
+        return self.dumps(obj, pretty, default).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonJSON:
+    """
+    orjson (C/Rust). Schreibt immer UTF-8 und numpy-Werte direkt. Was orjson nicht
+    kann, geht an stdlib json: Ganzzahlen über 64 Bit, NaN/Infinity beim Lesen und beim
+    Schreiben (orjson machte daraus stillschweigend null).
+    """
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        self._fallback = StdlibJSON()
+
+    def dumpb(self, obj, pretty=False, default=None):
+        options = self._options | (self._orjson.OPT_INDENT_2 if pretty else 0)
+        try:
+            data = self._orjson.dumps(obj, default=default, option=options)
+        except TypeError:
+            return self._fallback.dumpb(obj, pretty, default)
+        # Ohne null in der Ausgabe war auch kein NaN/Infinity dabei; nur dann das Objekt prüfen
+        if b"null" in data and _has_nonfinite(obj):
+            return self._fallback.dumpb(obj, pretty, default)
+        return data
+
+    def dumps(self, obj, pretty=False, default=None):
+        return self.dumpb(obj, pretty, default).decode("utf-8")
+
+    def loads(self, data):
+        try:
+            return self._orjson.loads(data)
+        except self._orjson.JSONDecodeError:
+            return self._fallback.loads(data)
+
+
+def load_backend(name=JSON_BACKEND):
+    if name == "stdlib":
+        return StdlibJSON()
+    try:
+        return OrjsonJSON()
+    except ImportError:
+        if name == "orjson":
+            raise
+        return StdlibJSON()
+
+
+backend = load_backend()
+
+
+def dumps(obj, pretty=False, default=None):
+    """JSON als str, kompakt (pretty=True: 2 Leerzeichen Einrückung), Umlaute unverändert."""
+    return backend.dumps(obj, pretty, default)
+
+
+def dumpb(obj, pretty=False, default=None):
+    """Wie dumps, als UTF-8-Bytes (für Dateien und Request-Bodies ohne Umweg über str)."""
+    return backend.dumpb(obj, pretty, default)
+
+
+def loads(data):
+    """str oder bytes nach Python; Fehler als ValueError (JSONDecodeError)."""
+    return backend.loads(data)
+
+
+def response_json(response):
+    """Ersatz für response.json(): dekodiert den Body mit dem schnellen Backend."""
+    try:
+        return loads(response.content)
+    except ValueError:
+        # z. B. Nicht-UTF-8-Body: requests kennt die Zeichensatz-Erkennung
+        return response.json()
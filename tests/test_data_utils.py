@@ -0,0 +1,30 @@
+from data_utils import extract_json_from_markdown, extract_json_from_markdown_debug, iter_json_objects
+
+
+def test_truncated_outer_object_yields_nothing():
+    # Nicht das innere Objekt einer abgeschnittenen Antwort liefern
+    assert extract_json_from_markdown_debug('Hier {"metrics": {"belegt": 5}, "x": [1,2', debug=False) == (None, [])
+    assert extract_json_from_markdown('{"a": {"b": 1}') is None
+
+
+def test_nested_object_is_returned_whole():
+    text = 'Ergebnis:\n```json\n{"metrics": {"belegt": 5, "frei": [1, 2]}, "recommendations": ["a"]}\n```'
+    assert extract_json_from_markdown(text) == {"metrics": {"belegt": 5, "frei": [1, 2]}, "recommendations": ["a"]}
+
+
+def test_braces_and_escapes_inside_strings():
+    text = 'x {"a": "}{\\"", "b": {"c": "\\\\"}} y'
+    assert extract_json_from_markdown(text) == {"a": '}{"', "b": {"c": "\\"}}
+
+
+def test_failed_span_resumes_after_its_end():
+    text = 'Menge {a, {"inner": 1}} dann {"ok": true}'
+    errors = []
+    found = [obj for _, _, obj in iter_json_objects(text, errors)]
+    assert found == [{"ok": True}]
+    assert [start for start, _ in errors] == [text.index("{a")]
+
+
+def test_multiple_top_level_objects_and_stray_braces():
+    text = '} {"a": 1} text {"b": 2}'
+    assert [obj for _, _, obj in iter_json_objects(text)] == [{"a": 1}, {"b": 2}]
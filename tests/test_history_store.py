@@ -0,0 +1,41 @@
+import pytest
+
+from history_store import HistoryStore, SqliteHistoryStore
+
+
+def _store(tmp_path):
+    store = HistoryStore(tmp_path)
+    for ts in ("2024-01-03T10:00:00", "2024-01-01T09:00:00", None, "2024-01-02T12:00:00", "2024-01-02T08:00:00"):
+        entry = {"data": {"belegt": 1}}
+        if ts:
+            entry["ts"] = ts
+        store.append("t", entry)
+    with open(tmp_path / ".history_t.jsonl", "ab") as f:
+        f.write(b"{kaputt\n")
+    store.append("t", {"ts": "2024-01-02T08:00:00", "data": {"belegt": 2}})
+    return store
+
+
+def test_range_sorted_by_ts_with_stable_ties(tmp_path):
+    store = _store(tmp_path)
+    got = store.range("t", "2024-01-02", "2024-01-03")
+    assert [(e["ts"], e["data"]["belegt"]) for e in got] == [
+        ("2024-01-02T08:00:00", 1), ("2024-01-02T08:00:00", 2), ("2024-01-02T12:00:00", 1)]
+
+
+def test_range_matches_full_scan(tmp_path):
+    store = _store(tmp_path)
+    for start, end, limit in ((None, None, None), (None, "2024-01-02", 2), ("2024-01-01T09:00:00", None, 3),
+                              (None, None, 6), ("2025-01-01", None, None)):
+        assert store.range("t", start, end, limit) == store._range_scan("t", start, end, limit)
+
+
+@pytest.mark.parametrize("backend", [HistoryStore, SqliteHistoryStore])
+def test_latest_is_newest_by_ts(tmp_path, backend):
+    store = backend(directory=tmp_path)
+    for ts, belegt in (("2024-03-01", 1), ("2024-01-01", 2), ("2024-02-01", 3), ("2024-03-01", 4)):
+        store.append("t", {"ts": ts, "data": {"belegt": belegt}})
+    got = [(e["ts"], e["data"]["belegt"]) for e in store.latest("t", 3)]
+    assert got == [("2024-03-01", 4), ("2024-03-01", 1), ("2024-02-01", 3)]
+    assert [e["ts"] for e in store.latest("t", 2)] == ["2024-03-01", "2024-03-01"]
+    assert store.latest("t", 0) == []
@@ -0,0 +1,46 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import ingest
+from ingest import _NamedBuffer, read_all_metrics
+
+
+def _files():
+    header = "belegt,frei,vertragsdauer_durchschnitt,social_google,Kundenherkunft,Zahlungsstatus\n"
+    rows = ["1,0,5.5,80,Online,bezahlt\n", "0,1,7.0,20,Empfehlung,offen\n", "1,0,3.0,55,,überfällig\n"]
+    files = [_NamedBuffer(f"f{i}.csv", (header + "".join(rows[i:] + rows[:i]) * (i + 1)).encode()) for i in range(3)]
+    return files + [_NamedBuffer("kaputt.csv", b"belegt\nx\n")]
+
+
+def _read(files, workers):
+    warnings = []
+    merged, per_file = read_all_metrics(files, workers=workers, warn=warnings.append, per_file=True)
+    return merged, per_file, warnings
+
+
+def test_parallel_matches_serial(monkeypatch):
+    monkeypatch.setattr(ingest, "PARALLEL_MIN_MB", 0)
+    assert _read(_files(), workers=2) == _read(_files(), workers=1)
+
+
+class _BrokenPool:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_exception(BrokenProcessPool("Worker beendet"))
+        return future
+
+
+def test_broken_pool_falls_back_to_serial(monkeypatch):
+    monkeypatch.setattr(ingest, "PARALLEL_MIN_MB", 0)
+    expected = _read(_files(), workers=1)
+    monkeypatch.setattr(ingest, "ProcessPoolExecutor", _BrokenPool)
+    assert _read(_files(), workers=2) == expected
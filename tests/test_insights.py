@@ -0,0 +1,53 @@
+import random
+
+import pandas as pd
+
+from insights import build_insights, build_insights_batch
+
+_TOP = ("belegt", "frei", "belegungsgrad", "vertragsdauer_durchschnitt", "social_google", "social_facebook")
+_NESTED = {"zahlungsstatus": ("bezahlt", "offen", "überfällig"),
+           "kundenherkunft": ("Online", "Empfehlung", "Vorbeikommen")}
+
+
+def _value(rng):
+    return rng.choice((None, float("nan"), "nan", "x", " 12 ", "7.9", True, 0, 0.0, 4, 5, 5.5, 59, 60,
+                       84, 85, 89.99, 90, 95, 200, 201, -3, rng.uniform(-10, 300)))
+
+
+def _snapshot(rng, drop):
+    data = {k: _value(rng) for k in _TOP if rng.random() >= drop}
+    if rng.random() < 0.3:
+        # tot == 0: belegungsgrad entscheidet über occ
+        data.update(belegt=0, frei=0)
+    for key, fields in _NESTED.items():
+        if rng.random() < 0.1:
+            data[key] = None
+        elif rng.random() >= drop:
+            data[key] = {f: _value(rng) for f in fields if rng.random() >= drop}
+    return data
+
+
+def _batch_ids(frame, n):
+    got = build_insights_batch(frame).groupby("row")["id"].apply(list).to_dict()
+    return [got.get(i, []) for i in range(n)]
+
+
+def test_batch_matches_scalar_per_record():
+    rng = random.Random(19)
+    records = [_snapshot(rng, drop=0.15) for _ in range(3000)]
+    assert _batch_ids(records, len(records)) == [[t["id"] for t in build_insights(d)] for d in records]
+
+
+def test_batch_matches_scalar_on_dataframe():
+    # Alle Spalten vorhanden; object-Spalten halten None und NaN auseinander
+    rng = random.Random(20)
+    records = [_snapshot(rng, drop=0) for _ in range(1000)]
+    frame = pd.DataFrame(records, dtype=object)
+    assert _batch_ids(frame, len(records)) == [[t["id"] for t in build_insights(d)] for d in records]
+
+
+def test_nan_occupancy_is_kept_in_float_column():
+    frame = pd.DataFrame({"belegt": [0, 0], "frei": [0, 0], "belegungsgrad": [float("nan"), 50.0]})
+    expected = [[t["id"] for t in build_insights(d)] for d in frame.to_dict("records")]
+    assert expected[0] == ["reviews", "referral"]
+    assert _batch_ids(frame, 2) == expected
@@ -0,0 +1,27 @@
+import math
+
+import numpy as np
+import pytest
+
+from serialization import StdlibJSON, load_backend
+
+
+@pytest.fixture(params=["stdlib", "orjson"])
+def backend(request):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    return load_backend(request.param)
+
+
+def test_nonfinite_floats_round_trip(backend):
+    obj = {"belegungsgrad": float("nan"), "kpis": [1.5, float("inf")], "reihe": np.array([1.0, -np.inf]),
+           "skalar": np.float32("nan"), "text": "null"}
+    got = backend.loads(backend.dumpb(obj))
+    assert math.isnan(got["belegungsgrad"]) and math.isnan(got["skalar"])
+    assert got["kpis"] == [1.5, math.inf] and got["reihe"] == [1.0, -math.inf]
+    assert got["text"] == "null"
+
+
+def test_finite_output_matches_stdlib(backend):
+    obj = {"a": None, "b": [1, 2.5, "ä"], "c": {"d": np.arange(3)}}
+    assert backend.loads(backend.dumpb(obj)) == StdlibJSON().loads(StdlibJSON().dumpb(obj))